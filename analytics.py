@@ -0,0 +1,151 @@
+import time
+import numpy as np
+from datetime import datetime
+
+import columnar
+from settings import ANALYTICS_WINDOW_DAYS, PRICE_DROP_PERCENT
+
+DAY = 24 * 60 * 60
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def now_seconds(now=None) -> int:
+    """
+    'now' ('%Y-%m-%d %H:%M:%S' local time, as timestamps of database) in seconds of numpy datetime64[s]
+    """
+
+    now = now or time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+    return int(np.datetime64(now, 's').astype(np.int64))
+
+
+def groups(*keys) -> tuple:
+    """
+    Starts and ends (indexes) of groups of equal keys of sorted arrays
+    """
+
+    n = len(keys[0])
+    if not n:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    changed = np.zeros(n - 1, dtype=bool)
+    for key in keys:
+        changed |= key[1:] != key[:-1]
+    ends = np.append(np.nonzero(changed)[0], n - 1)
+    starts = np.insert(ends[:-1] + 1, 0, 0)
+    return starts, ends
+
+
+def price_stats(history: dict, now=None, window=ANALYTICS_WINDOW_DAYS) -> dict:
+    """
+    Stats of price of each product by its history (load(db, 'prices_history')): latest and previous price,
+    change of latest price from previous, %, min and max price for 'window' days to 'now' (with the price, which
+    was actual at the start of window)
+    return {'code': array, 'latest': array, 'previous': array, 'change': array, 'min': array, 'max': array}, nan to
+    'previous' and 'change' of items with one price, nan to 'change' after zero price
+    """
+
+    code, price = history['code'], history['price'].astype(np.float64)
+    seconds = history['timestamp'].astype(np.int64)
+    starts, ends = groups(code)
+    latest = price[ends]
+    previous = np.where(ends > starts, price[ends - 1], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.where(previous > 0, (latest - previous) / previous * 100, np.nan)
+
+    start = now_seconds(now) - window * DAY
+    same_next = np.append(code[1:] == code[:-1], False)
+    next_seconds = np.append(seconds[1:], np.iinfo(np.int64).max)
+    # row is actual in the window, if it is the last row of item or the next row is in the window
+    in_window = ~same_next | (next_seconds >= start)
+    low = np.minimum.reduceat(np.where(in_window, price, np.inf), starts) if len(starts) else latest
+    high = np.maximum.reduceat(np.where(in_window, price, -np.inf), starts) if len(starts) else latest
+
+    return {'code': code[ends], 'latest': latest, 'previous': previous, 'change': change, 'min': low, 'max': high}
+
+
+def price_drops(stats: dict, percent=PRICE_DROP_PERCENT) -> np.ndarray:
+    """
+    Codes of items with latest price lower than previous by 'percent' % and more (see price_stats())
+    """
+
+    with np.errstate(invalid='ignore'):
+        return stats['code'][stats['change'] <= -percent]
+
+
+def days_in_stock(history: dict, now=None, window=ANALYTICS_WINDOW_DAYS) -> dict:
+    """
+    Days in stock (count > 0) of each size of each product in each shop for 'window' days to 'now', by its history
+    (load(db, 'instock_history'))
+    return {'code': array, 'shop': array, 'size': array, 'days': array}
+    """
+
+    order = np.lexsort((history['rating'], history['size'], history['shop'], history['code']))
+    code, shop, size = history['code'][order], history['shop'][order], history['size'][order]
+    count, seconds = history['count'][order], history['timestamp'][order].astype(np.int64)
+    starts, ends = groups(code, shop, size)
+
+    end = now_seconds(now)
+    start = end - window * DAY
+    last = np.zeros(len(code), dtype=bool)
+    last[ends] = True
+    # each row is actual to the next row of the same size, the last row-- to now
+    until = np.where(last, end, np.append(seconds[1:], end))
+    duration = np.clip(np.minimum(until, end) - np.maximum(seconds, start), 0, None)
+    days = np.add.reduceat(np.where(count > 0, duration, 0), starts) / DAY if len(starts) else np.array([])
+
+    return {'code': code[ends], 'shop': shop[ends], 'size': size[ends], 'days': days}
+
+
+def load(db, table: str) -> dict:
+    """
+    Load 'prices_history' or 'instock_history' from database to numpy arrays (see columnar.read())
+    """
+
+    return columnar.read(db, table)
+
+
+def seconds_python(timestamp: str) -> float:
+
+    return (datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S') - EPOCH).total_seconds()
+
+
+def price_stats_python(history: dict, now=None, window=ANALYTICS_WINDOW_DAYS) -> dict:
+    """
+    The same as price_stats() by python loops with SQLite.get_prices_history() result, to benchmark and tests
+    return {code: (latest, previous, change, min, max)}
+    """
+
+    start = seconds_python(now or time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())) - window * DAY
+    stats = dict()
+    for code, rows in history.items():
+        latest = rows[-1][1]
+        previous = rows[-2][1] if len(rows) > 1 else None
+        change = (latest - previous) / previous * 100 if previous else None
+        prices = [price for i, (timestamp, price, rating) in enumerate(rows)
+                  if i == len(rows) - 1 or seconds_python(rows[i + 1][0]) >= start]
+        stats[code] = (latest, previous, change, min(prices), max(prices))
+
+    return stats
+
+
+def days_in_stock_python(histories: dict, now=None, window=ANALYTICS_WINDOW_DAYS) -> dict:
+    """
+    The same as days_in_stock() by python loops with {shop: SQLite.get_instock_history(shop)}, to benchmark and tests
+    return {(code, shop, size): days}
+    """
+
+    end = seconds_python(now or time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()))
+    start = end - window * DAY
+    days = dict()
+    for shop, history in histories.items():
+        for code, sizes in history.items():
+            for size, rows in sizes.items():
+                total = 0
+                for i, (timestamp, count, rating) in enumerate(rows):
+                    since = seconds_python(timestamp)
+                    until = seconds_python(rows[i + 1][0]) if i + 1 < len(rows) else end
+                    if count > 0:
+                        total += max(0, min(until, end) - max(since, start))
+                days[(code, shop, size)] = total / DAY
+
+    return days
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import hashlib
+from aiohttp import web
+
+from db import SQLite
+from settings import SHOPS, DB_NAME, API_HOST, API_PORT, API_CACHE_SIZE
+
+
+class Api:
+    """
+    Local HTTP/ JSON service of database to marketplace integration instead of export files:
+    GET /cards?brand=<brand> -- cards description with actual price (as Main.export()), of all items or of the brand
+    GET /cards/<code> -- card of one item
+    GET /prices?brand=<brand> -- actual price of each item, of all items or of the brand
+    GET /prices/<code> -- actual price of one item
+    GET /available/<code> -- sizes in stock and its count in each offline shop
+    Responses are cached in memory and have ETag with the version of data: new version is set by each write to database
+    (see SQLite.changed()), so 'If-None-Match' request returns 304 until the next sync.
+    Use:
+        ./api.py --port 8080
+    or:
+        web.run_app(Api().app())
+    """
+
+    def __init__(self, db_name=None, cache_size=API_CACHE_SIZE):
+
+        # own connection to db, settings.DB_NAME as default: brand filter of requests (see by_brand()) doesn't change
+        # the single instance of other users of the default database (Main in the same process)
+        self.db = SQLite(db_name or DB_NAME)
+        self.cache_size = cache_size
+        self.responses = dict()  # {path with query: (etag, body)} of the current version of data
+        self.index = dict()  # {'prices': {code: PriceObservation}, shop: {code: {size: count}}} of the current version
+        self.version = None
+
+    def app(self):
+
+        app = web.Application()
+        app.router.add_get('/cards', self.cards)
+        app.router.add_get('/cards/{code:\\d+}', self.cards)
+        app.router.add_get('/prices', self.prices)
+        app.router.add_get('/prices/{code:\\d+}', self.prices)
+        app.router.add_get('/available/{code:\\d+}', self.available)
+        return app
+
+    def check_version(self):
+        """
+        Drop cached responses and last state of tables (SQLite.cache), if database was changed by other process
+        """
+
+        version = self.db.get_state('version', '')
+        if version != self.version:
+            self.version = version
+            self.responses.clear()
+            self.index.clear()
+            self.db.cache.clear()
+
+    def respond(self, request, build):
+        """
+        Cached response of 'build'(request) result in json, 304 if ETag of client is actual, 404 to None result
+        """
+
+        self.check_version()
+        key = request.path_qs
+        if key not in self.responses:
+            data = build(request)
+            if data is None:
+                raise web.HTTPNotFound()
+            body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            etag = '"{}"'.format(hashlib.md5((self.version + key).encode()).hexdigest())
+            if len(self.responses) >= self.cache_size:
+                self.responses.clear()
+            self.responses[key] = (etag, body)
+        etag, body = self.responses[key]
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='application/json', headers={'ETag': etag})
+
+    def prices_index(self) -> dict:
+        """
+        Actual price of each item by its code, built once by version of data
+        """
+
+        if 'prices' not in self.index:
+            self.index['prices'] = {price.code: price for price in self.db.get_last_update_prices()}
+        return self.index['prices']
+
+    def instock_index(self, shop) -> dict:
+        """
+        Sizes in stock and its count of each item of the shop by its code, built once by version of data
+        """
+
+        if shop not in self.index:
+            index = dict()
+            for item in self.db.get_instock_last_update(shop):
+                if item.count != 0:
+                    index.setdefault(item.code, dict())[item.size] = item.count
+            self.index[shop] = index
+        return self.index[shop]
+
+    def by_brand(self, request, function):
+        """
+        Call database method with brand filter of request ('brand' query parameter)
+        """
+
+        self.db.brand = request.query.get('brand')
+        try:
+            return function()
+        finally:
+            self.db.brand = None
+
+    async def cards(self, request):
+
+        def build(request):
+            if 'code' in request.match_info:
+                cards = self.db.export_card_and_price(int(request.match_info['code']))
+                return cards[0]._asdict() if cards else None
+            return [card._asdict() for card in self.by_brand(request, self.db.export_card_and_price)]
+
+        return self.respond(request, build)
+
+    async def prices(self, request):
+
+        def build(request):
+            if 'code' in request.match_info:
+                price = self.prices_index().get(int(request.match_info['code']))
+                return price._asdict() if price is not None else None
+            return [price._asdict() for price in self.by_brand(request, self.db.get_last_update_prices)]
+
+        return self.respond(request, build)
+
+    async def available(self, request):
+
+        def build(request):
+            code = int(request.match_info['code'])
+            available = dict()
+            for shop in SHOPS:
+                sizes = self.instock_index(shop).get(code)
+                if sizes:
+                    available[shop] = dict(sorted(sizes.items()))
+            return available
+
+        return self.respond(request, build)
+
+
+if __name__ == '__main__':
+    # command line: ./api.py [--port 8080] [--db other.sqlite3]
+    args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+    web.run_app(Api(args.get('--db')).app(), host=API_HOST, port=int(args.get('--port', API_PORT)))
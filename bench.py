@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+import db
+import main
+import analytics
+import parser
+from db import create_database, INSTOCK_TABLES
+from parser import Parser
+from known import product_url
+from records import Product
+from mock import MockKant, ID_OFFSET
+from settings import BRANDS_URLS, BRANDS, SHOPS
+
+# modules, which should be imported only by commands needed them
+HEAVY_MODULES = ('asyncio', 'aiohttp', 'lxml.html', 'lxml.etree', 'parser')
+
+# code of each command of main.py up to its work: export and compact of empty database, parser and event loop to sync
+STARTUP = '''
+import sys, json
+import main
+main.DEBUG = False
+page = main.Main(db_name=sys.argv[1])
+if sys.argv[2] in ('products', 'prices', 'instock'):
+    page.parser, page.loop
+elif sys.argv[2] == 'compact':
+    page.db.compact()
+else:
+    page.export(sys.argv[2], sys.argv[3])
+print(json.dumps([name for name in {} if name in sys.modules]))
+'''.format(HEAVY_MODULES)
+
+# US sizes of synthetic 'instock_...' history
+SIZES = (7.0, 7.5, 8.0, 8.5, 9.0, 9.5, 10.0, 10.5, 11.0, 11.5, 12.0)
+
+
+def percentile(values: list, p: float) -> float:
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class FetchTiming:
+    """
+    Wrapper of Parser.fetch to measure latency of each request and downloaded bytes
+    """
+
+    def __init__(self):
+
+        self.fetch = None
+        self.latencies = list()
+        self.bytes = 0
+        self.errors = 0
+
+    def __enter__(self):
+
+        self.fetch = Parser.fetch
+
+        async def fetch(url, params=None):
+            start = time.perf_counter()
+            html = await self.fetch(url, params)
+            self.latencies.append(time.perf_counter() - start)
+            self.bytes += len(html)
+            self.errors += not html
+            return html
+
+        Parser.fetch = staticmethod(fetch)
+        return self
+
+    def __exit__(self, *args):
+
+        Parser.fetch = staticmethod(self.fetch)
+
+
+async def measure(name: str, concurrency: int, coroutine) -> tuple:
+    """
+    Run parse coroutine, return (its result, report of run)
+    """
+
+    cpu, start = time.process_time(), time.perf_counter()
+    with FetchTiming() as timing:
+        result = await coroutine
+    seconds = time.perf_counter() - start
+    requests = len(timing.latencies)
+    report = {'function': name, 'concurrency': concurrency, 'items': len(result), 'requests': requests,
+              'errors': timing.errors, 'bytes': timing.bytes, 'seconds': round(seconds, 4),
+              'pages_per_sec': round(requests / seconds, 2) if seconds else 0.0,
+              'p50_ms': round(percentile(timing.latencies, 50) * 1000, 3),
+              'p99_ms': round(percentile(timing.latencies, 99) * 1000, 3),
+              'cpu_sec': round(time.process_time() - cpu, 4)}
+    return result, report
+
+
+async def bench_parser(concurrency=(5, 10, 20), latency=0.005, jitter=0.002, error_rate=0.0, pages=5,
+                       listings=3, items=200, timeout=0.0) -> list:
+    """
+    Throughput of Parser.parse_main, parse_details, parse_price and parse_available against local mock of www.kant.ru
+    (see mock.MockKant) for each value of 'concurrency' (settings.CHUNK, parallel requests).
+    'listings'-- count of catalog urls from settings.BRANDS_URLS, 'pages' pages each;
+    'items'-- count of products to parse_details, parse_price and parse_available;
+    'timeout'-- pause between chunks of requests instead of settings.TIMEOUT
+    return list of reports, one to each function and concurrency
+    """
+
+    reports = list()
+    chunk, pause, debug = parser.CHUNK, parser.TIMEOUT, parser.DEBUG
+    parser.TIMEOUT, parser.DEBUG = timeout, False
+    host, Parser.host = Parser.host, None
+    try:
+        async with MockKant(pages=pages, latency=latency, jitter=jitter, error_rate=error_rate) as server:
+            Parser.host = server.host
+            for value in concurrency:
+                parser.CHUNK = value
+                tiles, report = await measure('parse_main', value,
+                                              Parser.parse_main(BRANDS_URLS[:listings], pages + 1))
+                reports.append(report)
+                ids = [tile.id for tile in tiles[:items]]
+                urls = [product_url(_id) for _id in ids]
+                products, report = await measure('parse_details', value, Parser.parse_details(urls))
+                reports.append(report)
+                codes_urls = [(_id - ID_OFFSET, url) for _id, url in zip(ids, urls)]
+                _, report = await measure('parse_price', value, Parser.parse_price(codes_urls))
+                reports.append(report)
+                codes = [(_id - ID_OFFSET, _id) for _id in ids]
+                _, report = await measure('parse_available', value, Parser.parse_available(codes))
+                reports.append(report)
+    finally:
+        parser.CHUNK, parser.TIMEOUT, parser.DEBUG = chunk, pause, debug
+        Parser.host = host
+
+    return reports
+
+
+def generate_db(file_name: str, products=5000, years=2, churn=0.02, dead=0.1, seed=0, first_id=3_000_000) -> dict:
+    """
+    Create database file (rewrite, if exists) with synthetic 'products' and its 'prices' and 'instock_...' history:
+    'products'-- count of products, urls and codes are the same as mock.MockKant product pages;
+    'years'-- length of history to now;
+    'churn'-- average changes of price (and count of each size in each shop) per day;
+    'dead'-- share of products, which are not in stock (rating 0);
+    'first_id'-- id of the first product url, as mock.MockKant.first_id
+    return rows count of each table
+    """
+
+    if os.path.isfile(file_name):
+        os.remove(file_name)
+    create_database(file_name)
+    conn = sqlite3.connect(file_name)
+    values = random.Random(seed)
+    end = time.time()
+    start = end - years * 365 * 24 * 60 * 60
+    events = years * 365 * churn  # average count of changes per product
+    stamp = lambda t: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+    rows = {'products': list(), 'prices': list()}
+    rows.update({shop: list() for shop in SHOPS})
+    count = {table: 0 for table in ['products', 'prices'] + list(INSTOCK_TABLES.values())}
+
+    def flush(limit=0):
+        for table, sql in (('products', "INSERT INTO products (code, brand, model, url, img, age, gender, year, "
+                                        "use, pronation, article, season, rating, timestamp) "
+                                        "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?);"),
+                           ('prices', "INSERT INTO prices (code_id, price, timestamp, rating) VALUES (?,?,?,?);")):
+            if len(rows[table]) > limit:
+                conn.executemany(sql, rows[table])
+                count[table] += len(rows[table])
+                rows[table] = list()
+        for shop in SHOPS:
+            if len(rows[shop]) > limit:
+                conn.executemany("INSERT INTO {} (code_id, size, count, timestamp, rating) VALUES (?,?,?,?,?);".format(
+                    INSTOCK_TABLES[shop]), rows[shop])
+                count[INSTOCK_TABLES[shop]] += len(rows[shop])
+                rows[shop] = list()
+
+    for i in range(products):
+        _id = first_id + i
+        code = _id - ID_OFFSET
+        brand = BRANDS[_id % len(BRANDS)]
+        created = values.uniform(start, end)
+        rows['products'].append(Product(code, brand, 'gel-model {}'.format(_id % 1000),
+                                        'https://www.kant.ru/catalog/product/{}/'.format(_id),
+                                        'https://www.kant.ru/upload/iblock/{}_small.jpg'.format(_id), 'взрослый',
+                                        'мужской', 2021, 'асфальт', 'нейтральная', '1011B{}-001'.format(_id % 1000),
+                                        'демисезон', int(values.random() >= dead), stamp(created)))
+        price = values.randrange(3000, 20000, 10)
+        times = sorted(values.uniform(created, end) for _ in range(1 + int(events * values.uniform(0, 2))))
+        for rating, moment in enumerate(times, 1):
+            rows['prices'].append((code, price, stamp(moment), rating))
+            price = max(0, price + values.randrange(-2000, 2000, 10))
+        for shop in SHOPS:
+            for size in values.sample(SIZES, values.randint(0, 6)):
+                times = sorted(values.uniform(created, end) for _ in range(1 + int(events * values.uniform(0, 1))))
+                for rating, moment in enumerate(times, 1):
+                    rows[shop].append((code, size, values.randint(0, 5), stamp(moment), rating))
+        flush(10000)
+    flush()
+    conn.commit()
+    conn.close()
+
+    return count
+
+
+def bench_sync(file_name: str, latency=0.0, churn=0.1, pages=5) -> list:
+    """
+    Time and peak memory (tracemalloc) of Main.update_products_table(), update_prices_table(), update_instock_table()
+    and export() to each format with database 'file_name' (see generate_db()) and local mock of www.kant.ru, which works
+    in its own thread
+    return list of reports, one to each phase
+    """
+
+    reports = list()
+    debug = main.DEBUG, parser.DEBUG, db.DEBUG
+    main.DEBUG = parser.DEBUG = db.DEBUG = False
+    pause, parser.TIMEOUT = parser.TIMEOUT, 0
+    server = MockKant(pages=pages, latency=latency, churn=churn).start_thread()
+    Parser.host = server.host
+    temp_dir = tempfile.mkdtemp()
+    page = main.Main(db_name=os.path.abspath(file_name))
+    phases = [('update_products_table', page.update_products_table),
+              ('update_prices_table', page.update_prices_table),
+              ('update_instock_table', page.update_instock_table)] + \
+             [('export_' + to, lambda to=to: page.export(to, os.path.join(temp_dir, 'card.' + to)))
+              for to in ('csv', 'json', 'xml')]
+    try:
+        for name, phase in phases:
+            requests = server.requests
+            tracemalloc.start()
+            start = time.perf_counter()
+            phase()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            reports.append({'phase': name, 'seconds': round(seconds, 4), 'peak_memory_mb': round(peak / 2 ** 20, 3),
+                            'requests': server.requests - requests})
+    finally:
+        server.stop_thread()
+        Parser.host = None
+        parser.TIMEOUT = pause
+        main.DEBUG, parser.DEBUG, db.DEBUG = debug
+        for name in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, name))
+        os.rmdir(temp_dir)
+        page.db.close()
+
+    return reports
+
+
+def bench_startup(commands=('products', 'prices', 'instock', 'compact', 'csv', 'json', 'xml'), repeat=5) -> list:
+    """
+    Startup time of main.py commands: new python process imports main.py and initialises only modules of the command
+    ('csv', 'json', 'xml'-- export to the format) with empty database, 'repeat' times each
+    return list of reports, one to each command: min and median time, heavy modules imported by command
+    """
+
+    reports = list()
+    temp_dir = tempfile.mkdtemp()
+    file_name = os.path.join(temp_dir, 'startup.sqlite3')
+    create_database(file_name)
+    cwd = os.path.dirname(os.path.abspath(main.__file__))
+    try:
+        for command in commands:
+            times = list()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, '-c', STARTUP, file_name, command,
+                                         os.path.join(temp_dir, 'card.' + command)],
+                                        cwd=cwd, capture_output=True, text=True, check=True).stdout
+                times.append(time.perf_counter() - start)
+            modules = json.loads([line for line in output.splitlines() if line.startswith('[')][-1])
+            reports.append({'command': command, 'min_sec': round(min(times), 4),
+                            'median_sec': round(percentile(times, 50), 4), 'modules': modules})
+    finally:
+        for name in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, name))
+        os.rmdir(temp_dir)
+
+    return reports
+
+
+def bench_analytics(file_name: str, window=30, repeat=3) -> list:
+    """
+    Time of price stats (analytics.price_stats()) and days in stock (analytics.days_in_stock()) of all items of database
+    'file_name' (see generate_db()) with numpy against the same python loops, both with load of history from database
+    return list of reports, one to each stats and way, best of 'repeat' runs
+    """
+
+    reports = list()
+    debug, db.DEBUG = db.DEBUG, False
+    database = db.SQLite(os.path.abspath(file_name))
+    now = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+    ways = (('price_stats', 'numpy',
+             lambda: analytics.price_stats(analytics.load(database, 'prices_history'), now, window)),
+            ('price_stats', 'python',
+             lambda: analytics.price_stats_python(database.get_prices_history(), now, window)),
+            ('days_in_stock', 'numpy',
+             lambda: analytics.days_in_stock(analytics.load(database, 'instock_history'), now, window)),
+            ('days_in_stock', 'python',
+             lambda: analytics.days_in_stock_python({shop: database.get_instock_history(shop) for shop in SHOPS}, now,
+                                                    window)))
+    try:
+        for name, way, function in ways:
+            times = list()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+            reports.append({'stats': name, 'way': way, 'seconds': round(min(times), 4)})
+    finally:
+        db.DEBUG = debug
+        database.close()
+
+    return reports
+
+
+def manager(args=None):
+    """
+    Command line:
+        ./bench.py parser --concurrency 5 10 20 --latency 0.005 --out bench_parser.json
+        ./bench.py generate --products 20000 --years 2 --churn 0.02 --db bench.sqlite3
+        ./bench.py sync --db bench.sqlite3 --latency 0 --churn 0.1 --out bench_sync.json
+        ./bench.py startup --repeat 5
+        ./bench.py analytics --db bench.sqlite3
+    Print report in json, or write it to '--out' file
+    """
+
+    arguments = argparse.ArgumentParser(description='Benchmarks of kant parser and database')
+    arguments.add_argument('suite', choices=['parser', 'generate', 'sync', 'startup', 'analytics'])
+    arguments.add_argument('--concurrency', type=int, nargs='+', default=[5, 10, 20])
+    arguments.add_argument('--latency', type=float, default=0.005, help='mock server latency, sec')
+    arguments.add_argument('--jitter', type=float, default=0.002, help='mock server latency jitter, sec')
+    arguments.add_argument('--errors', type=float, default=0.0, help='mock server error rate, from 0 to 1')
+    arguments.add_argument('--pages', type=int, default=5, help='pages of each catalog listing')
+    arguments.add_argument('--items', type=int, default=200, help='products to parse')
+    arguments.add_argument('--products', type=int, default=5000, help='products of generated database')
+    arguments.add_argument('--years', type=float, default=2, help='years of history of generated database')
+    arguments.add_argument('--churn', type=float, default=0.02, help='changes per product per day (mock: per request)')
+    arguments.add_argument('--db', default='bench.sqlite3', help='database file to generate and to sync')
+    arguments.add_argument('--repeat', type=int, default=5, help='runs of each command to startup suite')
+    arguments.add_argument('--out', help='json file to write report')
+    args = arguments.parse_args(args)
+
+    report = {'suite': args.suite, 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
+              'python': sys.version.split()[0]}
+    if args.suite == 'parser':
+        report['settings'] = {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.errors,
+                              'pages': args.pages, 'items': args.items}
+        report['results'] = asyncio.run(bench_parser(args.concurrency, args.latency, args.jitter, args.errors,
+                                                     args.pages, items=args.items))
+    elif args.suite == 'generate':
+        report['settings'] = {'products': args.products, 'years': args.years, 'churn': args.churn}
+        start = time.perf_counter()
+        report['results'] = generate_db(args.db, args.products, args.years, args.churn)
+        report['seconds'] = round(time.perf_counter() - start, 4)
+    elif args.suite == 'sync':
+        report['settings'] = {'db': args.db, 'latency': args.latency, 'churn': args.churn, 'pages': args.pages}
+        report['results'] = bench_sync(args.db, args.latency, args.churn, args.pages)
+    elif args.suite == 'analytics':
+        report['settings'] = {'db': args.db, 'repeat': args.repeat}
+        report['results'] = bench_analytics(args.db, repeat=args.repeat)
+    elif args.suite == 'startup':
+        report['settings'] = {'repeat': args.repeat}
+        report['results'] = bench_startup(repeat=args.repeat)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return report
+
+
+if __name__ == '__main__':
+    manager()
@@ -0,0 +1,81 @@
+from typing import NamedTuple
+
+from settings import BRANDS, BRANDS_URLS
+
+
+class Brand(NamedTuple):
+    """
+    Brand of settings.BRANDS: canonical name (as 'brand' column of 'products' table), its listing urls of
+    settings.BRANDS_URLS and lower case aliases: name and name of url ('361' of '361°')
+    """
+
+    name: str
+    urls: tuple
+    aliases: tuple
+
+
+def slug(url: str) -> str:
+    """
+    Brand name of listing url: '.../running-shoes/brand-asics/' or '.../brand/brooks/products/'
+    """
+
+    parts = [part for part in url.split('/') if part]
+    for i, part in enumerate(parts):
+        if part.startswith('brand-'):
+            return part[len('brand-'):]
+        if part == 'brand' and i + 1 < len(parts):
+            return parts[i + 1]
+    return ''
+
+
+def build() -> dict:
+    """
+    Registry of brands by settings, once on import
+    return {alias: Brand, ...}
+    """
+
+    slugs = {slug(url): url for url in BRANDS_URLS}
+    registry = dict()
+    for name in BRANDS:
+        key = ''.join(char for char in name.lower() if char.isalnum())  # '361°' -> '361'
+        aliases = tuple(sorted({name.lower(), key}))
+        brand = Brand(name, tuple(url for alias, url in slugs.items() if alias in aliases), aliases)
+        registry.update((alias, brand) for alias in aliases)
+    return registry
+
+
+REGISTRY = build()
+
+
+def get(name: str):
+    """
+    Brand by its name or alias of any case, None to unknown brand
+    """
+
+    return REGISTRY.get(name.lower().strip()) if name else None
+
+
+def select(names) -> tuple:
+    """
+    Canonical names of brands, without doubles: select(['asics', 'HOKA', 'Asics']) -> ('Asics', 'Hoka')
+    raise ValueError to unknown brand
+    """
+
+    if isinstance(names, str):
+        names = [names]
+    selected = list()
+    for name in names:
+        brand = get(name)
+        if brand is None:
+            raise ValueError('unknown brand {!r}, see settings.BRANDS'.format(name))
+        if brand.name not in selected:
+            selected.append(brand.name)
+    return tuple(selected)
+
+
+def urls(names) -> list:
+    """
+    Listing urls of brands (see select())
+    """
+
+    return [url for name in select(names) for url in REGISTRY[name.lower()].urls]
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+
+from db import EXPORT_TABLES
+from settings import COLUMNAR_CHUNK
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional dependency, export to numpy .npz without it
+    pyarrow = None
+
+# numpy types of columns of EXPORT_TABLES, other columns are str
+TYPES = {'code': np.int64, 'year': np.int64, 'rating': np.int64, 'price': np.int64, 'count': np.int64,
+         'size': np.float64, 'timestamp': 'datetime64[s]'}
+
+
+def chunks(columns: tuple, cursor, size=COLUMNAR_CHUNK):
+    """
+    Read rows of cursor by 'size' rows
+    yield {column: numpy array of chunk}
+    """
+
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        yield {column: np.array(values, dtype=TYPES.get(column, str)) for column, values in zip(columns, zip(*rows))}
+
+
+def arrays(columns: tuple, cursor, size=COLUMNAR_CHUNK) -> dict:
+    """
+    Read all rows of cursor by 'size' rows
+    return {column: numpy array}
+    """
+
+    values = {column: list() for column in columns}
+    for chunk in chunks(columns, cursor, size):
+        for column, array in chunk.items():
+            values[column].append(array)
+    return {column: np.concatenate(array) if array else np.array([], dtype=TYPES.get(column, str))
+            for column, array in values.items()}
+
+
+def read(db, table: str, size=COLUMNAR_CHUNK) -> dict:
+    """
+    Read table of db.EXPORT_TABLES from database
+    return {column: numpy array}
+    """
+
+    columns, cursor = db.export_columns(table)
+    try:
+        return arrays(columns, cursor, size)
+    finally:
+        cursor.close()
+
+
+def write_npz(file_name: str, columns: tuple, cursor, size=COLUMNAR_CHUNK) -> int:
+    """
+    Write table to .npz file: array to each column
+    return count of rows
+    """
+
+    table = arrays(columns, cursor, size)
+    np.savez(file_name, **table)
+    return len(table[columns[0]])
+
+
+def write_parquet(file_name: str, columns: tuple, cursor, size=COLUMNAR_CHUNK) -> int:
+    """
+    Write table to .parquet file: row group to each chunk
+    return count of rows
+    """
+
+    types = {np.int64: pyarrow.int64(), np.float64: pyarrow.float64(), 'datetime64[s]': pyarrow.timestamp('s')}
+    schema = pyarrow.schema([(column, types.get(TYPES.get(column), pyarrow.string())) for column in columns])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(file_name, schema) as writer:
+        for chunk in chunks(columns, cursor, size):
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(chunk[column], type=schema.field(column).type) for column in columns], schema=schema))
+            count += len(chunk[columns[0]])
+    return count
+
+
+def export(db, directory: str, to='parquet', size=COLUMNAR_CHUNK) -> dict:
+    """
+    Export 'products', actual 'prices', full 'prices_history' and 'instock_history' (see db.EXPORT_TABLES) to columnar
+    files '<directory>/<table>.parquet', if pyarrow is installed, or to numpy '<directory>/<table>.npz'
+    return {'format': 'parquet' or 'npz', 'rows': {table: count of rows}}
+    """
+
+    if to not in ('parquet', 'npz'):
+        raise ValueError("to must be 'parquet' or 'npz', not {!r}".format(to))
+    if to == 'parquet' and pyarrow is None:
+        to = 'npz'
+    os.makedirs(directory, exist_ok=True)
+    write = write_parquet if to == 'parquet' else write_npz
+    rows = dict()
+    for table in EXPORT_TABLES:
+        columns, cursor = db.export_columns(table)
+        rows[table] = write(os.path.join(directory, '{}.{}'.format(table, to)), columns, cursor, size)
+        cursor.close()
+
+    return {'format': to, 'rows': rows}
+
+
+def load(directory: str) -> dict:
+    """
+    Load exported tables from directory
+    return {table: {column: numpy array}}
+    """
+
+    tables = dict()
+    for table in EXPORT_TABLES:
+        file_name = os.path.join(directory, table)
+        if os.path.isfile(file_name + '.npz'):
+            with np.load(file_name + '.npz') as data:
+                tables[table] = {column: data[column] for column in data.files}
+        elif pyarrow is not None and os.path.isfile(file_name + '.parquet'):
+            data = pyarrow.parquet.read_table(file_name + '.parquet')
+            tables[table] = {column: data.column(column).to_numpy() for column in data.column_names}
+
+    return tables
@@ -1,8 +1,100 @@
+import time
 import sqlite3
 import os.path
 from pathlib import Path
 
-from settings import SHOPS, DB_NAME, RATING, DEBUG
+import brands
+from known import KnownIndex, url_id
+from sizes import EUR_MIN, JUNIOR, eur_to_us
+from records import Card, PriceObservation, StockObservation
+from metrics import metrics
+from settings import SHOPS, DB_NAME, RATING, DEBUG, RETENTION_DAYS, VACUUM_PAGES
+
+# 'instock_...' table names of each offline shop, same ordering as settings.SHOPS
+INSTOCK_TABLES = dict(zip(SHOPS, ('instock_nagornaya', 'instock_timiryazevskaya', 'instock_teply_stan',
+                                  'instock_altufevo')))
+
+# Tables structure of database (from Django project), to create new database file by create_database()
+SCHEMA = ['CREATE TABLE IF NOT EXISTS "products" ("code" integer NOT NULL PRIMARY KEY, "brand" varchar(20) NOT NULL, '
+          '"model" varchar(50) NOT NULL, "url" varchar(100) NOT NULL UNIQUE, "img" varchar(150) NOT NULL, '
+          '"age" varchar(20) NOT NULL, "gender" varchar(20) NOT NULL, "year" integer NOT NULL, '
+          '"use" varchar(20) NOT NULL, "pronation" varchar(30) NOT NULL, "article" varchar(30) NOT NULL, '
+          '"season" varchar(30) NOT NULL, "rating" smallint unsigned NOT NULL CHECK ("rating" >= 0), '
+          '"timestamp" datetime NOT NULL);',
+          'CREATE TABLE IF NOT EXISTS "prices" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, '
+          '"price" smallint unsigned NOT NULL CHECK ("price" >= 0), "timestamp" datetime NOT NULL, '
+          '"rating" smallint unsigned NOT NULL CHECK ("rating" >= 0), '
+          '"code_id" integer NOT NULL REFERENCES "products" ("code") DEFERRABLE INITIALLY DEFERRED);'] + \
+         ['CREATE TABLE IF NOT EXISTS "{}" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "size" decimal NOT NULL, '
+          '"count" smallint unsigned NOT NULL CHECK ("count" >= 0), "timestamp" datetime NOT NULL, '
+          '"rating" smallint unsigned NOT NULL CHECK ("rating" >= 0), '
+          '"code_id" integer NOT NULL REFERENCES "products" ("code") DEFERRABLE INITIALLY DEFERRED);'.format(table)
+          for table in INSTOCK_TABLES.values()]
+
+# Service tables of this project (not from Django project), created once, if not exists, on connect to database:
+# 'state'-- values to keep between runs, for example count of runs of Main.update_instock_table();
+# 'schedule'-- time of the last check of price ('prices' kind) and availability ('instock' kind) of each item, see
+# scheduler.py;
+# 'known'-- ids of urls of products of each brand, in stock and not in stock, see known.py
+SERVICE_TABLES = ['CREATE TABLE IF NOT EXISTS "state" ("key" varchar(50) NOT NULL PRIMARY KEY, "value" text NOT NULL);',
+                  'CREATE TABLE IF NOT EXISTS "schedule" ("code" integer NOT NULL, "kind" varchar(10) NOT NULL, '
+                  '"checked" datetime NOT NULL, PRIMARY KEY ("code", "kind"));',
+                  'CREATE TABLE IF NOT EXISTS "known" ("brand" varchar(20) NOT NULL, "instock" bool NOT NULL, '
+                  '"ids" blob NOT NULL, PRIMARY KEY ("brand", "instock"));']
+
+# Triggers of 'products' table: any write of brand, rating or url of product by any program (this project, Django
+# project, sqlite3 shell) increments 'products_version' in 'state' table, so the index of known products (see
+# known_index()) is never used with other rows of 'products'
+TRIGGERS = ['CREATE TRIGGER IF NOT EXISTS "products_version_{0}" AFTER {1} ON "products" BEGIN '
+            'INSERT OR REPLACE INTO "state" ("key", "value") VALUES (\'products_version\', '
+            'COALESCE((SELECT "value" FROM "state" WHERE "key" = \'products_version\'), 0) + 1); END;'.format(
+                name, event)
+            for name, event in (('insert', 'INSERT'), ('update', 'UPDATE OF brand, rating, url_id'),
+                                ('delete', 'DELETE'))]
+
+# Indexes to fast search of the actual state (max rating) and the state on any date (as- of queries) of the product.
+# Created once, if not exists, on connect to database
+INDEXES = ["CREATE INDEX IF NOT EXISTS prices_code_rating ON prices (code_id, rating);",
+           "CREATE INDEX IF NOT EXISTS prices_code_timestamp ON prices (code_id, timestamp, rating);"] + \
+          ["CREATE INDEX IF NOT EXISTS {0}_code_size_rating ON {0} (code_id, size, rating);".format(table)
+           for table in INSTOCK_TABLES.values()] + \
+          ["CREATE INDEX IF NOT EXISTS {0}_code_timestamp ON {0} (code_id, size, timestamp, rating);".format(table)
+           for table in INSTOCK_TABLES.values()] + \
+          ["CREATE INDEX IF NOT EXISTS products_brand_rating ON products (brand, rating);",  # partial work by brands
+           "CREATE INDEX IF NOT EXISTS products_url_id ON products (url_id);"]
+
+# Columns of this project added to tables of Django project, if not exists, on connect to database (see migrate()):
+# 'products.url_id'-- id of url of product '/catalog/product/<id>/' (see known.py): key of items of listing pages and
+# of availability request
+COLUMNS = {'products': {'url_id': 'integer'}}
+
+
+# Tables to columnar export (see columnar.py): name: (columns, sql). 'prices'-- actual price of each item,
+# 'prices_history' and 'instock_history'-- all rows, 'instock_history' of all shops with 'shop' column
+EXPORT_TABLES = {
+    'products': (('code', 'brand', 'model', 'url', 'img', 'age', 'gender', 'year', 'use', 'pronation', 'article',
+                  'season', 'rating', 'timestamp'),
+                 "SELECT code, brand, model, url, img, age, gender, year, use, pronation, article, season, rating, "
+                 "timestamp FROM products ORDER BY code;"),
+    'prices': (('code', 'price', 'timestamp', 'rating'),
+               "SELECT code_id, price, timestamp, MAX(rating) FROM prices GROUP BY code_id ORDER BY code_id;"),
+    'prices_history': (('code', 'price', 'timestamp', 'rating'),
+                       "SELECT code_id, price, timestamp, rating FROM prices ORDER BY code_id, rating;"),
+    'instock_history': (('code', 'shop', 'size', 'count', 'timestamp', 'rating'),
+                        " UNION ALL ".join("SELECT code_id, '{}', size, count, timestamp, rating FROM {}".format(
+                            shop, table) for shop, table in INSTOCK_TABLES.items()) + ";")}
+
+
+def create_database(file_name):
+    """
+    Create new database file with empty tables (see SCHEMA), to tests and benchmarks
+    """
+
+    conn = sqlite3.connect(file_name)
+    for sql in SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
 
 
 class SQLite:
@@ -17,31 +109,64 @@ class SQLite:
     -- export_... serialized and export items card description to json, xml, csv
     """
 
-    # protection from double connectors to database. sqlite3 module don't support 2 and more parallel connections
-    def __new__(cls):
+    # protection from double connectors to database. sqlite3 module don't support 2 and more parallel connections.
+    # Other database file ('db_name') is a separate instance: holders of the default database are not switched to it
+    def __new__(cls, db_name=None):
+        if db_name is not None:
+            return super(SQLite, cls).__new__(cls)
         if not hasattr(cls, 'instance'):
             cls.instance = super(SQLite, cls).__new__(cls)
 
         return cls.instance
 
-    def __init__(self):
+    def __init__(self, db_name=None):
         # to real path to 'db.sqlite3' file. If database file should be a parent dir,
         # set parent_dir = Path(__file__).resolve().parent.parent
+        # 'db_name'-- an optional other database file (absolute path or name in parent_dir), settings.DB_NAME as default
         parent_dir = Path(__file__).resolve().parent
-        self.db = os.path.join(parent_dir, DB_NAME)  # path + file with any OS
+        self.db = os.path.join(parent_dir, db_name or DB_NAME)  # path + file with any OS
         if os.path.isfile(self.db):
+            self.close()  # re- connect of the single instance of the default database
             self.conn = sqlite3.connect(self.db)
             self.cur = self.conn.cursor()
+            self.migrated = False  # connect only reads, schema of this project is checked by the first write, see next
             if DEBUG:
                 print('Database is working.')
         else:
             self.db = None  # re- forward to main.Main(). Look functionality on Main() class
             if DEBUG:
                 print('No access to database. :-(\nEdit DB_NAME in settings.py or edit SQLite.parent_dir correctly.')
-        self.brand = None  # may be this parameter will be replaced later from main.Main.__init__()
-        # if self.brand was recieved from main.Main(brand='your_working_brand_name'), in each methods
-        # from this SQLite() class, request to database will be only apply
-        # to a part of all data from db, within one brand name
+        # last state of tables in memory: 'products'-- {code: (url, rating)}, 'prices'-- {code: PriceObservation},
+        # shop-- {(code, size): StockObservation}. Filled by the first get_... call of full database (without brand),
+        # updated by to_... and update_... methods, so other get_... calls don't read full tables again
+        self.cache = dict()
+        self.known = None  # index of known products, see known_index()
+        self.known_version = self.data_version = None  # version of 'products', which the index is of, and of database
+        self.brands = None  # may be this parameter will be replaced later from main.Main.__init__()
+        # if self.brands was recieved from main.Main(brand='your_working_brand_name') or Main(brands=[...]), in each
+        # methods from this SQLite() class, request to database will be only apply
+        # to a part of all data from db, within these brand names (see brand_filter())
+
+    def brand_getter(self):
+
+        # one brand name, tuple of names of several brands, None to all brands
+        if self.brands is not None and len(self.brands) == 1:
+            return self.brands[0]
+        return self.brands
+
+    def brand_setter(self, name):
+
+        # canonical name of known brand (see brands.py), other name as is
+        self.brands = (brands.get(name).name if brands.get(name) else name, ) if name else None
+
+    brand = property(brand_getter, brand_setter)
+
+    def brand_filter(self, column='brand') -> str:
+        """
+        Part of WHERE clause by brands of partial work: 'brand IN (?,?)', its parameters-- self.brands
+        """
+
+        return '{} IN ({})'.format(column, ','.join('?' * len(self.brands)))
 
     def __del__(self):
 
@@ -52,31 +177,135 @@ class SQLite:
         if hasattr(self, 'cur') and hasattr(self, 'conn'):
             self.cur.close()
             self.conn.close()
+            del self.cur, self.conn  # closed once
 
             if DEBUG:
                 print('Close database.')
 
+    def fetch(self, record, sql, parameters=()):
+        """
+        Execute 'sql' by new cursor with 'record' row factory (see records.py)
+        return [record, record, ...]
+        """
+
+        cur = self.conn.cursor()
+        cur.row_factory = record.from_row
+        cur.execute(sql, parameters)
+        return cur.fetchall()
+
+    def create_service_tables(self):
+        """
+        Create service tables and triggers, if not exists (see SERVICE_TABLES, TRIGGERS)
+        """
+
+        for sql in SERVICE_TABLES + TRIGGERS:
+            self.cur.execute(sql)
+        self.conn.commit()
+
+    def migrate(self):
+        """
+        Create service tables, columns and indexes of this project, if not exists, once by connection. Called only by
+        writers: to_...() and update_...() methods, sync methods of main.Main, compact() and 'migrate' command of
+        main.py, so export and api.py work with database without writes and locks
+        """
+
+        if self.migrated:
+            return
+        self.create_service_tables()
+        self.add_columns()
+        self.create_indexes()
+        self.migrate_sizes()
+        self.migrated = True
+
+    def add_columns(self):
+        """
+        Add columns to tables (see COLUMNS), if not exists, and fill 'url_id' of products, written without it (old
+        database, or other program)
+        """
+
+        for table, columns in COLUMNS.items():
+            exists = {row[1] for row in self.cur.execute("PRAGMA table_info({});".format(table)).fetchall()}
+            for column, kind in columns.items():
+                if column not in exists:
+                    self.cur.execute('ALTER TABLE {} ADD COLUMN "{}" {};'.format(table, column, kind))
+        products = self.cur.execute("SELECT code, url FROM products WHERE url_id IS NULL;").fetchall()
+        if products:
+            self.cur.executemany("UPDATE products SET url_id = ? WHERE code = ?;",
+                                 [(url_id(url), code) for code, url in products])
+        self.conn.commit()
+
+    def migrate_sizes(self):
+        """
+        Convert EUR sizes of 'instock_...' tables, written as is before sizes.py, to US sizes by the chart of brand,
+        once by database ('sizes_version' in 'state' table). EUR sizes out of the chart and sizes, which have rows of
+        the same US size already, are kept as is, so no history of two sizes is joined
+        """
+
+        if self.get_state('sizes_version') == '1':
+            return
+        brands = dict(self.cur.execute("SELECT code, brand FROM products;").fetchall())
+        for table in INSTOCK_TABLES.values():
+            sizes = self.cur.execute("SELECT DISTINCT code_id, size FROM {};".format(table)).fetchall()
+            exists = set(sizes)
+            rows = list()
+            for code, size in sizes:
+                if EUR_MIN <= size < JUNIOR:
+                    us = eur_to_us(size, brands.get(code))
+                    if us != size and (code, us) not in exists:
+                        exists.add((code, us))
+                        rows.append((us, code, size))
+            self.cur.executemany("UPDATE {} SET size = ? WHERE code_id = ? AND size = ?;".format(table), rows)
+        self.update_state('sizes_version', 1)
+        self.conn.commit()
+        self.cache.clear()
+
+    def create_indexes(self):
+        """
+        Create indexes to 'prices' and 'instock_...' tables, if not exists (see INDEXES)
+        """
+
+        for sql in INDEXES:
+            self.cur.execute(sql)
+        self.conn.commit()
+
     def to_products(self, products: list):
         """
         Append main items description that will not change in the future (except 'rating' column for not in stock items)
         type of values:             (int,   str,  str,   str, str, str, str,    int,  str, str,      str, str, int, str)
         """
 
+        self.migrate()  # the first write of connection creates tables of this project, see migrate()
         sql = "INSERT INTO products (code, brand, model, url, img, age, gender, year, use, pronation, article, " \
-              "season, rating, timestamp) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?);"
-        self.cur.executemany(sql, products)
+              "season, rating, timestamp, url_id) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?);"
+        index = self.known_index()
+        ids = [url_id(item[3]) for item in products]
+        self.cur.executemany(sql, [tuple(item) + (_id, ) for item, _id in zip(products, ids)])
+        rows = self.cur.rowcount
+        for item, _id in zip(products, ids):
+            index.add(item[1], _id, item[12])
+        self.save_known()
         self.conn.commit()
-        return self.cur.rowcount
+        self.changed()
+        if 'products' in self.cache:
+            self.cache['products'].update((item[0], (item[3], item[12], _id)) for item, _id in zip(products, ids))
+        metrics.count('rows', rows)
+        return rows
 
     def to_prices(self, prices: list):
         """
         Update price if existing items or add new item price to 'prices' table to database
         """
 
+        self.migrate()  # the first write of connection creates tables of this project, see migrate()
         sql = "INSERT INTO prices (code_id, price, timestamp, rating) VALUES (?,?,?,?);"
         self.cur.executemany(sql, prices)
+        rows = self.cur.rowcount
         self.conn.commit()
-        return self.cur.rowcount
+        self.changed()
+        if 'prices' in self.cache:
+            self.cache['prices'].update((item[0], PriceObservation._make(item)) for item in prices)
+        metrics.count('rows', rows)
+        return rows
 
     def to_instock(self, shop, instock: list):
         """
@@ -84,6 +313,7 @@ class SQLite:
         'instock_nagornaya' table
         """
 
+        self.migrate()  # the first write of connection creates tables of this project, see migrate()
         table = ''
         if shop == SHOPS[0]:
             table = 'instock_nagornaya'
@@ -97,19 +327,36 @@ class SQLite:
         if table:
             sql = "INSERT INTO '{}' (code_id, size, count, timestamp, rating) VALUES (?,?,?,?,?);".format(table)
         self.cur.executemany(sql, instock)
+        rows = self.cur.rowcount
+        self.conn.commit()
+        self.changed()
+        if shop in self.cache:
+            self.cache[shop].update(((item[0], float(item[1])), StockObservation.from_row(None, item))
+                                    for item in instock)
+        metrics.count('rows', rows)
+        return rows
+
+    def to_schedule(self, kind: str, codes, timestamp: str):
+        """
+        Set the time of the last check of price ('prices' kind) or availability ('instock' kind) of products
+        """
+
+        self.migrate()  # the first write of connection creates tables of this project, see migrate()
+        self.cur.executemany("INSERT OR REPLACE INTO schedule (code, kind, checked) VALUES (?, ?, ?);",
+                             [(code, kind, timestamp) for code in codes])
         self.conn.commit()
-        return self.cur.rowcount
 
     def get_products_urls_rating_below_normal(self):
         """
         Return urls of not in stock items or has just appeared in stock item (after its rating=1 before)
         """
 
-        if self.brand is not None:
-            sql = "SELECT url FROM products WHERE brand='{}' AND rating < {};".format(self.brand, RATING)
+        if self.brands is not None:
+            sql = "SELECT url FROM products WHERE {} AND rating < {};".format(self.brand_filter(), RATING)
+            self.cur.execute(sql, self.brands)
         else:
             sql = "SELECT url FROM products WHERE rating < {};".format(RATING)
-        self.cur.execute(sql)
+            self.cur.execute(sql)
         urls = [i[0] for i in self.cur.fetchall()]
         return urls
 
@@ -122,53 +369,94 @@ class SQLite:
         codes = self.cur.fetchall()
         return codes
 
-    def get_products_code_url(self):
+    def get_products_code_url(self, not_instock=True):
         """
         Get pairs code (unic), link (unic) to operate (update or add new) 'prices' and 'instock_nagornaya' tables
+        'not_instock'-- with items, which dropped out of www.kant.ru (rating 0), after all items in stock
         """
 
-        if self.brand is not None:
-            sql = "SELECT code, url FROM products WHERE brand = '{}';".format(self.brand)
-        else:
-            sql = "SELECT code, url FROM products;"
-        self.cur.execute(sql)
+        return self._products_code('url', not_instock)
+
+    def get_products_code_id(self, not_instock=True):
+        """
+        Get pairs code, id of url (see known.py) to load availability of items to 'instock_...' tables, the same
+        ordering as get_products_code_url()
+        """
+
+        return self._products_code('url_id', not_instock)
+
+    def _products_code(self, column: str, not_instock: bool) -> list:
+
+        if self.brands is None:
+            if 'products' in self.cache:
+                metrics.count('cache_hits')
+            else:
+                self.cur.execute("SELECT code, url, rating, url_id FROM products;")
+                self.cache['products'] = {code: (url, rating, _id) for code, url, rating, _id in self.cur.fetchall()}
+            products = sorted(self.cache['products'].items(), key=lambda item: item[1][1] == 0)  # in stock first
+            value = 2 if column == 'url_id' else 0
+            return [(code, item[value]) for code, item in products if not_instock or item[1] >= RATING]
+
+        where = [self.brand_filter()]
+        if not not_instock:
+            where.append("rating >= {}".format(RATING))
+        sql = "SELECT code, {} FROM products WHERE {} ORDER BY rating = 0;".format(column, ' AND '.join(where))
+        self.cur.execute(sql, self.brands)
         codes = self.cur.fetchall()
         return codes
 
+    def get_products_brand(self) -> dict:
+        """
+        Brand of each product to its size chart (see sizes.py)
+        return {code: brand, ...}
+        """
+
+        if self.brands is not None:
+            sql = "SELECT code, brand FROM products WHERE {};".format(self.brand_filter())
+            return dict(self.cur.execute(sql, self.brands).fetchall())
+        return dict(self.cur.execute("SELECT code, brand FROM products;").fetchall())
+
     def get_products_urls(self):
         """
         Get the product link
         Need to operate 'products' table changes of items
         """
 
-        if self.brand is not None:
-            sql = "SELECT url FROM products WHERE brand='{}' AND rating >= {};".format(self.brand, RATING)
+        if self.brands is not None:
+            sql = "SELECT url FROM products WHERE {} AND rating >= {};".format(self.brand_filter(), RATING)
+            self.cur.execute(sql, self.brands)
         else:
             sql = "SELECT url FROM products WHERE rating >= {};".format(RATING)
-        self.cur.execute(sql)
+            self.cur.execute(sql)
         urls = [i[0] for i in self.cur.fetchall()]
         return urls
 
     def get_last_update_prices(self):
         """
         Get last update actual price of the product by its code
+        return [PriceObservation(code, price, timestamp, rating), ...]
         """
 
-        if self.brand is not None:
-            sql = "SELECT prod.code, p.price, p.timestamp, p.rating " \
-                "FROM prices AS p, products AS prod " \
-                "ON prod.code = p.code_id " \
-                "WHERE prod.brand = '{}' " \
-                "GROUP BY p.code_id " \
-                "ORDER BY -max(p.rating);".format(self.brand)
-        else:
-            sql = "SELECT code_id, price, timestamp, rating FROM prices GROUP BY code_id ORDER BY -max(rating);"
-        self.cur.execute(sql)
-        return self.cur.fetchall()
+        if self.brands is None:
+            if 'prices' in self.cache:
+                metrics.count('cache_hits')
+            else:
+                sql = "SELECT code_id, price, timestamp, rating FROM prices GROUP BY code_id ORDER BY -max(rating);"
+                self.cache['prices'] = {price.code: price for price in self.fetch(PriceObservation, sql)}
+            return list(self.cache['prices'].values())
+
+        sql = "SELECT prod.code, p.price, p.timestamp, p.rating " \
+            "FROM prices AS p, products AS prod " \
+            "ON prod.code = p.code_id " \
+            "WHERE {} " \
+            "GROUP BY p.code_id " \
+            "ORDER BY -max(p.rating);".format(self.brand_filter('prod.brand'))
+        return self.fetch(PriceObservation, sql, self.brands)
 
     def get_instock_last_update(self, shop):
         """
         Get actual info on the size and availability of the products
+        return [StockObservation(code, size, count, timestamp, rating), ...]
         """
 
         table = ''
@@ -181,21 +469,151 @@ class SQLite:
         elif shop == SHOPS[3]:
             table = 'instock_altufevo'
 
-        if self.brand is not None and table:
+        if self.brands is not None and table:
             sql = "SELECT p.code, i.size, i.count, i.timestamp, i.rating " \
                   "FROM '{}' AS i, products AS p " \
                   "ON p.code=i.code_id " \
-                  "WHERE p.brand = '{}' AND i.rating >= {} " \
+                  "WHERE {} AND i.rating >= {} " \
                   "GROUP BY i.code_id, i.size " \
-                  "ORDER BY -MAX(i.rating);".format(table, self.brand, RATING)
-        elif self.brand is None and table:
+                  "ORDER BY -MAX(i.rating);".format(table, self.brand_filter('p.brand'), RATING)
+            return self.fetch(StockObservation, sql, self.brands)
+        elif self.brands is None and shop in self.cache:
+            metrics.count('cache_hits')
+            return list(self.cache[shop].values())
+        elif self.brands is None and table:
             sql = "SELECT code_id, size, count, timestamp, rating " \
                   "FROM '{}' " \
                   "WHERE rating >= {} " \
                   "GROUP BY code_id, size " \
                   "ORDER BY -MAX(rating);".format(table, RATING)
-        self.cur.execute(sql)
-        return self.cur.fetchall()
+            instock = self.fetch(StockObservation, sql)
+            self.cache[shop] = {(item.code, item.size): item for item in instock}
+            return instock
+        return self.fetch(StockObservation, sql)
+
+    @staticmethod
+    def _as_of(date):
+        """
+        Date to compare with 'timestamp' columns: 'YYYY-MM-DD' (to the end of this day), 'YYYY-MM-DD HH:MM:SS',
+        datetime.date or datetime.datetime
+        """
+
+        if hasattr(date, 'hour'):  # datetime.datetime
+            return date.strftime('%Y-%m-%d %H:%M:%S')
+        if hasattr(date, 'strftime'):  # datetime.date
+            date = date.strftime('%Y-%m-%d')
+        if len(date) == 10:
+            return date + ' 23:59:59'
+
+        return date
+
+    def _codes_filter(self, codes, column):
+        """
+        Part of WHERE clause by codes list and brands (if self.brands) of the products, its parameters-- brand_params()
+        """
+
+        sql = ''
+        if codes is not None:
+            sql += " AND {} IN ({})".format(column, ','.join(str(int(code)) for code in codes))
+        if self.brands is not None:
+            sql += " AND {} IN (SELECT code FROM products WHERE {})".format(column, self.brand_filter())
+
+        return sql
+
+    def brand_params(self) -> tuple:
+        """
+        Parameters of brand_filter(), empty without brands
+        """
+
+        return self.brands or ()
+
+    def get_prices_as_of(self, date, codes=None):
+        """
+        Get actual price of each product (or only 'codes' products) on the date: the row with max rating among rows
+        recorded before the end of this date
+        return [PriceObservation(code, price, timestamp, rating), ...]
+        """
+
+        sql = "SELECT code_id, price, timestamp, MAX(rating) " \
+              "FROM prices " \
+              "WHERE timestamp <= ?{} " \
+              "GROUP BY code_id;".format(self._codes_filter(codes, 'code_id'))
+        return self.fetch(PriceObservation, sql, (self._as_of(date),) + self.brand_params())
+
+    def get_instock_as_of(self, shop, date, codes=None):
+        """
+        Get availability of each size of each product (or only 'codes' products) in the shop on the date
+        return [StockObservation(code, size, count, timestamp, rating), ...]
+        """
+
+        sql = "SELECT code_id, size, count, timestamp, MAX(rating) " \
+              "FROM {} " \
+              "WHERE timestamp <= ?{} " \
+              "GROUP BY code_id, size;".format(INSTOCK_TABLES[shop], self._codes_filter(codes, 'code_id'))
+        return self.fetch(StockObservation, sql, (self._as_of(date),) + self.brand_params())
+
+    def get_prices_history(self, codes=None):
+        """
+        Get prices history series of each product (or only 'codes' products), ordered by rating (by time)
+        return {code: [(timestamp, price, rating), ...], ...}
+        """
+
+        sql = "SELECT code_id, timestamp, price, rating " \
+              "FROM prices " \
+              "WHERE 1{} " \
+              "ORDER BY code_id, rating;".format(self._codes_filter(codes, 'code_id'))
+        history = dict()
+        for code, timestamp, price, rating in self.cur.execute(sql, self.brand_params()):
+            history.setdefault(code, list()).append((timestamp, price, rating))
+
+        return history
+
+    def get_instock_history(self, shop, codes=None):
+        """
+        Get availability history series of each size of each product (or only 'codes' products) in the shop, ordered
+        by rating (by time)
+        return {code: {size: [(timestamp, count, rating), ...], ...}, ...}
+        """
+
+        sql = "SELECT code_id, size, timestamp, count, rating " \
+              "FROM {} " \
+              "WHERE 1{} " \
+              "ORDER BY code_id, size, rating;".format(INSTOCK_TABLES[shop], self._codes_filter(codes, 'code_id'))
+        history = dict()
+        for code, size, timestamp, count, rating in self.cur.execute(sql, self.brand_params()):
+            history.setdefault(code, dict()).setdefault(float(size), list()).append((timestamp, count, rating))
+
+        return history
+
+    def get_changes(self, kind: str, now: str) -> dict:
+        """
+        Count of changes of price ('prices' kind) or of count of all sizes in all shops ('instock' kind) of each product
+        and hours from its first record to 'now'. Rating is incremented by each change, so compact() does not change
+        the count
+        return {code: (changes, hours), ...}
+        """
+
+        if kind == 'prices':
+            sql = "SELECT code_id, MAX(rating) - 1, (julianday(?) - julianday(MIN(timestamp))) * 24 " \
+                  "FROM prices " \
+                  "GROUP BY code_id;"
+            parameters = (now,)
+        else:
+            sql = "SELECT code_id, SUM(changes), MAX(hours) FROM (" + " UNION ALL ".join(
+                "SELECT code_id, MAX(rating) - 1 AS changes, (julianday(?) - julianday(MIN(timestamp))) * 24 AS hours "
+                "FROM {} GROUP BY code_id, size".format(table) for table in INSTOCK_TABLES.values()) + \
+                  ") GROUP BY code_id;"
+            parameters = (now,) * len(INSTOCK_TABLES)
+        return {code: (changes, hours) for code, changes, hours in self.cur.execute(sql, parameters)}
+
+    def get_schedule(self, kind: str, now: str) -> dict:
+        """
+        Hours from the last check of each product to 'now' (see to_schedule())
+        return {code: hours, ...}
+        """
+
+        sql = "SELECT code, (julianday(?) - julianday(checked)) * 24 FROM schedule WHERE kind = ?;"
+        return dict(self.cur.execute(sql, (now, kind)).fetchall())
 
     def get_instock_codes_with_0_count(self, shop):
         """
@@ -212,39 +630,173 @@ class SQLite:
         elif shop == SHOPS[3]:
             table = 'instock_altufevo'
 
-        if self.brand is not None and table:
+        if self.brands is not None and table:
             sql = "SELECT i.code_id " \
                   "FROM products AS p, '{}' AS i " \
-                  "WHERE p.brand = '{}' AND i.count = 0 " \
-                  "GROUP BY i.code_id;".format(
-                table, self.brand)
-        elif self.brand is None and table:
+                  "ON p.code = i.code_id " \
+                  "WHERE {} AND i.count = 0 " \
+                  "GROUP BY i.code_id;".format(table, self.brand_filter('p.brand'))
+        elif self.brands is None and table:
             sql = "SELECT code_id FROM '{}' WHERE count = 0 GROUP BY code_id;".format(table)
-        self.cur.execute(sql)
+        self.cur.execute(sql, self.brand_params())
 
         return self.cur.fetchall()
 
-    def update_products_rating_to_0(self, urls):
+    def update_products_rating_to_0(self, ids):
         """
-        Sets low rating for items that is not in stock
+        Sets low rating for items that is not in stock, by ids of its urls (see known.py)
         """
 
-        sql = "UPDATE products SET rating = 0 WHERE url IN ('{}');".format("','".join(urls))
-        self.cur.execute(sql)
+        self.update_products_rating(ids, 0)
+
+    def update_products_rating_to_normal(self, ids):
+        """
+        Set normal rating for items that have become available again, by ids of its urls (see known.py)
+        """
+
+        self.update_products_rating(ids, RATING)
+
+    def update_products_rating(self, ids, rating: int):
+
+        self.migrate()  # the first write of connection creates tables of this project, see migrate()
+        ids = set(ids)
+        self.cur.executemany("UPDATE products SET rating = ? WHERE url_id = ?;", [(rating, _id) for _id in ids])
+        self.known_index().move(ids, rating >= RATING)
+        self.save_known()
         self.conn.commit()
-        return self.cur.fetchall()
+        self.changed()
+        if 'products' in self.cache:
+            for code, (url, old_rating, _id) in self.cache['products'].items():
+                if _id in ids:
+                    self.cache['products'][code] = (url, rating, _id)
 
-    def update_products_rating_to_normal(self, urls):
+    def known_index(self) -> KnownIndex:
         """
-        Set normal rating for items that have become available again
+        Index of known products (see known.py): loaded once from 'known' table, or built again from 'products' table,
+        if 'products' was changed out of this class (see TRIGGERS). Checked again only after commits of other
+        connections (PRAGMA data_version), writes of this connection update the index itself
         """
 
-        sql = "UPDATE products SET rating = '{}' WHERE url IN ('{}');".format(RATING, "','".join(urls))
-        self.cur.execute(sql)
+        data_version = self.cur.execute("PRAGMA data_version;").fetchone()[0]
+        if self.known is not None and data_version == self.data_version:
+            return self.known
+        self.data_version = data_version
+        version = self.get_state('products_version', '0')
+        if self.known is not None and version == self.known_version:
+            return self.known
+        if self.get_state('known_version') == version:
+            self.known = KnownIndex.from_rows(self.cur.execute("SELECT brand, instock, ids FROM known;").fetchall())
+            self.known_version = version
+        else:
+            self.migrate()  # 'known' table and 'url_id' column
+            products = self.cur.execute("SELECT brand, url_id, rating FROM products;").fetchall()
+            self.known = KnownIndex.build(products)
+            self.cur.execute("DELETE FROM known;")
+            self.known.dirty = set(self.known.ids)
+            self.save_known()
+            self.conn.commit()
+        return self.known
+
+    def save_known(self):
+        """
+        Write changed sets of the index to 'known' table, without commit: in the same transaction with 'products' table,
+        with the version of 'products' (see TRIGGERS), which the index is of
+        """
+
+        self.cur.executemany("INSERT OR REPLACE INTO known (brand, instock, ids) VALUES (?,?,?);",
+                             self.known.rows(self.known.dirty))
+        self.known.dirty = set()
+        self.known_version = self.get_state('products_version', '0')
+        self.cur.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('known_version', ?);",
+                         (self.known_version, ))
+
+    def get_known_ids(self) -> tuple:
+        """
+        Ids of urls of known products (see known.py), of self.brands of partial work
+        return set of ids of in stock items, set of ids of not in stock items
+        """
+
+        return self.known_index().get(self.brands)
+
+    def get_state(self, key: str, default=None) -> str:
+        """
+        Value from 'state' table, kept between runs
+        """
+
+        try:
+            self.cur.execute("SELECT value FROM state WHERE key = ?;", (key,))
+        except sqlite3.OperationalError:  # no 'state' table: database is not migrated yet, see migrate()
+            return default
+        row = self.cur.fetchone()
+        return row[0] if row is not None else default
+
+    def update_state(self, key: str, value):
+
+        # by its own cursor: rowcount of self.cur of the caller is kept
+        self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?);", (key, str(value)))
         self.conn.commit()
-        return self.cur.fetchall()
+
+    def changed(self):
+        """
+        New version of data after each write, to ETag of api.py responses
+        """
+
+        self.update_state('version', repr(time.time()))
+
+    def file_size(self):
+        """
+        Size of database file in bytes
+        """
+
+        page_size = self.cur.execute("PRAGMA page_size;").fetchone()[0]
+        page_count = self.cur.execute("PRAGMA page_count;").fetchone()[0]
+        return page_size * page_count
+
+    def compact(self, retention_days=RETENTION_DAYS):
+        """
+        Downsample history of 'prices' and 'instock_...' tables older than 'retention_days' to the last value (max
+        rating) of each day, then return free pages to the file system by incremental vacuum and update statistics of
+        query planner. The row with max rating of each product (each size of product) is always the last one of its day,
+        so the actual state of product is never deleted.
+        Use only if no sync is working with database (see main.manager)
+        return {table: deleted rows, ..., 'bytes': reclaimed bytes of database file}
+        """
+
+        self.migrate()  # indexes to group history
+        cutoff = time.strftime('%Y-%m-%d 00:00:00', time.localtime(time.time() - retention_days * 24 * 60 * 60))
+        file_size = self.file_size()
+        report = dict()
+        groups = {'prices': 'code_id'}
+        groups.update({table: 'code_id, size' for table in INSTOCK_TABLES.values()})
+        for table, group in groups.items():
+            sql = "DELETE FROM {0} " \
+                  "WHERE timestamp < :cutoff AND id NOT IN (" \
+                  "SELECT id FROM (" \
+                  "SELECT id, MAX(rating) FROM {0} WHERE timestamp < :cutoff GROUP BY {1}, date(timestamp)));".format(
+                table, group)
+            self.cur.execute(sql, {'cutoff': cutoff})
+            report[table] = self.cur.rowcount
+            self.conn.commit()
+
+        # incremental vacuum needs 'auto_vacuum = INCREMENTAL' mode, which is set by full VACUUM once
+        if self.cur.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            self.cur.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            self.cur.execute("VACUUM;")
+        while self.cur.execute("PRAGMA freelist_count;").fetchone()[0]:
+            self.cur.execute("PRAGMA incremental_vacuum({});".format(VACUUM_PAGES)).fetchall()
+            self.conn.commit()
+        self.cur.execute("PRAGMA analysis_limit = 1000;")  # approximate statistics, fast on big tables
+        self.cur.execute("ANALYZE;")
+        self.conn.commit()
+        report['bytes'] = file_size - self.file_size()
+        if DEBUG:
+            print('Compact database:', report)
+
+        return report
 
     def exe(self, sql):
+        self.cache.clear()  # any changes of tables
+        self.known = None
         self.cur.execute(sql)
         self.conn.commit()
         return self.cur.fetchall()
@@ -268,6 +820,7 @@ class SQLite:
     def export_card_and_price(self, code=None):
         """
         Export to json, xml, csv formats. Used by Main.export()
+        return [Card(code, model, brand, price, url, img, ...), ...]
         """
 
         # single card description by code of item
@@ -279,19 +832,18 @@ class SQLite:
                   "WHERE code='{}' and pri.price <> 0 " \
                   "GROUP BY  pri.code_id " \
                   "HAVING MAX(pri.rating);".format(code)
-            self.cur.execute(sql)
 
-            return self.cur.fetchall()
+            return self.fetch(Card, sql)
 
         # multiple card description by brand
-        if self.brand is not None:
+        if self.brands is not None:
             sql = "SELECT p.code, p.model, p.brand, pri.price, p.url, p.img, p.age, p.gender, p.year, p.use, " \
                   "p.pronation, p.article, p.season " \
                   "FROM products AS p, prices AS pri " \
                   "ON p.code=pri.code_id " \
-                  "WHERE brand='{}' AND pri.price <> 0 " \
+                  "WHERE {} AND pri.price <> 0 " \
                   "GROUP BY  pri.code_id " \
-                  "HAVING MAX(pri.rating);".format(self.brand)
+                  "HAVING MAX(pri.rating);".format(self.brand_filter('p.brand'))
         else:
             # multiple card description of full database
             sql = "SELECT p.code, p.model, p.brand, pri.price, p.url, p.img, p.age, p.gender, p.year, p.use, " \
@@ -301,8 +853,18 @@ class SQLite:
                     "WHERE pri.price <> 0 " \
                     "GROUP BY  pri.code_id " \
                     "HAVING MAX(pri.rating);"
-        self.cur.execute(sql)
-        return self.cur.fetchall()
+        return self.fetch(Card, sql, self.brand_params())
+
+    def export_columns(self, table: str):
+        """
+        Rows of the table to columnar export (see EXPORT_TABLES), read them by cursor.fetchmany()
+        return columns, cursor
+        """
+
+        columns, sql = EXPORT_TABLES[table]
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        return columns, cur
 
     def export_available(self, code):
         """
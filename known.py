@@ -0,0 +1,114 @@
+import re
+from array import array
+
+from settings import RATING
+
+# id of product in its url: 'https://www.kant.ru/catalog/product/3052137/' -> 3052137
+PRODUCT_ID = re.compile(r'/catalog/product/(\d+)')
+
+# url of product card by its id, as it is on listing pages
+PRODUCT_URL = 'https://www.kant.ru/catalog/product/{}/'
+
+
+def url_id(url: str):
+    """
+    Id of product by its url, None to other url
+    """
+
+    match = PRODUCT_ID.search(url)
+    return int(match.group(1)) if match else None
+
+
+def product_url(_id: int) -> str:
+
+    return PRODUCT_URL.format(_id)
+
+
+class KnownIndex:
+    """
+    Compact index of known products: ids of its urls (see url_id()) of each brand, in stock (rating >= settings.RATING)
+    and not in stock items. Kept in 'known' table of database as sorted arrays of 8 bytes integers (see
+    SQLite.known_index()), loaded once and updated by each write to 'products' table, so new items are found by set
+    arithmetic of integers, without reading and hashing of all urls of 'products' table.
+    Use:
+        index = KnownIndex.build([(brand, url_id, rating), ...])
+        instock, not_instock = index.get(['Asics', 'Hoka'])  # sets of ids, all brands as default
+    """
+
+    def __init__(self):
+
+        self.ids = dict()  # {(brand, instock): {id, ...}}
+        self.dirty = set()  # keys of changed sets, to write to database
+
+    def __len__(self):
+
+        return sum(len(ids) for ids in self.ids.values())
+
+    @classmethod
+    def from_rows(cls, rows: list):
+        """
+        Index by rows of 'known' table: [(brand, instock, bytes of array of ids), ...]
+        """
+
+        index = cls()
+        for brand, instock, blob in rows:
+            ids = array('q')
+            ids.frombytes(blob)
+            index.ids[(brand, bool(instock))] = set(ids)
+        return index
+
+    @classmethod
+    def build(cls, products: list):
+        """
+        Index by rows of 'products' table: [(brand, url_id, rating), ...]
+        """
+
+        index = cls()
+        for brand, _id, rating in products:
+            index.add(brand, _id, rating)
+        return index
+
+    def rows(self, keys=None) -> list:
+        """
+        Rows of 'known' table of changed sets (all sets to 'keys' = None)
+        """
+
+        keys = list(self.ids) if keys is None else keys
+        return [(brand, instock, array('q', sorted(self.ids.get((brand, instock), ()))).tobytes())
+                for brand, instock in keys]
+
+    def add(self, brand: str, _id: int, rating: int):
+
+        if _id is None:  # not a product url
+            return
+        instock = rating >= RATING
+        self.ids.setdefault((brand, instock), set()).add(_id)
+        self.ids.get((brand, not instock), set()).discard(_id)
+        self.dirty.update(((brand, True), (brand, False)))
+
+    def move(self, ids, instock: bool):
+        """
+        Move products of 'ids' to in stock, or to not in stock items of its brand
+        """
+
+        ids = set(ids)
+        for brand, key_instock in list(self.ids):
+            if key_instock == instock:
+                continue
+            moved = self.ids[(brand, key_instock)] & ids
+            if moved:
+                self.ids[(brand, key_instock)] -= moved
+                self.ids.setdefault((brand, instock), set()).update(moved)
+                self.dirty.update(((brand, True), (brand, False)))
+
+    def get(self, brands=None) -> tuple:
+        """
+        Ids of in stock and not in stock products of 'brands', all brands as default
+        return set of ids, set of ids
+        """
+
+        instock, not_instock = set(), set()
+        for (brand, key_instock), ids in self.ids.items():
+            if brands is None or brand in brands:
+                (instock if key_instock else not_instock).update(ids)
+        return instock, not_instock
@@ -1,15 +1,20 @@
 #!/usr/bin/env python
 
 import time
-import asyncio
 import sys
 import os.path
-from aiohttp import ClientConnectionError
+import fcntl
 from pathlib import Path
+from contextlib import contextmanager
 
+import brands as registry
 from db import SQLite
-from parser import Parser
-from settings import DEBUG, RATING, BRANDS_URLS, SHOPS, BRANDS
+from known import product_url
+from records import PriceObservation, StockObservation
+from metrics import metrics
+from settings import DEBUG, RATING, BRANDS_URLS, SHOPS, BRANDS, LOCK_FILE, METRICS_FILE, PROMETHEUS_FILE, \
+    PROFILE_FILE, SLOW_CALLBACK, PROFILE_TOP, NOT_INSTOCK_PROBE_RUNS, SCHEDULE, \
+    SERVE_INTERVAL, SERVE_PRODUCTS_HOURS, LISTING_PRICES, CHUNK, REPLAY_DIR, PAGES_DIR
 
 
 # support print to testing full app functionality, include 'db' and 'parser' modules
@@ -30,19 +35,46 @@ class Main:
     update_prices_table() fills and monitors 'prices' table
     update_instock_table() fills and monitors all 'instock_...' tables
     export() export data cards description to popular formats for marketplaces: json, xml or csv.
+    serve() daemon mode: update due items of all tables by cycles until SIGTERM
     """
 
-    def __init__(self, brand=None):
+    def __init__(self, brand=None, db_name=None, schedule=None, brands=None):
 
         self.url_list = BRANDS_URLS  # used all running brands (links) to parsing
         self.from_parse_main = list()  # cached, if disconnect cases is often
+        self.tiles = dict()  # items of listing pages of the last update_products_table(), see update_prices_table()
         self.max_pagination = 30  # max pagination of each brand
         self._brand = brand  # uses partial working with db without affecting all data to correct data consistency
+        self._brands = None  # the same with several brands: Main(brands=['Asics', 'Hoka'])
+        # check prices and availability only of due items (see scheduler.py), settings.SCHEDULE as default
+        self.schedule = SCHEDULE if schedule is None else schedule
+        self.listing_prices = LISTING_PRICES  # check prices by listing pages, see update_prices_table()
+        self.pages = None  # archive of product pages of parse_price() and parse_details(), see pages.py
 
-        self.loop = asyncio.get_event_loop()  # start async event loop
-        self.db = SQLite()  # connect to db
+        self._loop = self._parser = None  # event loop and parser only to update tables, see next
+        self.db = SQLite(db_name)  # connect to db, settings.DB_NAME as default
 
-        self.set_brand_parameter(brand)  # see next
+        self.set_brands_parameter(brands or ([brand] if brand is not None else None))  # see next
+
+    def loop_getter(self):
+
+        # asyncio is not imported to export
+        if self._loop is None:
+            import asyncio
+            self._loop = asyncio.get_event_loop()  # start async event loop
+        return self._loop
+
+    loop = property(loop_getter)
+
+    def parser_getter(self):
+
+        # aiohttp and lxml.html are not imported to export
+        if self._parser is None:
+            from parser import Parser
+            self._parser = Parser
+        return self._parser
+
+    parser = property(parser_getter)
 
     def brand_getter(self):
 
@@ -59,6 +91,16 @@ class Main:
 
     brand = property(brand_getter, brand_setter, brand_deleter)  # convenient use partial working with db
 
+    def brands_getter(self):
+
+        return self._brands
+
+    def brands_setter(self, names):
+
+        self.set_brands_parameter(names)
+
+    brands = property(brands_getter, brands_setter)
+
     def set_brand_parameter(self, brand):
         """
         Forwarding 'brand' argument from main.Main() to db.SQLite() to operate part of data from database.
@@ -71,29 +113,36 @@ class Main:
         without using full data.
         """
 
-        if brand is not None:
-            self._brand = brand  # set double parameters: self._brand and self.brand (property)
-            # forward naming to SQLite().brand
-            if self.db is not None:
-                self.db.brand = brand
-            # working only with one brand (not full running shoes urls)
-            name = brand.lower()
-            # find unic url by one unic brand name
-            # use split() by '/' and '-' (from url string) to use correct url by brand name
-            self.url_list = [url for url in self.url_list if
-                             list(filter(
-                                 lambda x: x == name,
-                                 [i for i in url.split('/') if '-' not in i] + \
-                                 [i.partition('-')[2] for i in url.split('/') if '-' in i]
-                             ))]
-
-    def update_products_table(self):
+        self.set_brands_parameter([brand] if brand is not None else None)
+
+    def set_brands_parameter(self, brands):
+        """
+        Partial work with several brands in one process by one set of queries to database, for example:
+        page = Main(brands=['Asics', 'Hoka', 'Brooks'])
+        page.brands = ['asics', 'hoka']  # or from attribute, any case or alias of brand (see brands.py)
+        None-- full data of all brands. Raise ValueError to brand out of settings.BRANDS
+        """
+
+        names = registry.select(brands) if brands else None  # canonical names
+        self._brands = names
+        self._brand = names[0] if names and len(names) == 1 else None
+        # forward names to SQLite().brands
+        if getattr(self, 'db', None) is not None:
+            self.db.brands = names
+        # listing urls of these brands only, or full running shoes urls
+        self.url_list = registry.urls(names) if names else BRANDS_URLS
+
+    @metrics.measure
+    def update_products_table(self, new_only=False):
         """
         Create new items to 'products' table to database and update rating to items, which doesn't in stock
+        'new_only'-- only add new items and items in stock again: paging of listing stops after the page of only known
+        items (see Parser.parse_main()), so items out of stock are not found and its rating is not changed
         """
 
         if not self.db:  # if not db connection
             return None
+        self.db.migrate()  # tables of this project, once by connection
 
         # support to develop, if True
         if DEBUG:
@@ -101,41 +150,48 @@ class Main:
             tac = lambda: '{:.2f}sec'.format(time.time() - now)
             print('\r\n> Start update_products_table..')
 
+        # ids of urls of items from db (see known.py), in stock and with small rate
+        ids_from_db, ids_from_db_small_rate = self.db.get_known_ids()
         # load urls from www.kant.ru
         if not self.from_parse_main:  # if not cached from internet re- connection (mobile connection, as usual)
-            self.from_parse_main = self.loop.run_until_complete(Parser.parse_main(self.url_list, self.max_pagination))
-        unic_urls = set(self.from_parse_main)  # unic urls, exclude doubles items from list
-        url_from_db = set(self.db.get_products_urls())  # get urls to check its availability
-        check_urls = unic_urls - url_from_db  # check urls, not in stock from 'products' table
-        urls_not_instock = url_from_db - unic_urls # out of stock urls
-        url_from_db_small_rate = set(self.db.get_products_urls_rating_below_normal())  # get only small rate
-        urls_to_normal_rate = url_from_db_small_rate & check_urls  # update to normal rate: RATING
-        new_urls = list(check_urls - url_from_db_small_rate)  # set new rate: RATING
+            known = ids_from_db | ids_from_db_small_rate if new_only else None
+            self.from_parse_main = self.loop.run_until_complete(
+                self.parser.parse_main(self.url_list, self.max_pagination, known))
+        unic_ids = {tile.id for tile in self.from_parse_main}  # unic items, exclude doubles items from list
+        check_ids = unic_ids - ids_from_db  # check items, not in stock from 'products' table
+        ids_not_instock = set() if new_only else ids_from_db - unic_ids  # out of stock items
+        ids_to_normal_rate = check_ids & ids_from_db_small_rate  # update to normal rate: RATING
+        new_urls = [product_url(_id) for _id in check_ids - ids_from_db_small_rate]  # set new rate: RATING
         new = list() # products from new_urls
-        if urls_not_instock:  # change rating to 0 for not in stock items
-            self.db.update_products_rating_to_0(urls_not_instock)
-        if urls_to_normal_rate:  # change rating to normal (settings.RATING) if item is available again
-            self.db.update_products_rating_to_normal(urls_to_normal_rate)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())  # of new items and of its archived pages
+        self.stamp_pages(timestamp)
+        if ids_not_instock:  # change rating to 0 for not in stock items
+            self.db.update_products_rating_to_0(ids_not_instock)
+        if ids_to_normal_rate:  # change rating to normal (settings.RATING) if item is available again
+            self.db.update_products_rating_to_normal(ids_to_normal_rate)
         if new_urls:  # add to 'products' new items
-            new = self.loop.run_until_complete(Parser.parse_details(new_urls))  # item description by it urls
+            new = self.loop.run_until_complete(self.parser.parse_details(new_urls, timestamp))  # description by urls
             if new:
                 self.db.to_products(new)
             else:
                 if DEBUG:
                     print('without exec Parser.parse_details')
+        self.tiles = {tile.id: tile for tile in self.from_parse_main}  # prices of listing, to update_prices_table()
+        self.from_parse_main = list()  # the next run loads www.kant.ru again
         if DEBUG:
-            print('\tfrom db, rate {}: {}'.format(RATING, len(url_from_db)))
-            print('\tfrom kant.ru: ', len(unic_urls))
-            if urls_not_instock:
-                print('\tNot in stock:', len(urls_not_instock), urls_not_instock)
-            if urls_to_normal_rate:
-                print('\tUpdate rate 1 to normal:', len(urls_to_normal_rate), urls_to_normal_rate)
+            print('\tfrom db, rate {}: {}'.format(RATING, len(ids_from_db)))
+            print('\tfrom kant.ru: ', len(unic_ids))
+            if ids_not_instock:
+                print('\tNot in stock:', len(ids_not_instock), ids_not_instock)
+            if ids_to_normal_rate:
+                print('\tUpdate rate 1 to normal:', len(ids_to_normal_rate), ids_to_normal_rate)
             if new:
                 print('\tNew:', len(new), new)
             print('> End update_product_table {}.'.format(tac()))
 
         return True  # if all ok
 
+    @metrics.measure
     def update_prices_table(self):
         """
         set new prices to new items in 'prices' from new items in 'products' and update prices 'prices', if chanched
@@ -143,6 +199,7 @@ class Main:
 
         if not self.db:  # if not db connection
             return None
+        self.db.migrate()  # tables of this project, once by connection
 
         # support dev
         if DEBUG:
@@ -151,6 +208,7 @@ class Main:
             print('\r\n> Start update_prices_table..')
 
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())  # time to update stamp
+        self.stamp_pages(timestamp)
         products = self.db.get_products_code_url()  # get pairs code and url from 'products'
         if not products:
             if DEBUG:
@@ -158,52 +216,118 @@ class Main:
             return False
         prod_codes = [code for code, url in products]  # only codes
         # get prices by codes in 'products' from 'prices' table with max rate
-        prices_from_db = self.db.get_last_update_prices()  # [(code, price, timestamp, rating), (code, ...]
-        prices_codes = [code for (code, price, time_, rating) in prices_from_db]  # only codes
+        prices_from_db = {price.code: price for price in self.db.get_last_update_prices()}  # {code: PriceObservation}
 
         # new codes set to 'prices': code, price, timestamp, RATING
-        new = set(prod_codes) - set(prices_codes)  # new shoes, prices not define, need parse
+        new = set(prod_codes) - prices_from_db.keys()  # new shoes, prices not define, need parse
+        exist = prices_from_db.keys() & set(prod_codes)
+        loaded = set()  # codes of loaded product pages, to schedule: items of failed pages are due yet
         if new:
             new_codes_urls = [(code, url) for (code, url) in products if code in new]  # get pairs code: url for parsing
-            new_codes_prices = self.loop.run_until_complete(Parser.parse_price(new_codes_urls))  # code: price for items
+            new_codes_prices = self.loop.run_until_complete(self.parser.parse_price(new_codes_urls))  # code: price for items
+            loaded.update(code for code, price in new_codes_prices)
             # starting rate for new normal price == RATING
-            solution_new_list = [(code, price, timestamp, RATING) for (code, price) in new_codes_prices]
+            solution_new_list = [PriceObservation(code, price, timestamp, RATING) for (code, price) in new_codes_prices]
             if solution_new_list:
                 self.db.to_prices(solution_new_list)
                 if DEBUG:
                     print('new prices to db: ', len(solution_new_list), *solution_new_list)
 
         # update existing items if prices has been updated, increment rate + 1
-        exist = set(prices_codes) & set(prod_codes)
+        if self.schedule:  # only due items
+            from scheduler import Scheduler
+            scheduler = Scheduler(self.db, 'prices')
+            due = set(scheduler.due(exist, timestamp))
+            if DEBUG:
+                print('Scheduled items: {} of {}'.format(len(due), len(exist)))
+            exist = due
+        # items on listing pages with the same price as in db are checked without load of its product pages. Listing
+        # is loaded only if its pages are less requests, than product pages of items to check
+        listed = set()
+        tiles, self.tiles = self.tiles, dict()  # tiles of update_products_table() are used once
+        if self.listing_prices and exist and (tiles or len(exist) > self.listing_pages()):
+            tiles = tiles or self.load_tiles()
+            ids = dict(self.db.get_products_code_id())  # {code: id of url}
+            listed = {code for code in exist if ids.get(code) in tiles and tiles[ids[code]].available
+                      and tiles[ids[code]].price == prices_from_db[code].price}
+            exist = exist - listed
+            metrics.count('listing_hits', len(listed))
+            if DEBUG:
+                print('Prices of listing: {} the same, {} to check'.format(len(listed), len(exist)))
         if exist:
             old_codes_urls = [(code, url) for (code, url) in products if code in exist]
-            updated_codes_prices = self.loop.run_until_complete(Parser.parse_price(old_codes_urls))
+            updated_codes_prices = self.loop.run_until_complete(self.parser.parse_price(old_codes_urls))
+            loaded.update(code for code, price in updated_codes_prices)
             to_update = list()
             for upd_code, upd_price in updated_codes_prices:  # iterate for loaded data from kant.ru
-                for db_code, db_price, _time, rating in prices_from_db:  # check equal prices from db and site
-                    if upd_code == db_code and upd_price != db_price:  # code is equal. Prices is updated?
-                        # item in stock and price real is update
-                        to_update.append((upd_code, upd_price, timestamp, rating+1))  # set new price to item
-                        break
+                last = prices_from_db[upd_code]  # check equal prices from db and site
+                if upd_price != last.price:  # item in stock and price real is update
+                    to_update.append(PriceObservation(upd_code, upd_price, timestamp, last.rating + 1))
             if to_update:  # set new price and rate conditions-- update existing items
                 self.db.to_prices(to_update)
                 if DEBUG:
                     print('\tupdate prices in db: ', len(to_update), *to_update)
+        if self.schedule:
+            scheduler.checked(loaded | listed, timestamp)
 
         if DEBUG:
             print('> End update_prices_table on {}.'.format(tac()))
 
         return True  # if all ok
 
-    def update_instock_table(self):
+    def stamp_pages(self, timestamp: str):
+        """
+        Archive product pages of the next parse_...() calls with 'timestamp' of rows derived from them (see pages.py),
+        or stop to archive, if self.pages is None
+        """
+
+        from parser import Parser
+        Parser.pages = self.pages  # in worker processes too, see shard.py
+        if self.pages is not None:
+            self.pages.stamp = timestamp
+
+    def price_page(self, price: PriceObservation, ids=None):
+        """
+        Raw html of product page, from which the row of 'prices' table was derived
+        'ids'-- {code: id of url} of SQLite.get_products_code_id(), to get pages of many rows without building it again
+        return html or None, if the page is not in the archive
+        """
+
+        if self.pages is None:
+            return None
+        ids = ids if ids is not None else dict(self.db.get_products_code_id())
+        return self.pages.get(ids.get(price.code), price.timestamp)
+
+    def listing_pages(self) -> int:
+        """
+        Count of listing pages, which load_tiles() requests at least: the first chunk of settings.CHUNK pages (at most
+        self.max_pagination) of each listing url, see Parser.parse_main()
+        """
+
+        return len(self.url_list) * min(CHUNK, self.max_pagination)
+
+    def load_tiles(self) -> dict:
+        """
+        Items of listing pages of www.kant.ru, see Parser.parse_main()
+        return {id of url: Tile, ...}
+        """
+
+        tiles = self.loop.run_until_complete(self.parser.parse_main(self.url_list, self.max_pagination))
+        return {tile.id: tile for tile in tiles}
+
+    @metrics.measure
+    def update_instock_table(self, not_instock=None):
         """
         Set new instock availability of each size of each item, update existing availability and set to 0 not in stock
         items.
+        'not_instock'-- check items, which dropped out of www.kant.ru (rating 0) too, as default each
+        settings.NOT_INSTOCK_PROBE_RUNS run
         Working tables: 'instock_nagornaya', 'instock_altufevo', 'instock_teply_stan', 'instock_timiryazevskaya'
         """
 
         if not self.db:  # if not db connection
             return None
+        self.db.migrate()  # tables of this project, once by connection
 
         if DEBUG:
             now = tic()
@@ -211,80 +335,88 @@ class Main:
             print('\r\n> Start update_instock_tables..')
 
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())  # now time to update db timestamps
-        codes_urls = self.db.get_products_code_url()
-        if not codes_urls:  # table is empty. First run 'Main.update_products_table()'
+        run = int(self.db.get_state('instock_runs', 0)) + 1  # count of runs, kept in database
+        if not_instock is None:
+            not_instock = NOT_INSTOCK_PROBE_RUNS > 0 and run % NOT_INSTOCK_PROBE_RUNS == 0
+        pair_codes = self.db.get_products_code_id(not_instock)  # pairs code, id of url; items in stock first
+        if not pair_codes:  # table is empty. First run 'Main.update_products_table()'
             if DEBUG: print('No items in products table!')
             return False
-        codes = [i[0] for i in codes_urls]
-        instock_codes = [int(i[1].split('/')[5]) for i in codes_urls]  # unic code from url, get numeric set from link
-        pair_codes = list(zip(codes, instock_codes))  # pair: code, unic_code_from_url
+        if DEBUG:
+            print('Run {}, check items, which dropped out of www.kant.ru: {}'.format(run, not_instock))
+        if self.schedule:  # only due items
+            from scheduler import Scheduler
+            scheduler = Scheduler(self.db, 'instock')
+            due = set(scheduler.due([code for code, _id in pair_codes], timestamp))
+            if DEBUG:
+                print('Scheduled items: {} of {}'.format(len(due), len(pair_codes)))
+            pair_codes = [(code, _id) for code, _id in pair_codes if code in due]
 
         # load from kant.ru and set availability (size and its quantity) to loaded_instock, for example:
-        #   shop            code    size, count,    time,         rating
+        #   shop            code        size    code      size, count,    time,         rating
         # {'nagornaya':
         #               {12345678:
-        #                           (11.5, 3, 2021-06-21 23:59:00, 4) }}
-        loaded = self.loop.run_until_complete(Parser.parse_available(pair_codes))  # load from www.kant.ru
+        #                           {11.5: StockObservation(12345678, 11.5, 3, 2021-06-21 23:59:00, 1)}}}
+        loaded = list()
+        if pair_codes:  # may be no due items (see scheduler.py)
+            brands = self.db.get_products_brand()  # to size chart of brand
+            loaded = self.loop.run_until_complete(self.parser.parse_available(pair_codes, brands))  # www.kant.ru
         loaded_instock = {shop: dict() for shop in SHOPS}  # serialized to analyse with last_update_instock
 
         for code, instock in loaded:
             for shop in SHOPS:
                 if shop in instock.keys():
-                    loaded_instock[shop][code] = list()
-                    for sizes in instock[shop]:
-                        loaded_instock[shop][code].append((float(sizes[0]), sizes[1], timestamp, RATING))
-
-        # load from db availability (size and its quantity) to last_update_instock, for example:
-        #   shop            code    size, count,    time,         rating
+                    counts = dict()  # labels of different size systems of one size (see sizes.py) are summed
+                    for size, count in instock[shop]:
+                        if size is not None:
+                            counts[size] = counts.get(size, 0) + count
+                    loaded_instock[shop][code] = {size: StockObservation(code, size, count, timestamp, RATING)
+                                                  for size, count in counts.items()}
+
+        # load from db availability (size and its quantity) to last_update_instock, the same format, for example:
+        #   shop            code        size    code      size, count,    time,         rating
         # {'nagornaya':
         #               {12345678:
-        #                           (11.5, 3, 2021-06-21 23:59:00, 4) }}
+        #                           {11.5: StockObservation(12345678, 11.5, 3, 2021-06-21 23:59:00, 4)}}}
         last_update_instock = {shop: dict() for shop in SHOPS}
+        # only loaded items: not skipped items, which dropped out of www.kant.ru, and not items of failed requests
+        checked = {code for code, instock in loaded}
         for shop in SHOPS:
-            for code, size, count, _time, rate in self.db.get_instock_last_update(shop):  # load from database
-                if code not in last_update_instock[shop].keys():
-                    last_update_instock[shop][code] = list()
-                last_update_instock[shop][code].append((float(size), count, _time, rate))
+            for item in self.db.get_instock_last_update(shop):  # load from database, or its last state in memory
+                if item.code in checked:
+                    last_update_instock[shop].setdefault(item.code, dict())[item.size] = item
 
         # New items (new code_id, which dooes not in 'instock_...' db) add to table istantly without any check
         absolutely_new = {shop: list() for shop in SHOPS}
         for shop in SHOPS:
             for code in loaded_instock[shop].keys():
                 if code not in last_update_instock[shop].keys():
-                    absolutely_new[shop].extend([(code, *i) for i in loaded_instock[shop][code]])
+                    absolutely_new[shop].extend(loaded_instock[shop][code].values())
 
         # Check items for consistency already available
         new = {shop: list() for shop in SHOPS}  # new available sizes with existing items in the selected store
         updated = {shop: list() for shop in SHOPS}
-        not_instock = {shop: list() for shop in SHOPS}
+        dropped = {shop: list() for shop in SHOPS}  # sizes, which dropped out of the store: count 0
 
         for shop in SHOPS:
-            for code in last_update_instock[shop].keys():  # from database
+            for code, last_sizes in last_update_instock[shop].items():  # from database
                 if code in loaded_instock[shop].keys():  # if codes from kant.ru and database matched
-                    for size, count, timestmp, rate in last_update_instock[shop][code]:  # check database
-                        for size_, count_, timestmp_, rate_ in loaded_instock[shop][code]:  # check kant.ru
-                            if size == size_ and count != count_:  # if sizes matched and count is updated (not matched)
-                                updated[shop].append((code, size_, count_, timestamp, rate + 1))
-                                break
-                    # needs lambda to equal types to correct working with values in future
-                    # unic sizes if item from database
-                    last_update_sizes = set(map(lambda x: float(x[0]), last_update_instock[shop][code]))
-                    # unic sizes of item from kant.ru
-                    loaded_sizes = set(map(lambda x: float(x[0]), loaded_instock[shop][code]))
-                    not_instock_sizes = last_update_sizes - loaded_sizes
-                    new_sizes = loaded_sizes - last_update_sizes
-                    # product was available in stock, but it dropped out now
-                    not_instock[shop].extend([(code, value[0], 0, timestamp, value[3]+1)
-                                        for value in last_update_instock[shop][code]
-                                              if (value[0] in not_instock_sizes and value[1] != 0)])
-                    new[shop].extend([(code, value[0], value[1], timestamp, RATING)
-                                for value in loaded_instock[shop][code] if value[0] in new_sizes])
+                    loaded_sizes = loaded_instock[shop][code]
+                    for size, last in last_sizes.items():  # check database
+                        item = loaded_sizes.get(size)  # check kant.ru
+                        if item is None:  # product was available in stock, but it dropped out now
+                            if last.count != 0:
+                                dropped[shop].append(last._replace(count=0, timestamp=timestamp,
+                                                                   rating=last.rating + 1))
+                        elif item.count != last.count:  # if sizes matched and count is updated (not matched)
+                            updated[shop].append(item._replace(rating=last.rating + 1))
+                    new[shop].extend(item for size, item in loaded_sizes.items() if size not in last_sizes)
                 else:  # if product was in db, but dropped out of the store completely
-                    # add to not_instock dropped out items, but not rewrite no longer exists items
-                    not_instock[shop].extend([(code, item[0], 0, timestamp, item[3]+1)
-                                              for item in last_update_instock[shop][code] if item[1] != 0])
+                    # add to dropped out items, but not rewrite no longer exists items
+                    dropped[shop].extend(last._replace(count=0, timestamp=timestamp, rating=last.rating + 1)
+                                         for last in last_sizes.values() if last.count != 0)
 
-        for i, data in enumerate([absolutely_new, new, updated, not_instock]):
+        for i, data in enumerate([absolutely_new, new, updated, dropped]):
             if i == 0:
                 group = 'Absolutely new items'
             elif i == 1:
@@ -303,18 +435,27 @@ class Main:
                             print("{} sizes, {}: {}".format(group, len(data[shop]), data[shop]))
                             print('Recorded lines to database:', recorded_lines, '\n')
 
+        self.db.update_state('instock_runs', run)
+        if self.schedule:  # items of failed requests are due yet
+            scheduler.checked(checked, timestamp)
+
         if DEBUG:
             print('> End update_instock_tables on {}.'.format(tac()))
 
         return True  # if that's all ok
 
-    def export(self, to='csv'):
+    @metrics.measure
+    def export(self, to='csv', file_name=None):
         """
         Serialized and export to file for connect to marketplace API and retail services ('InSales', example).
         'to' parameter may be:
             'json'-- export to json file
             'xml'-- export to xml file
             'csv'-- export to csv file
+            'parquet' or 'npz'-- columnar export of products, prices and its history to directory (see columnar.py),
+            'parquet' is written as 'npz', if pyarrow is not installed
+        'file_name'-- an optional path to file, settings.JSON_FILE, XML_FILE or CSV_FILE in parent dir as default
+        (settings.COLUMNAR_DIR to 'parquet' and 'npz')
         """
 
         # real path to json file. If json file should be a parent dir,
@@ -325,27 +466,14 @@ class Main:
 
             import json
             from settings import JSON_FILE
-            file_name = os.path.join(parent_dir, JSON_FILE)  # path + file with any OS
+            file_name = file_name or os.path.join(parent_dir, JSON_FILE)  # path + file with any OS
 
             card_description = dict()
             for card in self.db.export_card_and_price():
-                code = card[0]
+                code = card.code
                 item_available = self.db.export_available(code)
                 if item_available:  # if products in stock
-                    card_description[code] = dict()
-                    card_description[code]['code'] = card[0]
-                    card_description[code]['model'] = card[1]
-                    card_description[code]['brand'] = card[2]
-                    card_description[code]['price'] = card[3]
-                    card_description[code]['url'] = card[4]
-                    card_description[code]['img'] = card[5]
-                    card_description[code]['age'] = card[6]
-                    card_description[code]['gender'] = card[7]
-                    card_description[code]['year'] = card[8]
-                    card_description[code]['use'] = card[9]
-                    card_description[code]['pronation'] = card[10]
-                    card_description[code]['article'] = card[11]
-                    card_description[code]['season'] = card[12]
+                    card_description[code] = card._asdict()
                     card_description[code]['available'] = item_available  # get shops and items available by code
 
             if card_description:  # for a non- empty database
@@ -363,7 +491,7 @@ class Main:
 
             from lxml import etree
             from settings import XML_FILE
-            file_name = os.path.join(parent_dir, XML_FILE)  # path + file with any OS
+            file_name = file_name or os.path.join(parent_dir, XML_FILE)  # path + file with any OS
 
             products = etree.Element('products')
             products.set('source', 'www.kant.ru')
@@ -371,32 +499,32 @@ class Main:
 
             for card in self.db.export_card_and_price():
 
-                available = self.db.export_available(card[0])
+                available = self.db.export_available(card.code)
                 if available:  # if product in stock
                     code = etree.SubElement(products, 'code')
-                    code.set('id', str(card[0]))
-
-                    model = etree.SubElement(code, 'model').text = card[1]
-                    brand = etree.SubElement(code, 'brand').text = card[2]
-                    price = etree.SubElement(code, 'price').text = str(card[3])
-                    if card[4]:
-                        url = etree.SubElement(code, 'url').text = card[4]
-                    if card[5]:
-                        img = etree.SubElement(code, 'img').text = card[5]
-                    if card[6]:
-                        age = etree.SubElement(code, 'age').text = card[6]
-                    if card[7]:
-                        gender = etree.SubElement(code, 'gender').text = card[7]
-                    if card[8]:
-                        year = etree.SubElement(code, 'year').text = str(card[8])
-                    if card[9]:
-                        use = etree.SubElement(code, 'use').text = card[9]
-                    if card[10]:
-                        pronation = etree.SubElement(code, 'pronation').text = card[10]
-                    if card[11]:
-                        article = etree.SubElement(code, 'article').text = card[11]
-                    if card[12]:
-                        season = etree.SubElement(code, 'season').text = card[12]
+                    code.set('id', str(card.code))
+
+                    model = etree.SubElement(code, 'model').text = card.model
+                    brand = etree.SubElement(code, 'brand').text = card.brand
+                    price = etree.SubElement(code, 'price').text = str(card.price)
+                    if card.url:
+                        url = etree.SubElement(code, 'url').text = card.url
+                    if card.img:
+                        img = etree.SubElement(code, 'img').text = card.img
+                    if card.age:
+                        age = etree.SubElement(code, 'age').text = card.age
+                    if card.gender:
+                        gender = etree.SubElement(code, 'gender').text = card.gender
+                    if card.year:
+                        year = etree.SubElement(code, 'year').text = str(card.year)
+                    if card.use:
+                        use = etree.SubElement(code, 'use').text = card.use
+                    if card.pronation:
+                        pronation = etree.SubElement(code, 'pronation').text = card.pronation
+                    if card.article:
+                        article = etree.SubElement(code, 'article').text = card.article
+                    if card.season:
+                        season = etree.SubElement(code, 'season').text = card.season
 
                     instock = etree.SubElement(code, 'available')
                     shops = dict()
@@ -426,7 +554,7 @@ class Main:
 
             import csv
             from settings import CSV_FILE
-            file_name = os.path.join(parent_dir, CSV_FILE)  # path + file with any OS
+            file_name = file_name or os.path.join(parent_dir, CSV_FILE)  # path + file with any OS
 
             card_fields = ('Код', 'Модель', 'Бренд', 'Стоимость', 'Ссылка', 'Картинка', 'Возраст', 'Пол', 'Год',
                 'Назначение', 'Пронация', 'Артикул', 'Сезон')
@@ -445,6 +573,23 @@ class Main:
 
                 return False
 
+        elif to in ('parquet', 'npz'):
+
+            import columnar
+            from settings import COLUMNAR_DIR
+            file_name = file_name or os.path.join(parent_dir, COLUMNAR_DIR)
+
+            report = columnar.export(self.db, file_name, to)
+            if report['rows']['products']:  # for a non- empty database
+                if DEBUG:
+                    print('Columnar files ({}) are updated: {}'.format(report['format'], report['rows']))
+                return True
+            else:
+                print("Database is empty or no database file. Run Main.update_...() methods to filling database, "
+                      "then use this method to export data.")
+
+                return False
+
         else:
             if DEBUG:
                 print("Check 'to' parameter on 'Main.export()' method")
@@ -452,6 +597,91 @@ class Main:
             return False
 
 
+    def serve(self, interval=SERVE_INTERVAL, products_hours=SERVE_PRODUCTS_HOURS, cycles=None) -> int:
+        """
+        Daemon mode instead of one- shot runs by cron: keep event loop, session (connection pool) of parser and last
+        state of tables in memory (see SQLite.cache), update prices and availability of due items (see
+        scheduler.py) every 'interval' sec and 'products' table every 'products_hours' hours. Write report of each cycle
+        (see save_metrics()). Stop after the current update on SIGTERM or SIGINT, or after 'cycles' cycles
+        return count of cycles
+        """
+
+        import signal
+        import threading
+        from aiohttp import ClientConnectionError
+
+        stop = threading.Event()
+        handlers = {signum: signal.signal(signum, lambda *args: stop.set()) for signum in (signal.SIGTERM,
+                                                                                           signal.SIGINT)}
+        self.schedule = True
+        self.loop.run_until_complete(self.parser.open_session())
+        products_updated = 0  # time of the last update of 'products' table
+        cycle = 0
+        try:
+            while not stop.is_set():
+                metrics.reset()
+                try:
+                    if time.time() - products_updated >= products_hours * 60 * 60:
+                        if self.update_products_table():
+                            products_updated = time.time()
+                    if not stop.is_set():
+                        self.update_prices_table()
+                    if not stop.is_set():
+                        self.update_instock_table()
+                except (ClientConnectionError, ConnectionError):  # next try on the next cycle (ConnectionError of queue)
+                    print('ConnectionError. Reconnect on the next cycle..')
+                    metrics.count('retries')
+                cycle += 1
+                save_metrics()
+                if DEBUG:
+                    print('> End of cycle {}.'.format(cycle))
+                if cycles is not None and cycle >= cycles:
+                    break
+                stop.wait(interval)
+        finally:
+            self.loop.run_until_complete(self.parser.close_session())
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        return cycle
+
+
+def save_metrics():
+    """
+    Structured report of the run, see settings.METRICS_FILE and settings.PROMETHEUS_FILE
+    """
+
+    parent_dir = Path(__file__).resolve().parent
+    metrics.save(METRICS_FILE and os.path.join(parent_dir, METRICS_FILE),
+                 PROMETHEUS_FILE and os.path.join(parent_dir, PROMETHEUS_FILE))
+
+
+@contextmanager
+def lock():
+    """
+    Lock file (settings.LOCK_FILE) with process id, while sync or compaction of database is working: fcntl.flock of
+    the file, which is never deleted, so the lock of broken process is released by the system with its files.
+    Yield True if the lock is taken, or False if other living process is working with database
+    """
+
+    file_name = os.path.join(Path(__file__).resolve().parent, LOCK_FILE)
+    fd = os.open(file_name, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:  # other process holds the lock
+            yield False
+            return
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())  # to see, who works with database
+        try:
+            yield True
+        finally:
+            os.ftruncate(fd, 0)
+    finally:
+        os.close(fd)  # and its lock
+
+
 def manager():
     """
     Manager to operate updating 3 functionality for tables and 1 to export
@@ -459,17 +689,36 @@ def manager():
     Main.update_prices_table(),
     Main.update_instock_table(),
     Main.export(),
+    SQLite.compact()-- downsample old history of 'prices' and 'instock_...' tables and vacuum database,
+    SQLite.migrate()-- create tables, columns and indexes of this project (sync and compaction create them too),
+    Main.serve()-- daemon mode, update all tables by cycles until SIGTERM,
+    workqueue.work()-- 'worker' command, parse tasks of the work queue (see '--queue') until SIGTERM,
     with call command line: python main.py with sys.args
     for example: python main.py products
+    Options:
+    --profile -- profile the run (see profiler.py), write settings.PROFILE_FILE and print summary
+    --mock -- work with local mock server instead of www.kant.ru (see mock.py), to profile offline
+    --schedule -- check prices and availability only of due items (see scheduler.py)
+    --new -- 'products' command only adds new items, by first pages of listing (see Main.update_products_table())
+    --db=<file> -- other database file instead of settings.DB_NAME, for example copy of database to '--mock' run
+    --brands=<brand>[,<brand>...] -- work only with these brands, for example: --brands=asics,hoka,brooks
+    --workers=<count> -- parse www.kant.ru by worker processes, one process writes to database (see shard.py)
+    --queue[=<file>] -- parse www.kant.ru by 'worker' processes of any hosts by the work queue (see workqueue.py),
+    settings.QUEUE_DB as default
+    --record[=<dir>] -- save responses of www.kant.ru to the archive (see replay.py), settings.REPLAY_DIR as default
+    --replay[=<dir>] -- responses from the archive instead of www.kant.ru, without network and pauses
+    --pages[=<dir>] -- keep raw product pages of prices and new items (see pages.py), settings.PAGES_DIR as default
     """
 
     try_count = 3  # how many attempts to load page to parse
-    load_prods = load_prices = load_instock = export = target = None
+    load_prods = load_prices = load_instock = export = target = compact = serve = worker = migrate = None
+    profile = mock = schedule = queued = new_only = False
+    db_name = workers = queue = brands = archive = pages = None
     args = sys.argv
 
     if len(args) > 1:
-        for argv in args:
-            argv = argv.lower()
+        for arg in args:
+            argv = arg.lower()
             if argv == 'products':
                 load_prods = True
             elif argv == 'prices':
@@ -478,32 +727,158 @@ def manager():
                 load_instock = True
             elif argv == 'export':
                 export = True
+            elif argv == 'compact':
+                compact = True
+            elif argv == 'migrate':
+                migrate = True
+            elif argv == 'serve':
+                serve = True
+            elif argv == 'worker':
+                worker = True
             elif argv == 'json':
                 target = 'json'
             elif argv == 'xml':
                 target = 'xml'
             elif argv == 'csv':
                 target = 'csv'
-
-    page = Main()
-    if hasattr(page, 'db'):  # normal connect to db
-        for i in range(try_count):
-            try:
-                if load_prods:
-                    load_prods = not page.update_products_table()
-                if load_prices:
-                    load_prices = not page.update_prices_table()
-                if load_instock:
-                    load_instock = not page.update_instock_table()
-            except ClientConnectionError as err:  # as usual may be on mobile connect, local testing, not production
-                print('ConnectionError. Reconnect..')
-                time.sleep(20)
+            elif argv == 'parquet':
+                target = 'parquet'
+            elif argv == 'npz':
+                target = 'npz'
+            elif argv == '--profile':
+                profile = True
+            elif argv == '--mock':
+                mock = True
+            elif argv == '--schedule':
+                schedule = True
+            elif argv == '--new':
+                new_only = True
+            elif argv.startswith('--db='):
+                db_name = arg[len('--db='):]  # path as is, not lower case
+            elif argv.startswith('--brands='):
+                brands = [name for name in arg[len('--brands='):].split(',') if name]
+            elif argv.startswith('--workers='):
+                workers = argv[len('--workers='):]
+                if not workers.isdecimal() or not int(workers):
+                    print('Wrong --workers={}: count of worker processes must be a positive integer.'.format(workers))
+                    return None
+                workers = int(workers)
+            elif argv == '--queue':
+                queued = True
+            elif argv.startswith('--queue='):
+                queued, queue = True, arg[len('--queue='):]
+            elif argv in ('--record', '--replay'):
+                archive = (argv[2:], REPLAY_DIR)
+            elif argv.startswith('--record=') or argv.startswith('--replay='):
+                archive = (argv[2:len('--record')], arg[len('--record='):])
+            elif argv == '--pages':
+                pages = PAGES_DIR
+            elif argv.startswith('--pages='):
+                pages = arg[len('--pages='):]
+
+    def run():
+        nonlocal load_prods, load_prices, load_instock
+        if serve:
+            with lock() as locked:  # the lock is taken while daemon is working, export works with database yet
+                if not locked:
+                    print('Other sync or compaction is working with database now. Try later.')
+                    return None
+                print('Serve, {} cycles.'.format(page.serve()))
+        elif load_prods or load_prices or load_instock or compact or migrate:
+            with lock() as locked:
+                if not locked:
+                    print('Other sync or compaction is working with database now. Try later.')
+                    return None
+                if migrate:
+                    page.db.migrate()
+                if load_prods or load_prices or load_instock:
+                    from aiohttp import ClientConnectionError  # network stack only to sync, not to export or compact
+                    for i in range(try_count):
+                        try:
+                            if load_prods:
+                                load_prods = not page.update_products_table(new_only)
+                            if load_prices:
+                                load_prices = not page.update_prices_table()
+                            if load_instock:
+                                load_instock = not page.update_instock_table()
+                        # as usual may be on mobile connect, local testing; ConnectionError-- not finished tasks of queue
+                        except (ClientConnectionError, ConnectionError) as err:
+                            print('ConnectionError. Reconnect..')
+                            metrics.count('retries')
+                            time.sleep(20)
+                if compact:
+                    report = page.db.compact()
+                    print('Deleted rows: {}. Reclaimed {} bytes.'.format(
+                        ', '.join('{} {}'.format(table, rows) for table, rows in report.items() if table != 'bytes'),
+                        report['bytes']))
         if export:
             if target is not None:
                 page.export(target)
             else:
                 page.export()
 
+    if archive is not None:  # record or replay responses of www.kant.ru
+        import parser
+        from replay import Archive
+        mode, path = archive
+        parser.Parser.archive = Archive(os.path.join(Path(__file__).resolve().parent, path), mode)
+        if mode == 'replay':
+            parser.TIMEOUT = 0  # responses from disk
+
+    if worker:  # without database, only the queue
+        import signal
+        import threading
+        import workqueue
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
+        server = None
+        if mock:
+            from mock import MockKant
+            from parser import Parser
+            server = MockKant().start_thread()
+            Parser.host = server.host
+        try:
+            print('Worker, {} tasks.'.format(workqueue.work(queue, stop=stop)))
+        finally:
+            if server is not None:
+                server.stop_thread()
+        return None
+
+    if queued:
+        from workqueue import QueuedMain
+        page = QueuedMain(queue, db_name=db_name, schedule=schedule or None, brands=brands)
+    elif workers:
+        from shard import ShardedMain  # multiprocessing, only to sharded sync
+        page = ShardedMain(workers, db_name=db_name, schedule=schedule or None, brands=brands)
+    else:
+        page = Main(db_name=db_name, schedule=schedule or None, brands=brands)
+    if hasattr(page, 'db'):  # normal connect to db
+        parent_dir = Path(__file__).resolve().parent
+        if pages is not None:
+            from pages import PageArchive
+            page.pages = PageArchive(os.path.join(parent_dir, pages))
+        server = None
+        if mock:
+            from mock import MockKant  # aiohttp.web, only to offline runs
+            server = MockKant().start_thread()
+            page.parser.host = server.host
+        try:
+            if profile:
+                import profiler
+                profiler.print_summary(profiler.profile(run, os.path.join(parent_dir, PROFILE_FILE), SLOW_CALLBACK,
+                                                        PROFILE_TOP, page.loop))
+            else:
+                run()
+        finally:
+            if server is not None:
+                server.stop_thread()
+                page.parser.host = None
+            if workers or queued:
+                page.close()
+
+        save_metrics()
+
 
 if __name__ == "__main__":
 
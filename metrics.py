@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import functools
+import inspect
+from contextlib import contextmanager
+
+# counters of each phase of the run,
+# 'fallbacks'-- responses of unexpected markup, parsed by the full DOM path (see Parser.available_fast()),
+# 'listing_hits'-- prices checked by listing pages, without load of product pages (see Main.update_prices_table())
+COUNTERS = ('requests', 'bytes', 'errors', 'retries', 'parse_seconds', 'rows', 'cache_hits', 'fallbacks',
+            'listing_hits')
+
+
+class Metrics:
+    """
+    Structured report of the run: duration and counters of each phase (Main.update_...(), Main.export(),
+    Parser.parse_...() calls). Counters go to every working phase, so requests of Parser.parse_price() are counted in
+    'parse_price' and in 'update_prices_table' phases too.
+    Use:
+        @metrics.measure  # to method or function, async or not
+        def update_prices_table(self): ...
+        metrics.count('rows', 10)
+        metrics.save('run_report.json', 'kant.prom')
+    """
+
+    def __init__(self):
+
+        self.reset()
+
+    def reset(self):
+
+        self.started = time.time()
+        self.phases = dict()
+        self.active = list()  # names of working phases, nested
+        self.totals = dict.fromkeys(COUNTERS, 0)
+
+    @contextmanager
+    def phase(self, name: str):
+
+        if name not in self.phases:
+            self.phases[name] = dict(calls=0, seconds=0.0, **dict.fromkeys(COUNTERS, 0))
+        self.phases[name]['calls'] += 1
+        self.active.append(name)
+        start = time.perf_counter()
+        try:
+            yield self.phases[name]
+        finally:
+            self.phases[name]['seconds'] += time.perf_counter() - start
+            self.active.remove(name)
+
+    def measure(self, function):
+        """
+        Decorator: each call of function is the phase with function name
+        """
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with self.phase(function.__name__):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(function.__name__):
+                    return function(*args, **kwargs)
+
+        return wrapper
+
+    def count(self, counter: str, value=1):
+
+        self.totals[counter] += value
+        for name in set(self.active):
+            self.phases[name][counter] += value
+
+    @contextmanager
+    def timer(self, counter: str):
+        """
+        Add duration of the block to 'counter', for example: with metrics.timer('parse_seconds'): ...
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(counter, time.perf_counter() - start)
+
+    def report(self) -> dict:
+
+        rounded = lambda values: {key: round(value, 4) if type(value) is float else value
+                                  for key, value in values.items()}
+        return {'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                'seconds': round(time.time() - self.started, 4),
+                'totals': rounded(self.totals),
+                'phases': {name: rounded(values) for name, values in self.phases.items()}}
+
+    def prometheus(self) -> str:
+        """
+        Report in Prometheus text format, to node_exporter textfile collector
+        """
+
+        lines = list()
+        for key in ('calls', 'seconds') + COUNTERS:
+            lines.append('# TYPE kant_phase_{} gauge'.format(key))
+            for name, values in self.phases.items():
+                lines.append('kant_phase_{}{{phase="{}"}} {}'.format(key, name, values[key]))
+        lines.append('# TYPE kant_run_seconds gauge')
+        lines.append('kant_run_seconds {}'.format(round(time.time() - self.started, 4)))
+        lines.append('# TYPE kant_run_timestamp_seconds gauge')
+        lines.append('kant_run_timestamp_seconds {}'.format(int(time.time())))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, json_file=None, prometheus_file=None):
+
+        if json_file:
+            with open(json_file, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+        if prometheus_file:
+            with open(prometheus_file + '.tmp', 'w') as f:  # textfile collector reads only complete files
+                f.write(self.prometheus())
+            os.replace(prometheus_file + '.tmp', prometheus_file)
+
+
+metrics = Metrics()  # metrics of the run, common to main.py, parser.py and db.py
@@ -0,0 +1,218 @@
+import zlib
+import os.path
+import random
+import asyncio
+import threading
+from pathlib import Path
+from aiohttp import web
+
+from settings import BRANDS, NEW_FIRST
+
+# fixtures of www.kant.ru pages: catalog listing, product card and loadTableAvailability.php response, with
+# '{{...}}' values to fill by the mock server
+FIXTURES = os.path.join(Path(__file__).resolve().parent, 'fixtures')
+
+# product code of the item with url 'https://www.kant.ru/catalog/product/<id>/' is id - ID_OFFSET
+ID_OFFSET = 1_400_000
+
+# offline shops names from availability response, same ordering as settings.SHOPS
+SHOP_NAMES = ('м. Нагорная, ул. Нагорная, д. 13', 'м. Тимирязевская, ул. Яблочкова, д. 21',
+              'м. Теплый Стан, ул. Профсоюзная, д. 129а', 'м. Алтуфьево, Алтуфьевское ш., д. 70')
+
+# sizes labels in availability response of different brands, one size chart to each item
+SIZES = (('US:7', 'US:7,5', 'US:8', 'US:8,5', 'US:9', 'US:9,5', 'US:10', 'US:10,5', 'US:11', 'US:12'),
+         ('UK:6', 'UK:6,5', 'UK:7', 'UK:7,5', 'UK:8', 'UK:8,5', 'UK:9', 'UK:10'),
+         ('US:7/8,5', 'US:8/9,5', 'US:9/10,5', 'US:10/11,5', 'US:11/12,5'))
+
+
+def fixture(name: str) -> str:
+
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def fill(template: str, **values) -> str:
+
+    for key, value in values.items():
+        template = template.replace('{{%s}}' % key, str(value))
+    return template
+
+
+class MockKant:
+    """
+    Local aiohttp server instead of www.kant.ru to tests and benchmarks (see bench.py), serves:
+    /catalog/..., /brand/... -- catalog listings by 'PAGEN_1' page, 'per_page' items each, 'pages' pages of every
+        listing url (pages after the last one repeat it, as www.kant.ru does), in reverse order with settings.NEW_FIRST
+        parameters (the last items are new)
+    /catalog/product/<id>/ -- product card with code = id - ID_OFFSET
+    /ajax/loadTableAvailability.php?ID=<id> -- availability of sizes in offline shops
+    Responses are generated from 'fixtures' directory, deterministic by id and 'seed'. Every response waits 'latency'
+    +- 'jitter' sec and fails (503, empty body) with 'error_rate' probability.
+    'churn'-- probability of changed price and availability of the item in each new response
+    Use:
+        async with MockKant(latency=0.01) as server:
+            Parser.host = server.host
+    or with synchronous code (Main methods), the server works in its own thread:
+        server = MockKant().start_thread()
+        Parser.host = server.host
+        ...
+        server.stop_thread()
+    """
+
+    def __init__(self, pages=5, per_page=24, first_id=3_000_000, latency=0.0, jitter=0.0, error_rate=0.0,
+                 churn=0.0, seed=0, port=0):
+
+        self.pages = pages
+        self.per_page = per_page
+        self.first_id = first_id
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.churn = churn
+        self.seed = seed
+        self.port = port  # 0 to any free port
+        self.host = None  # 'http://127.0.0.1:port' after start()
+        self.requests = 0
+        self.sort = True  # listing is sorted by new items by settings.NEW_FIRST parameters, False-- it is ignored
+        self.random = random.Random(seed)
+        self.templates = {name: fixture(name) for name in ('listing.html', 'tile.html', 'product.html',
+                                                           'available.html')}
+        self.runner = None
+        self.loop = self.thread = None
+
+    async def __aenter__(self):
+
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+
+        await self.stop()
+
+    def app(self):
+
+        app = web.Application()
+        app.router.add_get('/catalog/product/{id:\\d+}/', self.product)
+        app.router.add_get('/ajax/loadTableAvailability.php', self.available)
+        app.router.add_get('/{path:.*}', self.listing)
+        return app
+
+    async def start(self):
+
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        self.host = 'http://127.0.0.1:{}'.format(self.port)
+
+    async def stop(self):
+
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def start_thread(self):
+
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def stop_thread(self):
+
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = self.thread = None
+
+    async def wait(self):
+        """
+        Latency and errors of response. Return False to failed response
+        """
+
+        self.requests += 1
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self.random.random() >= self.error_rate
+
+    def item(self, _id: int) -> random.Random:
+        """
+        Deterministic random values of the item, changed with 'churn' probability
+        """
+
+        version = 0
+        if self.churn:
+            version = int(self.random.random() < self.churn)
+        return random.Random('{}-{}-{}'.format(self.seed, _id, version))
+
+    def listing_ids(self, path: str, page: int, new_first=False) -> list:
+
+        if new_first:  # the last items first
+            return self.listing_ids(path, self.pages + 1 - min(page, self.pages))[::-1]
+        brand = zlib.crc32(path.encode()) % 1000  # each listing url has its own items
+        page = min(page, self.pages)  # the last page for pages after the last
+        start = self.first_id + (brand * self.pages + page - 1) * self.per_page
+        return list(range(start, start + self.per_page))
+
+    def name(self, _id: int) -> tuple:
+
+        brand = BRANDS[_id % len(BRANDS)]
+        return 'Кроссовки беговые {} Gel-Model {}'.format(brand, _id % 1000), brand
+
+    async def listing(self, request):
+
+        if not await self.wait():
+            return web.Response(status=503)
+        page = int(request.query.get('PAGEN_1', 1))
+        new_first = self.sort and all(request.query.get(name) == value for name, value in NEW_FIRST.items())
+        tiles = list()
+        for _id in self.listing_ids(request.path, page, new_first):
+            name, brand = self.name(_id)
+            price = '{:,}'.format(self.item(_id).randrange(3000, 20000, 10)).replace(',', ' ')  # as product card
+            tiles.append(fill(self.templates['tile.html'], id=_id, name=name, price=price))
+        html = fill(self.templates['listing.html'], tiles=''.join(tiles), page=page)
+        return web.Response(text=html, content_type='text/html')
+
+    async def product(self, request):
+
+        if not await self.wait():
+            return web.Response(status=503)
+        _id = int(request.match_info['id'])
+        name, brand = self.name(_id)
+        price = '{:,}'.format(self.item(_id).randrange(3000, 20000, 10)).replace(',', ' ')
+        html = fill(self.templates['product.html'], id=_id, code=_id - ID_OFFSET, name=name, brand=brand,
+                    price=price, article='1011B{}-001'.format(_id % 1000))
+        return web.Response(text=html, content_type='text/html')
+
+    async def available(self, request):
+
+        if not await self.wait():
+            return web.Response(status=503)
+        _id = int(request.query.get('ID', 0))
+        values = self.item(_id)
+        chart = SIZES[_id % len(SIZES)]
+        shops = list()
+        for name in SHOP_NAMES:
+            sizes = [size for size in chart if values.random() < 0.4]
+            if sizes:
+                rows = ''.join('\n<tr>\n<td>{}</td>\n<td>{}</td>\n</tr>'.format(size, values.randint(1, 5))
+                               for size in sizes)
+                shops.append('<div class="popur__row">\n<span>{}</span>\n<span>в наличии</span>\n</div>\n'
+                             '<table class="popur__table">{}\n</table>'.format(name, rows))
+            else:
+                shops.append('<div class="popur__row">\n<span>{}</span>\n<span>нет в наличии</span>\n</div>'.format(
+                    name))
+        html = fill(self.templates['available.html'], shops='\n'.join(shops))
+        return web.Response(text=html, content_type='text/html')
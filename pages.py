@@ -0,0 +1,158 @@
+import os
+import zlib
+import mmap
+import glob
+import fcntl
+import time
+import struct
+
+from known import url_id
+from settings import PAGES_DIR, PAGES_RETENTION_DAYS, PAGES_LEVEL
+
+# entry of offset index of segment: id of url of product (see known.py), timestamp of rows as integer
+# (2021-11-09 12:30:45 -> 20211109123045), offset and size of compressed page in segment file
+ENTRY = struct.Struct('<qqqi')
+
+# gzip format of zlib (wbits 16 + 15): each page is a gzip member, segment file is a valid gzip stream too
+WBITS = 31
+
+
+def stamp(timestamp: str) -> int:
+    """
+    Timestamp of rows of database ('%Y-%m-%d %H:%M:%S') as integer of its digits
+    """
+
+    return int(''.join(filter(str.isdigit, timestamp)))
+
+
+class PageArchive:
+    """
+    Archive of raw html of product pages, which parse_price() and parse_details() saw (see Parser.fetch()), to audit
+    changes of prices. Pages are compressed each by itself and appended to one segment file of a day
+    ('2021-11-09.seg'), the offset index of segment ('2021-11-09.idx') keeps id of url of product, timestamp, offset
+    and size of each page (see ENTRY). Both files are only appended under the lock of segment file (see put()), so
+    worker processes of one host (see shard.py) write to the same segment, and are read by mmap: a page is
+    decompressed from its place in the segment without reading of the whole file. Segments older than 'retention_days'
+    are deleted with its index, when a segment of a new day is created.
+    Pages are stamped by 'stamp' (see Main.stamp_pages()): the same timestamp as of 'prices' rows derived from them,
+    so the page of a price is found by its row and 'products.url_id' (see Main.price_page()).
+    Use:
+        pages = PageArchive('pages')
+        pages.stamp = '2021-11-09 12:30:45'
+        pages.put('https://www.kant.ru/catalog/product/3052137/', html)
+        pages.get(3052137, '2021-11-09 12:30:45')  # html or None
+    """
+
+    def __init__(self, path=PAGES_DIR, retention_days=PAGES_RETENTION_DAYS):
+
+        self.path = path
+        self.retention_days = retention_days
+        self.stamp = None  # timestamp of pages to put, the current time as default
+
+    def segment(self, timestamp: str) -> str:
+        """
+        Name of segment file of the day of 'timestamp', without extension
+        """
+
+        return os.path.join(self.path, timestamp[:10])
+
+    def put(self, url: str, text: str):
+        """
+        Append page of product 'url' to segment of 'stamp', other urls are skipped
+        """
+
+        _id = url_id(url)
+        if _id is None:
+            return
+        timestamp = self.stamp or time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        segment = self.segment(timestamp)
+        if not os.path.isfile(segment + '.seg'):  # the first page of a day
+            os.makedirs(self.path, exist_ok=True)
+            self.prune(timestamp)
+        compressor = zlib.compressobj(PAGES_LEVEL, zlib.DEFLATED, WBITS)
+        body = compressor.compress(text.encode('utf-8')) + compressor.flush()
+        seg = os.open(segment + '.seg', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # other writers wait for the page and its entry of index: offset is the size of segment under the lock
+            fcntl.flock(seg, fcntl.LOCK_EX)
+            offset = os.fstat(seg).st_size
+            self.write(seg, body)
+            idx = os.open(segment + '.idx', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                self.write(idx, ENTRY.pack(_id, stamp(timestamp), offset, len(body)))
+            finally:
+                os.close(idx)
+        finally:
+            os.close(seg)  # and its lock
+
+    @staticmethod
+    def write(fd: int, data: bytes):
+        """
+        Unbuffered write of all 'data' to file descriptor
+        """
+
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+    def find(self, _id: int, timestamp: str):
+        """
+        Place of the last page of product '_id' with 'timestamp' in its segment
+        return offset, size or None
+        """
+
+        index = self.map(self.segment(timestamp) + '.idx')
+        if index is None:
+            return None
+        found = None
+        key = (_id, stamp(timestamp))
+        with index:
+            for entry_id, entry_stamp, offset, size in ENTRY.iter_unpack(index):
+                if (entry_id, entry_stamp) == key:
+                    found = offset, size
+        return found
+
+    def get(self, _id: int, timestamp: str):
+        """
+        Page of product '_id' (id of its url), which was put with 'timestamp'
+        return html or None, if it is not in the archive
+        """
+
+        found = self.find(_id, timestamp) if _id is not None else None
+        segment = self.map(self.segment(timestamp) + '.seg') if found is not None else None
+        if segment is None:
+            return None
+        offset, size = found
+        with segment, memoryview(segment) as view, view[offset:offset + size] as body:  # without copy of page
+            return zlib.decompress(body, WBITS).decode('utf-8')
+
+    @staticmethod
+    def map(file_name: str):
+        """
+        Read only mmap of file, None to empty or not existing file (mmap can't map it)
+        """
+
+        if not os.path.isfile(file_name) or not os.path.getsize(file_name):
+            return None
+        with open(file_name, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # map stays valid after close of file
+
+    def prune(self, timestamp: str) -> list:
+        """
+        Delete segments of days before 'retention_days' of day of 'timestamp'
+        return names of deleted segments
+        """
+
+        day = time.mktime(time.strptime(timestamp[:10], '%Y-%m-%d'))
+        cutoff = time.strftime('%Y-%m-%d', time.localtime(day - self.retention_days * 24 * 60 * 60))
+        deleted = list()
+        for file_name in sorted(glob.glob(os.path.join(self.path, '????-??-??.seg'))):
+            segment = file_name[:-len('.seg')]
+            if os.path.basename(segment) < cutoff:
+                for extension in ('.idx', '.seg'):
+                    try:
+                        os.remove(segment + extension)
+                    except FileNotFoundError:  # deleted by other process
+                        pass
+                deleted.append(os.path.basename(segment))
+        return deleted
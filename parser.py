@@ -1,38 +1,139 @@
+import re
 import time
 import asyncio
 import aiohttp
 from lxml import html as lxml_html
 
-from settings import DEBUG, RATING, CHUNK, TIMEOUT, AVAILABLE, BRANDS, SHOPS
+from known import url_id
+from records import Product, Tile
+from sizes import normal_size
+from metrics import metrics
+from settings import DEBUG, RATING, CHUNK, NEW_ONLY_CHUNK, NEW_FIRST, TIMEOUT, AVAILABLE, BRANDS, SHOPS
 
 if DEBUG:
     tic = lambda: time.time()
 
+# Fast path of AVAILABLE response (see Parser.available_fast()): the content of Moscow tab is the flat list of
+# '<div class="popur__row">' (shop and 'в наличии'/ 'нет в наличии') and '<table>' (sizes of shop in stock)
+AVAILABLE_TAB = re.compile(r'<div\b[^>]*\bdata-tab="tab958"[^>]*>')
+AVAILABLE_ITEM = re.compile(r'\s*(?:<div class="popur__row">(?P<row>.*?)</div>|<table\b[^>]*>(?P<table>.*?)</table>|'
+                            r'(?P<end></div>))', re.S)
+AVAILABLE_TABLE = re.compile(r'(?:\s*<tr\b[^>]*>[^&]*?</tr>)*\s*')
+AVAILABLE_TAG = re.compile(r'<[^>]*>')
+
+# shop names in AVAILABLE response by SHOPS order
+SHOP_NAMES = ('нагорная', 'тимирязевская', 'теплый стан', 'алтуфьево')
+
 
 class Parser:
 
+    # Other host instead of www.kant.ru to all requests, for example local mock server to tests and benchmarks:
+    # Parser.host = 'http://127.0.0.1:8080'
+    host = None
+
+    # Session (connection pool) common to all requests of long- running process, see Main.serve(). None to new session
+    # to each request
+    session = None
+
+    # Limit of requests rate common to worker processes (see shard.RateLimiter), None without limit
+    limiter = None
+
+    # Archive of responses (see replay.Archive): 'record' mode saves each response, 'replay' mode serves responses from
+    # the archive without network. None to work with www.kant.ru only
+    archive = None
+
+    # Archive of raw product pages (see pages.PageArchive), which parse_price() and parse_details() saw. None as default
+    pages = None
+
     @staticmethod
-    async def parse_main(urls: list, finish: int) -> list:
+    async def open_session():
 
-        async def main_page_urls(_url: str, _params: int) -> list:
+        if Parser.session is None:
+            Parser.session = aiohttp.ClientSession()
 
-            urls = list()
-            async with aiohttp.ClientSession() as session:
-                async with session.get(_url, params={'PAGEN_1': _params}) as response:
-                    html = await response.text()
-            if "kant__catalog__item" in html:  # find urls from all shoes items on page
-                tree = lxml_html.fromstring(html)
-                a_tags = tree.xpath("//div[@class='kant__catalog__item']//a")  # links for smth items
-                for item in a_tags:
-                    name = item.values()[1].lower()
-                    if 'кроссовки' in name or 'марафонки' in name:
-                        # get useful urls to solution
-                        item_url = 'https://www.kant.ru{}'.format(item.values()[0])
-                        urls.append(item_url)
-            else:  # its not page with running shoes. Stop coroutines!
-                return list()
-
-            return urls
+    @staticmethod
+    async def close_session():
+
+        if Parser.session is not None:
+            await Parser.session.close()
+            Parser.session = None
+
+    @staticmethod
+    async def fetch(url: str, params=None) -> str:
+        """
+        Load page by url (and its query params). All requests of Parser to www.kant.ru go through this method
+        return html of page
+        """
+
+        archive = Parser.archive
+        if archive is not None and archive.mode == 'replay':
+            status, text = archive.get(url, params)
+            metrics.count('requests')
+            metrics.count('bytes', len(text.encode('utf-8')))
+            if status >= 400:
+                metrics.count('errors')
+            return text
+
+        kant_url = url  # key of the archive
+        if Parser.host is not None:
+            url = Parser.host + url.partition('www.kant.ru')[2]
+        if Parser.limiter is not None:
+            await Parser.limiter.wait()
+        metrics.count('requests')
+        session = Parser.session or aiohttp.ClientSession()
+        try:
+            async with session.get(url, params=params) as response:
+                metrics.count('bytes', len(await response.read()))
+                if response.status >= 400:
+                    metrics.count('errors')
+                text = await response.text()
+                if archive is not None:
+                    archive.put(kant_url, params, response.status, text)
+                if Parser.pages is not None and response.status < 400 and not params:  # product pages only
+                    # compression and write under the lock of segment out of event loop
+                    await asyncio.get_running_loop().run_in_executor(None, Parser.pages.put, kant_url, text)
+                return text
+        finally:
+            if session is not Parser.session:
+                await session.close()
+
+    @staticmethod
+    @metrics.measure
+    async def parse_main(urls: list, finish: int, known=None) -> list:
+        """
+        Items of listing 'urls', 'finish' pages of each listing url at most: [Tile(id, name, price, available), ...],
+        id of url of item (see known.py), its price and availability hint of listing page, see
+        Main.update_prices_table()
+        'known'-- ids of urls of known items (see known.py) to find only new items: listing is requested sorted by new
+        items first (settings.NEW_FIRST), so paging of listing url stops after the page of only known items. Only if
+        the listing is really sorted by new items: ids of items (growing by new items) are descending from the first
+        item of listing url to the last one of the page, else all pages are parsed
+        """
+
+        async def main_page_tiles(_url: str, _params: int) -> list:
+
+            tiles = list()
+            html = await Parser.fetch(_url, dict(order, PAGEN_1=_params))
+            with metrics.timer('parse_seconds'):
+                if "kant__catalog__item" in html:  # find urls from all shoes items on page
+                    tree = lxml_html.fromstring(html)
+                    for tile in tree.xpath("//div[@class='kant__catalog__item']"):  # tile of each item
+                        for item in tile.xpath(".//a"):  # links for smth items
+                            name = item.values()[1]
+                            if 'кроссовки' in name.lower() or 'марафонки' in name.lower():
+                                # get useful items to solution, by id of its url '/catalog/product/<id>/'
+                                _id = url_id(item.values()[0])
+                                if _id is not None:
+                                    price = ''.join(''.join(tile.xpath(
+                                        ".//div[@class='kant__catalog__item__price']/span[1]/text()")).split())
+                                    price = int(price) if price.isdecimal() else 0
+                                    sold_out = 'нет в наличии' in tile.text_content().lower()
+                                    tiles.append(Tile(_id, name, price, price > 0 and not sold_out))
+                                break  # one item of tile
+                else:  # its not page with running shoes. Stop coroutines!
+                    return list()
+
+                return tiles
 
         # Check correct input data
         if type(urls) is not list:
@@ -51,39 +152,53 @@ class Parser:
 
         # start parsing urls by chunk of tasks
         chunk = CHUNK
-        solution_urls = list()
+        order = dict()  # default order of listing
+        if known is not None:
+            known = set(known)
+            chunk = NEW_ONLY_CHUNK  # less pages after the last page with new items
+            order = NEW_FIRST
+        solution = list()
         all_urls = len(urls)
         for i, page_url in enumerate(urls):
             tasks = list()
-            items_urls = list()
+            items = list()
+            items_ids = set()
+            newest_first = known is not None  # ids of items of this listing url are descending yet
             do_search = True
             for pagination in range(1, finish+1):  # go for pages of each item url
                 if DEBUG:
                     # progress bar
                     print('\r{}, progress: {}/ {}. Now {}-th page of {}\r'.format(
                         tac(), i+1, all_urls, pagination, page_url[20:]), end='')
-                tasks.append(asyncio.create_task(main_page_urls(page_url, pagination)))
+                tasks.append(asyncio.create_task(main_page_tiles(page_url, pagination)))
                 if len(tasks) == chunk or pagination == finish:
-                    new_urls = await asyncio.gather(*tasks)
-                    for urls in new_urls:
+                    new_tiles = await asyncio.gather(*tasks)
+                    for tiles in new_tiles:
                         # if links is finded and first element is not repeated in the set of the same main url
                         # then keep looking
-                        if urls and urls[0] not in items_urls:
-                            items_urls.extend(urls)
+                        if tiles and tiles[0].id not in items_ids:
+                            ids = ([items[-1].id] if items else list()) + [tile.id for tile in tiles]
+                            newest_first = newest_first and all(a > b for a, b in zip(ids, ids[1:]))
+                            items.extend(tiles)
+                            items_ids.update(tile.id for tile in tiles)
+                            # next pages have only known items too, if the site sorted listing by new items
+                            if newest_first and all(tile.id in known for tile in tiles):
+                                do_search = False
                         # finish searching, because it is already repeated or empty task
                         else:
                             do_search = False
-                    solution_urls.extend(items_urls)  # extend items set within this brand
                     tasks = list()
                     await asyncio.sleep(TIMEOUT)
                 if not do_search:  # exit from pagination if empty tasks or repeat items content
                     break
+            solution.extend(items)  # extend items set within this brand
         if DEBUG:
-            print('>>> End parse_main on {} sec. Find {} urls.\n'.format(tac(), len(solution_urls)))
-        return solution_urls
+            print('>>> End parse_main on {} sec. Find {} items.\n'.format(tac(), len(solution)))
+        return solution
 
     @staticmethod
-    async def parse_details(urls: list) -> list:
+    @metrics.measure
+    async def parse_details(urls: list, timestamp=None) -> list:
         """
         Parsed list urls, format 'https://www.kant.ru/catalog/product/123456(78)/'
         to full details info:
@@ -100,91 +215,94 @@ class Parser:
         article-- unic value within model name of brand
         season-- 'лето', 'демисезон', 'зима' and more
         rating-- program rate for ordering and analytics items data by changes prices of items or change availability
-        timestamp-- stamp to update
+        timestamp-- stamp to update: 'timestamp' argument (the same as of archived pages, see Main.stamp_pages()), or
+        the current time
 
-        return items info by list of tuples
+        return items info by list of records.Product
         """
 
         async def parse(_url: str, _timestamp: str) -> tuple:
             """
             Parsed url of item by aiohttp.ClientSession.get and lxml.html
-            return tuple of full item info
+            return records.Product of full item info
             """
-            async with aiohttp.ClientSession() as session:
-                async with session.get(_url) as response:
-                    html = await response.text()
-            if not html:
-                return None, None  # output need tuple return, full description item card
-            code = brand = model = img = None
-            age = gender = article = season = use = pronation = ''
-            year = 0
-            tree = lxml_html.fromstring(html)
-            running = False  # are the running shoes for sure?
-            # commons attrs from xpath objs: values, text, xpath, text_content, keys, label, items, base, attrib
-            for item in tree.xpath("//div[@class='kant__product__detail-item']"):  # product description card
-                column = item.xpath("span[1]/text()")[0]
-                if len(item.xpath("span[2]/text()")) > 0:
-                    value = item.xpath("span[2]/text()")[0]
-                    if (column == 'Назначение' and 'бег' in value) or \
-                            (column == 'Тип' and 'кроссовки' in value or 'марафонки' in value):
-                        running = True
-                    if column == 'Бренд':
-                        brand = value.lower()
-            if running:  # card description found!
-                name = tree.xpath("//div[@id='kantMainCardProduct']/h1/text()")[0].lower()
-                if brand is None:
-                    if 'кроссовки' in name or 'марафонки' in name:
-                        temp = [i for i in name.split() if i in [j.lower() for j in BRANDS]]  # brandname from item name
-                        if temp:
-                            brand = temp[0]
-                model = name.partition(brand)[2].strip()
-                brand = brand.title()
-                code = tree.xpath("//div[@class='kant__product__code']/strong/text()")[0]
-                code = int(code) if code.isdecimal() else 0
-                if tree.xpath("//div[@class='kant__product__color__thumbs']//img"):
-                    img = 'https://www.kant.ru' + \
-                          tree.xpath("//div[@class='kant__product__color__thumbs']//img")[0].values()[0]
-                else:
-                    img = 'https://www.kant.ru'
-                for item in tree.xpath("//div[@class='kant__product__detail-item']"):
-                    column = str(item.xpath("span[1]/text()")[0])
+            html = await Parser.fetch(_url)
+            with metrics.timer('parse_seconds'):
+                if not html:
+                    return None, None  # output need tuple return, full description item card
+                code = brand = model = img = None
+                age = gender = article = season = use = pronation = ''
+                year = 0
+                tree = lxml_html.fromstring(html)
+                running = False  # are the running shoes for sure?
+                # commons attrs from xpath objs: values, text, xpath, text_content, keys, label, items, base, attrib
+                for item in tree.xpath("//div[@class='kant__product__detail-item']"):  # product description card
+                    column = item.xpath("span[1]/text()")[0]
                     if len(item.xpath("span[2]/text()")) > 0:
-                        value = str(item.xpath("span[2]/text()")[0])
-                        if column == 'Возраст':
-                            age = value
-                        if column == 'Пол':
-                            gender = value
-                        # sometimes year like 2021-22 (not 2021, or not 2022), produces on 2021 (earlest date)
-                        # in fact. So set one first earliest date
-                        if column == 'Модельный год':
-                            value = value.partition('-')[0]
-                            year = int(value) if value.isdecimal() else 0
-                        if column == 'Покрытие':
-                            use = value
-                        if column == 'Пронация':
-                            pronation = value
-                        if column == 'Артикул':
-                            article = value
-                        if column == 'Сезон':
-                            season = value
-                # special to Saucony brand:
-                if brand == 'Saucony' and model.startswith('s-'):
-                    age = 'junior' if age == '' else age
-                # end special Saucony
-                #
-                # special to Hoka brand:
-                if brand == 'Hoka':
-                    if model.startswith('m '):
-                        gender = 'man' if gender == '' else gender
-                    elif model.startswith('w '):
-                        gender = 'woman' if gender == '' else gender
-                    model = model[2:]
-                # end special Hoka
-                # TODO more specific setting for other brands or other keys or agregate more column to one in future
-
-            return code, brand, model, _url, img, age, gender, year, use, pronation, article, season, RATING, _timestamp
-
-        # check urls content on correct with prev call func parse_main.main_page_urls
+                        value = item.xpath("span[2]/text()")[0]
+                        if (column == 'Назначение' and 'бег' in value) or \
+                                (column == 'Тип' and 'кроссовки' in value or 'марафонки' in value):
+                            running = True
+                        if column == 'Бренд':
+                            brand = value.lower()
+                if running:  # card description found!
+                    name = tree.xpath("//div[@id='kantMainCardProduct']/h1/text()")[0].lower()
+                    if brand is None:
+                        if 'кроссовки' in name or 'марафонки' in name:
+                            # brandname from item name
+                            temp = [i for i in name.split() if i in [j.lower() for j in BRANDS]]
+                            if temp:
+                                brand = temp[0]
+                    model = name.partition(brand)[2].strip()
+                    brand = brand.title()
+                    code = tree.xpath("//div[@class='kant__product__code']/strong/text()")[0]
+                    code = int(code) if code.isdecimal() else 0
+                    if tree.xpath("//div[@class='kant__product__color__thumbs']//img"):
+                        img = 'https://www.kant.ru' + \
+                              tree.xpath("//div[@class='kant__product__color__thumbs']//img")[0].values()[0]
+                    else:
+                        img = 'https://www.kant.ru'
+                    for item in tree.xpath("//div[@class='kant__product__detail-item']"):
+                        column = str(item.xpath("span[1]/text()")[0])
+                        if len(item.xpath("span[2]/text()")) > 0:
+                            value = str(item.xpath("span[2]/text()")[0])
+                            if column == 'Возраст':
+                                age = value
+                            if column == 'Пол':
+                                gender = value
+                            # sometimes year like 2021-22 (not 2021, or not 2022), produces on 2021 (earlest date)
+                            # in fact. So set one first earliest date
+                            if column == 'Модельный год':
+                                value = value.partition('-')[0]
+                                year = int(value) if value.isdecimal() else 0
+                            if column == 'Покрытие':
+                                use = value
+                            if column == 'Пронация':
+                                pronation = value
+                            if column == 'Артикул':
+                                article = value
+                            if column == 'Сезон':
+                                season = value
+                    # special to Saucony brand:
+                    if brand == 'Saucony' and model.startswith('s-'):
+                        age = 'junior' if age == '' else age
+                    # end special Saucony
+                    #
+                    # special to Hoka brand:
+                    if brand == 'Hoka':
+                        if model.startswith('m '):
+                            gender = 'man' if gender == '' else gender
+                        elif model.startswith('w '):
+                            gender = 'woman' if gender == '' else gender
+                        model = model[2:]
+                    # end special Hoka
+                    # TODO more specific setting for other brands or other keys or agregate more column to one in
+                    #  future
+
+                return Product(code, brand, model, _url, img, age, gender, year, use, pronation, article, season,
+                               RATING, _timestamp)
+
+        # check urls content on correct with prev call func parse_main.main_page_tiles
         if type(urls) is not list:
             raise TypeError
         # check url format
@@ -197,7 +315,7 @@ class Parser:
         all_urls = len(urls)
         products = list()
         tasks = list()
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        timestamp = timestamp or time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         for i, url in enumerate(urls):
             tasks.append(asyncio.create_task(parse(url, timestamp)))
             if len(tasks) == CHUNK or i+1 == all_urls:
@@ -211,25 +329,25 @@ class Parser:
         if DEBUG:
             print('>>> End parse_details on {} sec. Parsed {} items.\n'.format(tac(), len(products)))
 
-        return products  # [(code, brand, model, url, img, age..), (code, brand, model, ..), ...,]
+        return products  # [Product(code, brand, model, url, img, age..), Product(code, brand, model, ..), ...,]
 
     @staticmethod
+    @metrics.measure
     async def parse_price(codes_urls: list) -> list:
 
         async def get_and_parse(code, url: str) -> tuple:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    html = await response.text()
-            if not html:
-                return None, None
-            tree = lxml_html.fromstring(html)
-            if tree.xpath("//div[@class='kant__product__price']/span[2]/text()"):
-                price = ''.join(tree.xpath("//div[@class='kant__product__price']/span[2]/text()")[0].split(' '))
-                price = int(price) if price.isdecimal() else 0
-            else:
-                price = 0
+            html = await Parser.fetch(url)
+            with metrics.timer('parse_seconds'):
+                if not html:
+                    return None, None
+                tree = lxml_html.fromstring(html)
+                if tree.xpath("//div[@class='kant__product__price']/span[2]/text()"):
+                    price = ''.join(tree.xpath("//div[@class='kant__product__price']/span[2]/text()")[0].split(' '))
+                    price = int(price) if price.isdecimal() else 0
+                else:
+                    price = 0
 
-            return code, price
+                return code, price
 
         # check correct income data, types of pairs: '(code, url)'
         if not (type(codes_urls) is list and type(codes_urls[0]) is tuple and type(codes_urls[0][0]) is int
@@ -261,78 +379,143 @@ class Parser:
         return products  # [(code, price), (code, price)...]
 
     @staticmethod
-    async def parse_available(codes: list)-> list:
+    def available_size(row_list: list, brand=None) -> tuple:
+        """
+        US size (see sizes.normal_size()) and count of table row of AVAILABLE response, split to words: ['US:9,5', '3']
+        or ['US:9,5', 'шт.', '3']
+        """
+
+        return normal_size(row_list[0], brand), int(row_list[1]) if len(row_list) == 2 else int(row_list[2])
+
+    @staticmethod
+    def available_dom(html: str, brand=None) -> dict:
+        """
+        Sizes in stock of each shop by lxml tree of AVAILABLE response, works with any markup. 'brand'-- brand of the
+        item to its size chart (see sizes.py)
+        return {shop: [(size, count), ...]}
+        """
+
+        tree = lxml_html.fromstring(html)
+        popur_row_div = tree.xpath("//div[@data-tab='tab958']/div")  # div class = popur__row
+
+        tables = tree.xpath("//div[@data-tab='tab958']/table")
+        table_index = 0
+        shops = SHOPS
+        shop = None
+        in_stock = dict()
+        for i, div in enumerate(popur_row_div):
+            div_content = div.text_content().lower()
+            if 'нагорная' in div_content:
+                if 'нет в наличии' not in div_content:
+                    shop = shops[0]
+                else:
+                    continue
+            if 'тимирязевская' in div_content:
+                if 'нет в наличии' not in div_content:
+                    shop = shops[1]
+                else:
+                    continue
+            if 'теплый стан' in div_content:
+                if 'нет в наличии' not in div_content:
+                    shop = shops[2]
+                else:
+                    continue
+            if 'алтуфьево' in div_content:
+                if 'нет в наличии' not in div_content:
+                    shop = shops[3]
+                else:
+                    break
+            in_stock[shop] = list()
+            table = tables[table_index]
+            table_index += 1
+            tr = table.xpath("tr")
+
+            for row in tr:
+                row_list = row.text_content().split()
+                if len(row_list) == 2 or len(row_list) == 3:  # size and availability found!
+                    in_stock[shop].append(Parser.available_size(row_list, brand))
+
+        return in_stock
+
+    @staticmethod
+    def available_fast(html: str, brand=None) -> dict:
+        """
+        The same as available_dom() by precompiled patterns, without lxml tree: AVAILABLE is the most frequent request,
+        its response is small and regular. Any unexpected markup (other tags in Moscow tab, nested tags, html entities,
+        unknown shop) stops parsing
+        return {shop: [(size, count), ...]} or None to parse by available_dom()
+        """
+
+        tab = AVAILABLE_TAB.search(html)
+        if tab is None or AVAILABLE_TAB.search(html, tab.end()) is not None:
+            return None
+        rows, tables = list(), list()
+        position = tab.end()
+        while True:
+            item = AVAILABLE_ITEM.match(html, position)
+            if item is None or '&' in item.group(0):
+                return None
+            position = item.end()
+            if item.group('end') is not None:  # end of Moscow tab
+                break
+            if item.group('row') is not None:
+                if '<div' in item.group('row'):
+                    return None
+                rows.append(AVAILABLE_TAG.sub('', item.group('row')).lower())
+            else:
+                tables.append(item.group('table'))
+
+        table_index = 0
+        in_stock = dict()
+        for div_content in rows:
+            names = [i for i, name in enumerate(SHOP_NAMES) if name in div_content]
+            if len(names) != 1:
+                return None
+            if 'нет в наличии' in div_content:
+                if names[0] == 3:  # as available_dom()
+                    break
+                continue
+            if table_index == len(tables):
+                return None
+            table = tables[table_index]
+            table_index += 1
+            # only rows in table, not nested
+            if AVAILABLE_TABLE.fullmatch(table) is None or table.count('<tr') != table.count('</tr>') or \
+                    '<table' in table or '<tbody' in table:
+                return None
+            sizes = list()
+            # text of each row, as tr.text_content()
+            for row in AVAILABLE_TAG.sub('', table.replace('</tr>', '\0')).split('\0')[:-1]:
+                row_list = row.split()
+                if len(row_list) == 2 or len(row_list) == 3:  # size and availability found!
+                    sizes.append(Parser.available_size(row_list, brand))
+            in_stock[SHOPS[names[0]]] = sizes
+
+        return in_stock
+
+    @staticmethod
+    @metrics.measure
+    async def parse_available(codes: list, brands=None)-> list:
+        """
+        Sizes in stock of each shop of each item: codes-- [(code, instock_code), ...], 'brands'-- {code: brand} to size
+        charts of brands (see sizes.py)
+        return [(code, {shop: [(US size, count), ...]}), ...]
+        """
+
+        brands = brands or dict()
 
         async def parse_instock(_code: int, _instock_code: int) -> tuple:
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(AVAILABLE, params={'ID': _instock_code}) as response:
-                    html = await response.text()
-            if not html:
-                return None, None
-            tree = lxml_html.fromstring(html)
-            popur_row_div = tree.xpath("//div[@data-tab='tab958']/div")  # div class = popur__row
-
-            tables = tree.xpath("//div[@data-tab='tab958']/table")
-            table_index = 0
-            shops = SHOPS
-            shop = None
-            in_stock = dict()
-            for i, div in enumerate(popur_row_div):
-                div_content = div.text_content().lower()
-                if 'нагорная' in div_content:
-                    if 'нет в наличии' not in div_content:
-                        shop = shops[0]
-                    else:
-                        continue
-                if 'тимирязевская' in div_content:
-                    if 'нет в наличии' not in div_content:
-                        shop = shops[1]
-                    else:
-                        continue
-                if 'теплый стан' in div_content:
-                    if 'нет в наличии' not in div_content:
-                        shop = shops[2]
-                    else:
-                        continue
-                if 'алтуфьево' in div_content:
-                    if 'нет в наличии' not in div_content:
-                        shop = shops[3]
-                    else:
-                        break
-                in_stock[shop] = list()
-                table = tables[table_index]
-                table_index += 1
-                tr = table.xpath("tr")
-
-                for row in tr:
-                    row_list = row.text_content().split()
-                    row_count = len(row_list)
-                    if row_count == 2 or row_count == 3:  # size and availability found!
-                        size_temp = row_list[0].lower()
-
-                        # special for 'Hoka' brand:
-                        #  incoming size format: US:11/12
-                        if '/' in size_temp:
-                            size_temp = size_temp.partition('/')[0]
-                        # end special for 'Hoka'
-
-                        size = None
-                        # sizes to database oriented (converter) to US size
-                        if size_temp.startswith('us'):
-                            size = float(size_temp.split(':')[1].replace(',', '.', 1))
-                        # transform to US size
-                        if size_temp.startswith('uk'):
-                            size = float(size_temp.split(':')[1].replace(',', '.', 1)) + 1
-                        # junior size
-                        elif size_temp.startswith('k'):
-                            size = float(size[1:])
-                        # TODO convert to US size!  Junior shoes, as usual
-                        if size_temp.startswith('eur'):
-                            size = float(size_temp.split(':')[1].replace(',', '.', 1))
-                        in_stock[shop].append((size, int(row_list[1]) if row_count == 2 else int(row_list[2])))
-
-            return _code, in_stock
+            html = await Parser.fetch(AVAILABLE, {'ID': _instock_code})
+            with metrics.timer('parse_seconds'):
+                if not html:
+                    return None, None
+                in_stock = Parser.available_fast(html, brands.get(_code))
+                if in_stock is None:  # unexpected markup
+                    metrics.count('fallbacks')
+                    in_stock = Parser.available_dom(html, brands.get(_code))
+
+                return _code, in_stock
 
         # correct data, for testing
         item = codes[0]
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+
+# modules of the project, its functions are grouped by module name, other functions by package name: 'aiohttp', 'lxml',
+# 'asyncio', 'sqlite3', ...
+MODULES = ('main', 'parser', 'db', 'records', 'metrics', 'mock', 'bench', 'profiler', 'sizes', 'shard', 'workqueue',
+           'brands', 'known', 'replay', 'pages')
+
+PROJECT_DIR = Path(__file__).resolve().parent
+
+STDLIB_DIR = Path(os.__file__).resolve().parent
+
+# built-in (C) functions by part of its name: "<method 'execute' of 'sqlite3.Cursor' objects>". 'wait'-- event loop
+# waits for network or asyncio.sleep() (settings.TIMEOUT)
+BUILTINS = (('sqlite3', 'sqlite3'), ('lxml', 'lxml'), ('select', 'wait'), ('_asyncio', 'asyncio'),
+            ('_ssl', 'ssl'), ('socket', 'socket'))
+
+
+def group_of(file_name: str, function: str) -> str:
+    """
+    Group of the profiled function: module of the project or package
+    """
+
+    if file_name == '~' or file_name.startswith('<'):  # built-in function or frozen module
+        for part, group in BUILTINS:
+            if part in function:
+                return group
+        return 'builtins'
+    path = Path(file_name).resolve()
+    if path.parent == PROJECT_DIR and path.stem in MODULES:
+        return path.stem
+    if 'site-packages' in path.parts:
+        return path.parts[path.parts.index('site-packages') + 1].split('.')[0]
+    if STDLIB_DIR in path.parents:
+        return path.relative_to(STDLIB_DIR).parts[0].split('.')[0]
+    return 'other'
+
+
+class SlowCallbacks(logging.Filter):
+    """
+    Collect callbacks of the profiled event loop, which work longer than 'duration': debug mode of this loop only
+    (loop.set_debug(), loop.slow_callback_duration), its warnings of slow callbacks are taken from 'asyncio' logger
+    instead of output. Other loops (mock server in its thread, workers) are not changed and not reported
+    """
+
+    def __init__(self, loop, duration: float):
+
+        super().__init__()
+        self.loop = loop
+        self.duration = duration
+        self.callbacks = list()
+        self.thread = self.debug = self.slow_callback_duration = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+
+        if record.thread != self.thread or not str(record.msg).startswith('Executing ') or len(record.args) != 2:
+            return True  # other messages as usual
+        callback, seconds = record.args
+        self.callbacks.append({'callback': str(callback)[:200], 'seconds': round(seconds, 4)})
+        return False
+
+    def __enter__(self):
+
+        self.thread = threading.get_ident()  # the loop runs in this thread
+        self.debug, self.slow_callback_duration = self.loop.get_debug(), self.loop.slow_callback_duration
+        self.loop.set_debug(True)
+        self.loop.slow_callback_duration = self.duration
+        logging.getLogger('asyncio').addFilter(self)
+        return self
+
+    def __exit__(self, *args):
+
+        logging.getLogger('asyncio').removeFilter(self)
+        self.loop.set_debug(self.debug)
+        self.loop.slow_callback_duration = self.slow_callback_duration
+
+
+def summary(stats: pstats.Stats, top=20) -> dict:
+    """
+    Own time (without called functions) and calls of each group (see group_of()), top functions by own time
+    """
+
+    groups = dict()
+    functions = list()
+    for (file_name, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        group = group_of(file_name, function)
+        values = groups.setdefault(group, {'seconds': 0.0, 'calls': 0})
+        values['seconds'] += own
+        values['calls'] += calls
+        functions.append({'function': '{}:{}({})'.format(os.path.basename(file_name), line, function),
+                          'group': group, 'calls': calls, 'seconds': round(own, 4), 'cumulative': round(cumulative, 4)})
+    functions.sort(key=lambda value: value['seconds'], reverse=True)
+    groups = {group: {'seconds': round(values['seconds'], 4), 'calls': values['calls']}
+              for group, values in sorted(groups.items(), key=lambda item: item[1]['seconds'], reverse=True)}
+    return {'seconds': round(stats.total_tt, 4), 'groups': groups, 'top': functions[:top]}
+
+
+def profile(function, file_name: str, slow_callback=0.1, top=20, loop=None) -> dict:
+    """
+    Run function() with cProfile and detection of callbacks of event 'loop' (of function(), run in this thread) longer
+    'slow_callback' sec, without 'loop' only with cProfile.
+    Write profile to 'file_name' (to see: python -m pstats file_name, snakeviz file_name, ...) and summary to json file
+    with the same name. Return summary: own time of 'main', 'parser', 'db' modules and used packages, top functions
+    and slow callbacks of event loop
+    """
+
+    profiler = cProfile.Profile()
+    slow = SlowCallbacks(loop, slow_callback)
+    with slow if loop is not None else nullcontext():
+        profiler.runcall(function)
+
+    profiler.dump_stats(file_name)
+    report = summary(pstats.Stats(profiler), top)
+    report['slow_callbacks'] = sorted(slow.callbacks, key=lambda value: value['seconds'], reverse=True)[:top]
+    with open(os.path.splitext(file_name)[0] + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return report
+
+
+def print_summary(report: dict):
+
+    print('Profile: {} sec'.format(report['seconds']))
+    for group, values in report['groups'].items():
+        print('  {:<16} {:>10.4f} sec {:>10} calls'.format(group, values['seconds'], values['calls']))
+    print('Top functions by own time:')
+    for value in report['top']:
+        print('  {:>10.4f} sec {:>10} calls  {}  [{}]'.format(value['seconds'], value['calls'], value['function'],
+                                                            value['group']))
+    if report['slow_callbacks']:
+        print('Slow callbacks of event loop:')
+        for value in report['slow_callbacks']:
+            print('  {:>10.3f} sec  {}'.format(value['seconds'], value['callback']))
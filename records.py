@@ -0,0 +1,96 @@
+from typing import NamedTuple
+
+
+class Product(NamedTuple):
+    """
+    Main item description from Parser.parse_details(), row of 'products' table (ordering as SQLite.to_products())
+    """
+
+    code: int
+    brand: str
+    model: str
+    url: str
+    img: str
+    age: str
+    gender: str
+    year: int
+    use: str
+    pronation: str
+    article: str
+    season: str
+    rating: int
+    timestamp: str
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        # sqlite3 row factory
+        return cls._make(row)
+
+
+class Tile(NamedTuple):
+    """
+    Item on listing page from Parser.parse_main(): id of its url (see known.py), name, price (0 if no price) and
+    availability hint (price is shown and no 'нет в наличии' label)
+    """
+
+    id: int
+    name: str
+    price: int
+    available: bool
+
+
+class Card(NamedTuple):
+    """
+    Item card description with actual price to export, row of SQLite.export_card_and_price()
+    """
+
+    code: int
+    model: str
+    brand: str
+    price: int
+    url: str
+    img: str
+    age: str
+    gender: str
+    year: int
+    use: str
+    pronation: str
+    article: str
+    season: str
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        return cls._make(row)
+
+
+class PriceObservation(NamedTuple):
+    """
+    Price of item on the timestamp, row of 'prices' table
+    """
+
+    code: int
+    price: int
+    timestamp: str
+    rating: int
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        return cls._make(row)
+
+
+class StockObservation(NamedTuple):
+    """
+    Count of items of one size on the timestamp, row of 'instock_...' tables
+    """
+
+    code: int
+    size: float
+    count: int
+    timestamp: str
+    rating: int
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        # 'size' column has decimal type, so sqlite3 returns int for integer sizes: 11 instead of 11.0
+        code, size, count, timestamp, rating = row
+        return cls(code, float(size), count, timestamp, rating)
@@ -0,0 +1,105 @@
+import os
+import gzip
+import hashlib
+from urllib.parse import urlencode
+
+from settings import REPLAY_DIR
+
+# file of the archive with one line to each recorded response: key of request, status, sha256 of body
+INDEX_FILE = 'index.tsv'
+
+
+class MissingResponse(LookupError):
+    """
+    Request of replay mode, which is not in the archive
+    """
+
+
+class Archive:
+    """
+    Archive of responses of www.kant.ru to record a run and to replay it offline, without network (see Parser.fetch()):
+    'record' mode saves each response (listing pages, product pages, availability requests), 'replay' mode serves
+    responses from the archive. Bodies are gzip files named by sha256 of the body (content-addressed, the same pages
+    are kept once), the index file keeps key of request (url and its query params), status and sha256 of body of each
+    response. The last response of the same request is replayed.
+    Use:
+        Parser.archive = Archive('replay', 'record')
+        ...
+        Parser.archive = Archive('replay', 'replay')
+    or from command line:
+        ./main.py prices instock --record
+        ./main.py prices instock --replay --db=copy.sqlite3
+    """
+
+    def __init__(self, path=REPLAY_DIR, mode='replay'):
+
+        if mode not in ('record', 'replay'):
+            raise ValueError("mode must be 'record' or 'replay', not {!r}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.index = None  # {key: (status, sha256)}, loaded by the first request
+
+    def __getstate__(self):
+
+        # to worker processes (see shard.py) without index, each process loads it
+        return {'path': self.path, 'mode': self.mode, 'index': None}
+
+    @staticmethod
+    def key(url: str, params=None) -> str:
+        """
+        Key of request: url of www.kant.ru (not of Parser.host) and sorted query params
+        """
+
+        if params:
+            return '{}?{}'.format(url, urlencode(sorted((str(name), str(value)) for name, value in params.items())))
+        return url
+
+    def load(self):
+
+        self.index = dict()
+        file_name = os.path.join(self.path, INDEX_FILE)
+        if os.path.isfile(file_name):
+            with open(file_name, encoding='utf-8') as f:
+                for line in f:
+                    key, status, digest = line.rstrip('\n').split('\t')
+                    self.index[key] = (int(status), digest)
+
+    def body_file(self, digest: str) -> str:
+
+        return os.path.join(self.path, 'objects', digest[:2], digest[2:] + '.gz')
+
+    def get(self, url: str, params=None) -> tuple:
+        """
+        Recorded response to request
+        return status, text of response
+        raise MissingResponse, if request is not recorded
+        """
+
+        if self.index is None:
+            self.load()
+        key = self.key(url, params)
+        if key not in self.index:
+            raise MissingResponse('{} is not recorded in {}'.format(key, self.path))
+        status, digest = self.index[key]
+        with open(self.body_file(digest), 'rb') as f:
+            return status, gzip.decompress(f.read()).decode('utf-8')
+
+    def put(self, url: str, params, status: int, text: str):
+        """
+        Record response to request. Processes of one host may record to the same archive at the same time
+        """
+
+        body = text.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()
+        file_name = self.body_file(digest)
+        if not os.path.isfile(file_name):
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            temp_name = '{}.{}.tmp'.format(file_name, os.getpid())
+            with open(temp_name, 'wb') as f:
+                f.write(gzip.compress(body, mtime=0))
+            os.replace(temp_name, file_name)  # never a part of file
+        key = self.key(url, params)
+        with open(os.path.join(self.path, INDEX_FILE), 'a', encoding='utf-8') as f:
+            f.write('{}\t{}\t{}\n'.format(key, status, digest))  # one write of short line
+        if self.index is not None:
+            self.index[key] = (status, digest)
@@ -0,0 +1,55 @@
+from settings import SCHEDULE_MIN_HOURS, SCHEDULE_MAX_HOURS, SCHEDULE_CHECKS_PER_CHANGE
+
+
+class Scheduler:
+    """
+    Refresh interval of each product by change rate of its price ('prices' kind) or availability ('instock' kind) from
+    rating history of database: often changed items are checked often, never changed items-- once in 'max_hours'.
+    Use:
+        scheduler = Scheduler(db, 'prices')
+        codes = scheduler.due(codes, timestamp)  # only items to check now
+        ... load and update
+        scheduler.checked(codes, timestamp)
+    """
+
+    def __init__(self, db, kind: str, min_hours=SCHEDULE_MIN_HOURS, max_hours=SCHEDULE_MAX_HOURS,
+                 checks=SCHEDULE_CHECKS_PER_CHANGE):
+
+        if kind not in ('prices', 'instock'):
+            raise ValueError("kind must be 'prices' or 'instock', not {!r}".format(kind))
+        self.db = db
+        self.kind = kind
+        self.min_hours = min_hours
+        self.max_hours = max_hours  # max staleness of the item
+        self.checks = checks  # checks per mean time between changes
+
+    def interval(self, changes: int, hours: float) -> float:
+        """
+        Refresh interval, hours, of the item with 'changes' changes for 'hours' of its history
+        """
+
+        if changes <= 0:  # never changed
+            return self.max_hours
+        return min(self.max_hours, max(self.min_hours, hours / changes / self.checks))
+
+    def intervals(self, now: str) -> dict:
+        """
+        return {code: refresh interval, hours}
+        """
+
+        changes = self.db.get_changes(self.kind, now)
+        return {code: self.interval(*values) for code, values in changes.items()}
+
+    def due(self, codes, now: str) -> list:
+        """
+        Codes, which are due to check on 'now' time: never checked or checked before its refresh interval
+        """
+
+        intervals = self.intervals(now)
+        checked = self.db.get_schedule(self.kind, now)
+        return [code for code in codes
+                if code not in checked or checked[code] >= intervals.get(code, self.max_hours)]
+
+    def checked(self, codes, now: str):
+
+        self.db.to_schedule(self.kind, codes, now)
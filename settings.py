@@ -35,6 +35,45 @@ BRANDS_URLS = [
     'https://www.kant.ru/brand/raidlight/products/'
 ]
 
+# Main.update_prices_table() loads listing pages (settings.BRANDS_URLS, a few dozen pages) and loads product pages
+# only of items with other price on listing, than in database, and of items out of listing (if there are more items,
+# than requests of listing). False to load product page of each item
+LISTING_PRICES = True
+
+# Items, which dropped out of www.kant.ru (rating 0 in 'products' table) are checked by Main.update_instock_table()
+# only each this run, after all items in stock: most of them return nothing, and they grow up with time.
+# 1 to check them each run, 0 to never check
+NOT_INSTOCK_PROBE_RUNS = 10
+
+# Scheduled sync (opt-in, or '--schedule' argument of main.py): Main.update_prices_table() and update_instock_table()
+# check only items, which are due by its refresh interval (see scheduler.py). Interval of each item is the mean time
+# between its changes in 'prices' ('instock_...') history divided by SCHEDULE_CHECKS_PER_CHANGE, but not shorter than
+# SCHEDULE_MIN_HOURS and not longer than SCHEDULE_MAX_HOURS (max staleness). New items are always checked
+SCHEDULE = False
+SCHEDULE_MIN_HOURS = 1
+SCHEDULE_MAX_HOURS = 72
+SCHEDULE_CHECKS_PER_CHANGE = 2
+
+# Daemon mode ('serve' argument of main.py, Main.serve()): pause between cycles of update of due prices and
+# availability, sec, and interval of update of 'products' table, hours
+SERVE_INTERVAL = 300
+SERVE_PRODUCTS_HOURS = 24
+
+# Sharded sync ('--workers=' argument of main.py, shard.ShardedMain): worker processes to parse www.kant.ru by brands
+# and max requests per second of all workers together
+SHARD_WORKERS = 4
+SHARD_RATE = 20
+
+# Work queue ('worker' command and '--queue' argument of main.py, see workqueue.py): database file of the queue,
+# common to all hosts, items of one task, lease of task to worker, sec, attempts of task before it fails, pause of
+# polling of the queue, sec, and max wait for results of all tasks of one Parser call, sec
+QUEUE_DB = 'queue.sqlite3'
+QUEUE_TASK_SIZE = 50
+QUEUE_LEASE = 300
+QUEUE_ATTEMPTS = 3
+QUEUE_POLL = 0.5
+QUEUE_WAIT = 3600
+
 # json file to export card description (an optional)
 JSON_FILE = 'card.json'
 
@@ -44,12 +83,86 @@ CSV_FILE = 'card.csv'
 # csv file to export card description (as default in 'to' parameter from export() method)
 XML_FILE = 'card.xml'
 
+# Directory to columnar export (Main.export(to='parquet') or 'npz', see columnar.py): products, actual prices, full
+# history of prices and availability, file to each table
+COLUMNAR_DIR = 'columnar'
+
+# Rows read from database and written to columnar file at once
+COLUMNAR_CHUNK = 50000
+
+# Lock file of the running sync ('products', 'prices', 'instock' commands) or compaction of database. Only one of them
+# may work with database at the same time (fcntl.flock of the file, see main.lock(), the file is not deleted)
+LOCK_FILE = 'kant.lock'
+
+# Structured report of the run (json): duration, requests, downloaded bytes, parse time, retries, rows written and
+# cache hits of each Main.update_...(), Main.export() and Parser.parse_...() call. None to don't write
+METRICS_FILE = 'run_report.json'
+
+# Report of the run in Prometheus text format, to node_exporter textfile collector, for example:
+# '/var/lib/node_exporter/textfile_collector/kant.prom'. None to don't write
+PROMETHEUS_FILE = None
+
+# Profile of the run with '--profile' argument (cProfile, see profiler.py), summary is written to json file with the same
+# name: own time of 'main', 'parser', 'db' modules and used packages, top functions and slow callbacks of event loop
+PROFILE_FILE = 'profile.prof'
+
+# Callbacks of event loop working longer than this, sec, are slow callbacks in the profile: they block all parallel
+# requests, as lxml parsing of big page
+SLOW_CALLBACK = 0.1
+
+# Count of top functions and slow callbacks in the profile summary
+PROFILE_TOP = 20
+
+#
+#            for: 'analytics.py'
+#
+# Window of price min/ max and of days in stock, days to now
+ANALYTICS_WINDOW_DAYS = 30
+
+# Price drop alert: latest price lower than previous by this %
+PRICE_DROP_PERCENT = 10
+
+#
+#            for: 'api.py'
+#
+# Address of local HTTP/ JSON service of database
+API_HOST = '127.0.0.1'
+API_PORT = 8080
+
+# Max count of cached responses of the current version of data
+API_CACHE_SIZE = 10000
+
+#
+#            for: 'sizes.py'
+#
+# Max count of cached size labels (with its brand) out of precomputed table
+SIZES_CACHE = 4096
+
+#
+#            for: 'pages.py'
+#
+# Directory of the archive of raw product pages of parse_price() and parse_details() ('--pages' argument of main.py)
+PAGES_DIR = 'pages'
+
+# Segments of the archive of pages (one file of each day) older than this count of days are deleted
+PAGES_RETENTION_DAYS = 30
+
+# Compression level of pages, from 1 (fast) to 9 (small)
+PAGES_LEVEL = 6
+
 #
 #            for: 'db.py'
 #
 # Database file. Starting tables structure from Django project, so 'id' is optional (not used explicitly from this proj)
 DB_NAME = 'db.sqlite3'
 
+# History of 'prices' and 'instock_...' tables older than this count of days is downsampled to the last value of each
+# day by 'compact' command (SQLite.compact()). Actual state (max rating) of each product is never deleted
+RETENTION_DAYS = 90
+
+# Pages of free space of database file to return to the file system at one step of incremental vacuum
+VACUUM_PAGES = 1000
+
 #
 #            for: 'parser.py'
 #
@@ -59,6 +172,19 @@ TIMEOUT = 0.4
 # Count of parallel loads per one async working request, urls to parallel work: as usual from 5 to 30.
 CHUNK = 20
 
+# Count of parallel loads of listing pages to find only new items (Main.update_products_table(new_only=True)): paging
+# stops after the page of only known items, so the less pages are loaded after it
+NEW_ONLY_CHUNK = 2
+
+# Query parameters of listing sorted by new items first, to find only new items: the early stop of paging relies on
+# this order, so it is requested explicitly, not taken from the default order of listing (by popularity), and checked
+# by ids of items of each page (see Parser.parse_main())
+NEW_FIRST = {'sort': 'new'}
+
+# Directory of the archive of responses of www.kant.ru to record and replay runs offline ('--record' and '--replay'
+# arguments of main.py, see replay.py)
+REPLAY_DIR = 'replay'
+
 # Link to get size, this count of items on each running shoes by this code
 # response return json of all departments of kant.ru local shops with size, count and id of offline shop by unic id
 # which depends on unic 'code'
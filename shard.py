@@ -0,0 +1,170 @@
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import parser
+from parser import Parser
+from main import Main
+from metrics import metrics
+from settings import BRANDS, SHARD_WORKERS, SHARD_RATE
+
+
+class RateLimiter:
+    """
+    Limit of requests per second common to all worker processes: each request takes the next free time slot from the
+    shared value. Set to Parser.limiter of worker, see Parser.fetch()
+    """
+
+    def __init__(self, rate=SHARD_RATE):
+
+        if rate <= 0:
+            raise ValueError('rate must be positive, not {!r}'.format(rate))
+        self.interval = 1 / rate
+        self.slot = multiprocessing.Value('d', 0.0, lock=False)  # time of the next free slot
+        self.lock = multiprocessing.Lock()
+
+    async def wait(self):
+
+        with self.lock:
+            now = time.time()
+            start = max(self.slot.value, now)
+            self.slot.value = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+def init_worker(limiter: RateLimiter):
+
+    Parser.limiter = limiter
+
+
+def run_worker(method: str, args: tuple, host: str, timeout: float, archive=None, pages=None) -> tuple:
+    """
+    Call Parser.<method>(*args) in worker process with its own event loop
+    return result and counters of metrics of the call
+    """
+
+    Parser.host, parser.TIMEOUT = host, timeout  # the same as of writer process
+    current = Parser.archive
+    if archive is None or current is None or (current.path, current.mode) != (archive.path, archive.mode):
+        Parser.archive = archive  # the same archive between calls: its index is loaded once by worker
+    Parser.pages = pages  # with 'stamp' of this call
+    metrics.reset()
+    result = asyncio.run(getattr(Parser, method)(*args))
+    return result, metrics.totals
+
+
+class ShardedParser:
+    """
+    Parser, which splits items of each parse_...() call to shards by brand (settings.BRANDS to 'workers' processes) and
+    parses shards at the same time in worker processes. Results go back to the caller: one writer process works with
+    database. Requests of all workers together are limited by 'rate' per second.
+    """
+
+    def __init__(self, workers=SHARD_WORKERS, rate=SHARD_RATE, brands=None):
+
+        if workers < 1:
+            raise ValueError('workers must be 1 or more, not {!r}'.format(workers))
+        self.workers = workers
+        self.rate = rate
+        self.brands = brands or dict  # function to {code: brand} of products, without brands as default
+        self.host = None  # see Parser.host, Parser.host of this process as default
+        self.pool = None
+
+    def shard(self, brand, index: int) -> int:
+        """
+        Worker of item: by its brand, or by its index of unknown brand
+        """
+
+        if brand in BRANDS:
+            return BRANDS.index(brand) % self.workers
+        return index % self.workers
+
+    async def run(self, method: str, shards: list) -> list:
+        """
+        Parser.<method>(*args) of each shard: [args, ...], with not empty items (the first argument), in worker processes
+        return joined results of shards
+        """
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                            initargs=(RateLimiter(self.rate),))
+        loop = asyncio.get_running_loop()
+        host = Parser.host if self.host is None else self.host
+        tasks = [loop.run_in_executor(self.pool, run_worker, method, args, host, parser.TIMEOUT, Parser.archive,
+                                      Parser.pages) for args in shards if args[0]]
+        results = list()
+        for result, totals in await asyncio.gather(*tasks):
+            results.extend(result)
+            for counter, value in totals.items():
+                if value:
+                    metrics.count(counter, value)
+        return results
+
+    def close(self):
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    async def open_session(self):
+        # each worker uses its own session to each call
+        pass
+
+    async def close_session(self):
+        pass
+
+    @metrics.measure
+    async def parse_main(self, urls: list, finish: int, known=None) -> list:
+
+        # one url of each brand, the first-- all running shoes
+        return await self.run('parse_main', [(urls[i::self.workers], finish, known) for i in range(self.workers)])
+
+    @metrics.measure
+    async def parse_details(self, urls: list, timestamp=None) -> list:
+
+        # brand of new items is unknown yet
+        return await self.run('parse_details', [(urls[i::self.workers], timestamp) for i in range(self.workers)])
+
+    @metrics.measure
+    async def parse_price(self, codes_urls: list) -> list:
+
+        brands = self.brands()
+        shards = [list() for _ in range(self.workers)]
+        for i, (code, url) in enumerate(codes_urls):
+            shards[self.shard(brands.get(code), i)].append((code, url))
+        return await self.run('parse_price', [(items, ) for items in shards])
+
+    @metrics.measure
+    async def parse_available(self, codes: list, brands=None) -> list:
+
+        brands = brands or self.brands()
+        shards = [list() for _ in range(self.workers)]
+        for i, (code, instock_code) in enumerate(codes):
+            shards[self.shard(brands.get(code), i)].append((code, instock_code))
+        return await self.run('parse_available', [(items, {code: brands.get(code) for code, instock_code in items})
+                                                  for items in shards])
+
+
+class ShardedMain(Main):
+    """
+    Main, which parses www.kant.ru by 'workers' processes (see ShardedParser) and writes to database by this process.
+    Use:
+        page = ShardedMain(workers=4, rate=20)
+        try:
+            page.update_prices_table()
+        finally:
+            page.close()
+    or from command line:
+        ./main.py prices instock --workers=4
+    """
+
+    def __init__(self, workers=SHARD_WORKERS, rate=SHARD_RATE, **kwargs):
+
+        super().__init__(**kwargs)
+        self._parser = ShardedParser(workers, rate, self.db.get_products_brand)
+
+    def close(self):
+
+        self._parser.close()
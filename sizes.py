@@ -0,0 +1,127 @@
+from functools import lru_cache
+
+from settings import BRANDS, SIZES_CACHE
+
+# US men's size by EUR size of brand charts, where they differ from the common chart (None). EUR sizes like '40 2/3'
+# are written as 40.7. Only sizes of the chart are converted, other EUR sizes are kept as is (see eur_to_us()), so two
+# EUR sizes of one brand never become one size. Each chart is one to one
+EUR_TO_US = {
+    None: {39: 6.5, 40: 7, 40.5: 7.5, 41: 8, 42: 8.5, 42.5: 9, 43: 9.5, 44: 10, 44.5: 10.5, 45: 11, 45.5: 11.5, 46: 12,
+           47: 12.5, 47.5: 13, 48.5: 14},
+    'asics': {39: 6, 39.5: 6.5, 40: 7, 40.5: 7.5, 41.5: 8, 42: 8.5, 42.5: 9, 43.5: 9.5, 44: 10, 44.5: 10.5, 45: 11,
+              46: 11.5, 46.5: 12, 47: 12.5, 48: 13, 49: 14},
+    'adidas': {39.3: 6.5, 40: 7, 40.7: 7.5, 41.3: 8, 42: 8.5, 42.7: 9, 43.3: 9.5, 44: 10, 44.7: 10.5, 45.3: 11,
+               46: 11.5, 46.7: 12, 47.3: 12.5, 48: 13, 49.3: 14},
+    'hoka': {39.3: 6.5, 40: 7, 40.7: 7.5, 41.3: 8, 42: 8.5, 42.7: 9, 43.3: 9.5, 44: 10, 44.7: 10.5, 45.3: 11,
+             46: 11.5, 46.7: 12, 47.3: 12.5, 48: 13, 49.3: 14},
+    'salomon': {39.3: 6.5, 40: 7, 40.7: 7.5, 41.3: 8, 42: 8.5, 42.7: 9, 43.3: 9.5, 44: 10, 44.7: 10.5, 45.3: 11,
+                46: 11.5, 46.7: 12, 47.3: 12.5, 48: 13, 49.3: 14},
+    'saucony': {39: 6.5, 40: 7, 40.5: 7.5, 41: 8, 42: 8.5, 42.5: 9, 43: 9.5, 44: 10, 44.5: 10.5, 45: 11, 46: 11.5,
+                46.5: 12, 47: 12.5, 48: 13, 49: 14},
+    'mizuno': {39: 6.5, 40: 7, 40.5: 7.5, 41: 8, 42: 8.5, 42.5: 9, 43: 9.5, 44: 10, 44.5: 10.5, 45: 11, 46: 11.5,
+               46.5: 12, 47: 12.5, 48.5: 13, 49: 14},
+}
+
+# US size = UK size + 1 of all brands, as sizes of 'instock_...' tables are written since the first version: rows of
+# UK labels can't be told from rows of US labels, so the difference of brand charts is not applied
+UK_TO_US = 1
+
+# EUR sizes of adults are from this value, US and UK sizes are less: EUR sizes out of the chart are kept as is
+EUR_MIN = 30
+
+# Junior US sizes ('K10,5') are kept in its own range of keys: JUNIOR + size (110.5), not the same as adult US sizes
+JUNIOR = 100
+
+
+def chart(brand) -> str:
+    """
+    Key of brand charts of EUR_TO_US
+    """
+
+    brand = brand.lower() if brand else None
+    return brand if brand in EUR_TO_US else None
+
+
+def number(value: str) -> float:
+    """
+    Size number of label: '9,5', '9.5', '40 2/3', '40⅔'
+    """
+
+    value = value.replace(',', '.', 1).replace('⅓', '.3').replace('⅔', '.7').strip()
+    whole, space, fraction = value.partition(' ')
+    if fraction:  # '40 2/3'
+        numerator, slash, denominator = fraction.partition('/')
+        return float(whole) + round(float(numerator) / float(denominator), 1)
+    return float(value)
+
+
+def eur_to_us(eur: float, brand=None) -> float:
+    """
+    US size of EUR size by the chart of the brand, EUR size as is, if it is not in the chart
+    """
+
+    us = EUR_TO_US[chart(brand)].get(round(eur, 1))
+    return float(us) if us is not None else eur
+
+
+@lru_cache(maxsize=SIZES_CACHE)
+def us_size(label: str, brand=None):
+    """
+    Canonical US size of the label of AVAILABLE response ('US:9,5', 'US:11/12', 'UK:8,5', 'EUR:42', 'K10,5') and
+    brand of the item: EUR sizes out of the chart of brand as is, junior sizes in its own range (see JUNIOR). Labels of
+    each brand are precomputed in LABELS, other are computed once and cached
+    return float, None to unknown label
+    """
+
+    label = label.lower().strip()
+
+    # special for 'Hoka' brand:
+    #  incoming size format: US:11/12
+    if '/' in label and ' ' not in label:
+        label = label.partition('/')[0]
+    # end special for 'Hoka'
+
+    system, colon, value = label.partition(':')
+    if not colon:  # junior size: 'K10,5'
+        system, value = label[:1], label[1:]
+    try:
+        if system == 'us':
+            return number(value)
+        if system == 'uk':
+            return number(value) + UK_TO_US
+        if system == 'eur':
+            return eur_to_us(number(value), brand)
+        if system == 'k':  # US junior size
+            return JUNIOR + number(value)
+    except ValueError:
+        return None
+    return None
+
+
+def labels(brand=None) -> dict:
+    """
+    Labels of AVAILABLE response of the brand, as they are written by www.kant.ru, with its US size
+    """
+
+    halves = [value / 2 for value in range(2, 36)]  # 1 - 17.5
+    texts = ['{:g}'.format(value).replace('.', ',') for value in halves]
+    values = ['US:' + text for text in texts] + ['UK:' + text for text in texts] + ['K' + text for text in texts]
+    eur = EUR_TO_US[chart(brand)]
+    values += ['EUR:' + '{:g}'.format(value).replace('.', ',') for value in eur] + ['EUR:{}'.format(value)
+                                                                                    for value in range(35, 50)]
+    return {label: us_size(label, brand) for label in values}
+
+
+# precomputed labels of all brands: {brand: {label: US size}}
+LABELS = {brand: labels(brand) for brand in [None] + BRANDS}
+
+
+def normal_size(label: str, brand=None):
+    """
+    US size of label: from LABELS, or by us_size()
+    """
+
+    sizes = LABELS.get(brand)
+    size = sizes.get(label) if sizes is not None else None
+    return size if size is not None else us_size(label, brand)
+
@@ -1,28 +1,70 @@
+import time
+import signal
+import sqlite3
+import threading
+import multiprocessing
+import numpy as np
+import asyncio
 import os.path
+import shutil
+import tempfile
+import sys
+import io
+from contextlib import redirect_stdout
 from os import remove
 from aiounittest import AsyncTestCase
 from unittest import TestCase, main, skipIf
 from pathlib import Path
 
+import parser
+import bench
+import profiler
+import columnar
+import analytics
+import sizes
+import brands
+from scheduler import Scheduler
+from shard import ShardedMain, RateLimiter
+import workqueue
+from workqueue import QueuedMain, QueuedParser, SQLiteQueue
+from api import Api
+from aiohttp.test_utils import TestClient, TestServer
 from parser import Parser
-from main import Main
+from mock import MockKant, ID_OFFSET, fixture, fill
+from main import Main, lock, manager
 from db import SQLite
-from settings import SHOPS, BRANDS_URLS, CSV_FILE, JSON_FILE, XML_FILE
+from known import url_id
+from replay import Archive, MissingResponse
+from pages import PageArchive, ENTRY
+from records import PriceObservation, StockObservation
+from metrics import Metrics, metrics
+from settings import SHOPS, BRANDS, BRANDS_URLS, LOCK_FILE, CSV_FILE, JSON_FILE, XML_FILE, AVAILABLE
 
 SKIP = False  # set False to check all tests
 # more cases relevant only in oct- nov 2021
 
 
+def put_pages(path: str, worker: int, count: int):
+    """
+    Pages of one worker process to the common archive (see TestPages)
+    """
+
+    pages = PageArchive(path)
+    pages.stamp = '2021-01-01 00:00:00'
+    for i in range(count):
+        pages.put('https://www.kant.ru/catalog/product/{}/'.format(3000000 + worker * count + i),
+                  'page {} of worker {} '.format(i, worker) * (i % 50 + 1))
+
+
 @skipIf(SKIP, 'skip parse_main')
 class TestAsyncParseMain(AsyncTestCase):
 
     async def test_parse_main_correct_data(self):
         cases = (['http://www.kant.ru/brand/brooks/products/'], [BRANDS_URLS[-1]])
-        solution_str = 'https://www.kant.ru/catalog/product'  # any solution item must be starts with this str
         for i in cases:
             with self.subTest(case=i):
                 response = await Parser.parse_main(i, 1)
-                self.assertEqual(response[0][:35], solution_str)
+                self.assertIsInstance(response[0].id, int)  # any solution item is id of url '/catalog/product/<id>/'
 
     async def test_parse_main_counts_and_values(self):
         case = ['https://www.kant.ru/catalog/shoes/running-shoes/brand-asics/']
@@ -35,9 +77,9 @@ class TestAsyncParseMain(AsyncTestCase):
         case = ['https://www.kant.ru/catalog/shoes/running-shoes/brand-asics/']
         big_page_num = 30  # max pagination parsing
         approx_count = 100  # from Asics many deep models line, if parsed all pages
-        solution = 'https://www.kant.ru/catalog/product/3052137/'  # actual for jul 2021
+        solution = 3052137  # 'https://www.kant.ru/catalog/product/3052137/', actual for jul 2021
         response = await Parser.parse_main(case, big_page_num)
-        self.assertIn(solution, response)
+        self.assertIn(solution, [tile.id for tile in response])
         self.assertGreater(len(response), approx_count)
 
     async def test_parse_main_uncorrect_url(self):
@@ -178,18 +220,856 @@ class TestAsyncParseAvailable(AsyncTestCase):
             await Parser.parse_available(case)
 
 
+class TestAsyncParserMock(AsyncTestCase):
+    """
+    Offline tests of Parser methods with local mock server of www.kant.ru (see mock.py)
+    """
+
+    async def run_with_server(self, coroutine):
+        """
+        Run Parser coroutine while mock server is working instead of www.kant.ru
+        """
+
+        timeout, parser.TIMEOUT = parser.TIMEOUT, 0
+        async with MockKant(pages=2) as server:
+            Parser.host = server.host
+            try:
+                return await coroutine
+            finally:
+                Parser.host = None
+                parser.TIMEOUT = timeout
+
+    async def test_parse_main(self):
+        response = await self.run_with_server(Parser.parse_main([BRANDS_URLS[1]], 5))
+        self.assertEqual(len(response), 2 * 24)  # 2 pages, than repeat of the last page
+        path = BRANDS_URLS[1][len('https://www.kant.ru'):]
+        self.assertEqual([tile.id for tile in response[:24]], MockKant(pages=2).listing_ids(path, 1))
+        self.assertTrue(all(tile.available and 3000 <= tile.price < 20000 for tile in response))
+
+    async def test_parse_details(self):
+        url = 'https://www.kant.ru/catalog/product/3000005/'
+        response = await self.run_with_server(Parser.parse_details([url]))
+        self.assertEqual(response[0].code, 3000005 - ID_OFFSET)
+        self.assertEqual(response[0].url, url)
+        self.assertEqual(response[0].year, 2021)
+
+    async def test_parse_price(self):
+        code = 3000005 - ID_OFFSET
+        url = 'https://www.kant.ru/catalog/product/3000005/'
+        response = await self.run_with_server(Parser.parse_price([(code, url)]))
+        self.assertEqual(response[0][0], code)
+        self.assertTrue(3000 <= response[0][1] < 20000)
+
+    async def test_parse_available(self):
+        response = await self.run_with_server(Parser.parse_available([(3000005 - ID_OFFSET, 3000005)]))
+        for shop, sizes in response[0][1].items():
+            self.assertIn(shop, SHOPS)
+            for size, count in sizes:
+                self.assertEqual(type(size), float)
+                self.assertGreater(count, 0)
+
+    async def test_available_fast(self):
+        async def fetch_all():
+            return await asyncio.gather(*[Parser.fetch(AVAILABLE, {'ID': 3000000 + i}) for i in range(48)])
+
+        for html in await self.run_with_server(fetch_all()):
+            self.assertEqual(Parser.available_fast(html), Parser.available_dom(html))
+
+    async def test_record_replay(self):
+        url = 'https://www.kant.ru/catalog/product/3000005/'
+
+        async def requests():
+            details = [product._replace(timestamp=None) for product in await Parser.parse_details([url])]
+            return (await Parser.parse_main([BRANDS_URLS[1]], 3), details,
+                    await Parser.parse_available([(3000005 - ID_OFFSET, 3000005)]))
+
+        path = tempfile.mkdtemp()
+        try:
+            Parser.archive = Archive(path, 'record')
+            recorded = await self.run_with_server(requests())
+            Parser.archive = Archive(path, 'replay')
+            Parser.host = 'http://127.0.0.1:9'  # nothing is listening, all from the archive
+            self.assertEqual(await requests(), recorded)
+            with self.assertRaises(MissingResponse):
+                await Parser.fetch(url, {'page': 2})
+        finally:
+            Parser.archive = Parser.host = None
+            shutil.rmtree(path)
+
+    def test_available_fast_fallback(self):
+        shop = ('<div class="popur__row">\n<span>м. Нагорная, ул. Нагорная, д. 13</span>\n<span>в наличии</span>\n'
+                '</div>\n<table class="popur__table">\n<tr>\n<td>US:9,5</td>\n<td>2</td>\n</tr>{}\n</table>')
+        html = fill(fixture('available.html'), shops=shop.format(''))
+        self.assertEqual(Parser.available_fast(html), {SHOPS[0]: [(9.5, 2)]})
+        cases = (shop.format('\n<tr>\n<td>US:10&nbsp;</td>\n<td>1</td>\n</tr>'),  # html entity
+                 shop.format('\n<TR>\n<td>US:10</td>\n<td>1</td>\n</TR>'),  # upper case tags
+                 shop.format('\n<tbody>\n<tr>\n<td>US:10</td>\n<td>1</td>\n</tr>\n</tbody>'),  # nested tags
+                 shop.format('').replace('<span>', '<div><span>', 1).replace('</span>', '</span></div>', 1),
+                 shop.format('').replace('Нагорная', 'Новая'),  # unknown shop
+                 shop.format('') + '\n<p>new block</p>')
+        for i in cases:
+            with self.subTest(case=i):
+                html = fill(fixture('available.html'), shops=i)
+                self.assertIsNone(Parser.available_fast(html))
+                Parser.available_dom(html)  # parsed by DOM
+
+
+class TestSizes(TestCase):
+
+    def test_normal_size(self):
+        cases = ((('US:9,5', None), 9.5), (('US:11/12', 'Hoka'), 11.0), (('UK:8,5', None), 9.5),
+                 (('UK:8,5', 'Adidas'), 9.5), (('EUR:42', 'Asics'), 8.5), (('EUR:43,5', 'Asics'), 9.5),
+                 (('EUR:40⅔', 'Adidas'), 7.5), (('EUR:42', 'Unknown'), 8.5), (('EUR:41,5', None), 41.5),
+                 (('EUR:48', 'Mizuno'), 48.0), (('K10,5', None), 110.5), (('XL', None), None), (('EUR:', None), None))
+        for (label, brand), size in cases:
+            with self.subTest(label=label, brand=brand):
+                self.assertEqual(sizes.normal_size(label, brand), size)
+                self.assertEqual(sizes.us_size(label, brand), size)  # the same as precomputed
+
+    def test_junior_sizes(self):
+        shop = ('<div class="popur__row">\n<span>м. Нагорная, ул. Нагорная, д. 13</span>\n<span>в наличии</span>\n'
+                '</div>\n<table class="popur__table">\n<tr>\n<td>K12,5</td>\n<td>2</td>\n</tr>\n</table>')
+        html = fill(fixture('available.html'), shops=shop)
+        self.assertEqual(Parser.available_fast(html), {SHOPS[0]: [(112.5, 2)]})
+        self.assertEqual(Parser.available_dom(html), {SHOPS[0]: [(112.5, 2)]})
+
+    def test_distinct_sizes(self):
+        # labels of one size system of one brand never become one size, junior sizes are not adult sizes
+        for brand in [None] + BRANDS:
+            adult = set()
+            for system in ('US:', 'UK:', 'EUR:', 'K'):
+                with self.subTest(brand=brand, system=system):
+                    values = [size for label, size in sizes.LABELS[brand].items() if label.startswith(system)]
+                    self.assertEqual(len(values), len(set(values)))
+                    if system == 'K':
+                        self.assertFalse(adult & set(values))
+                    else:
+                        adult.update(values)
+
+
+class TestPages(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_processes(self):
+        # pages of interleaved writers are found by its offsets
+        path, workers, count = os.path.join(self.temp_dir, 'pages'), 4, 200
+        os.makedirs(path)
+        processes = [multiprocessing.Process(target=put_pages, args=(path, worker, count)) for worker in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        pages = PageArchive(path)
+        self.assertEqual(os.path.getsize(os.path.join(path, '2021-01-01.idx')), ENTRY.size * workers * count)
+        for worker in range(workers):
+            for i in range(count):
+                self.assertEqual(pages.get(3000000 + worker * count + i, '2021-01-01 00:00:00'),
+                                 'page {} of worker {} '.format(i, worker) * (i % 50 + 1))
+
+
+def hold_lock(taken):
+    """
+    Take the lock of database and exit without release, as broken process (see TestLock)
+    """
+
+    with lock() as locked:
+        if locked:
+            taken.set()
+        os._exit(0)
+
+
+class TestLock(TestCase):
+
+    def test_lock(self):
+        file_name = os.path.join(Path(__file__).resolve().parent, LOCK_FILE)
+        with lock() as locked:
+            self.assertTrue(locked)
+            with open(file_name) as f:
+                self.assertEqual(f.read(), str(os.getpid()))
+            with lock() as other:
+                self.assertFalse(other)  # lock of this living process
+        self.assertTrue(os.path.isfile(file_name))  # never deleted: nothing to remove by two processes
+
+        taken = multiprocessing.Event()
+        process = multiprocessing.Process(target=hold_lock, args=(taken, ))
+        process.start()
+        process.join()
+        self.assertTrue(taken.is_set())
+        with lock() as locked:
+            self.assertTrue(locked)  # released by exit of broken process
+
+
+class TestManager(TestCase):
+
+    def test_wrong_workers(self):
+        argv = sys.argv
+        try:
+            for value in ('x', '0', '-2'):
+                with self.subTest(value=value):
+                    sys.argv = ['main.py', 'prices', '--workers=' + value]
+                    output = io.StringIO()
+                    with redirect_stdout(output):
+                        self.assertIsNone(manager())
+                    self.assertIn('--workers=' + value, output.getvalue())
+        finally:
+            sys.argv = argv
+
+
+class TestMetrics(AsyncTestCase):
+
+    def test_phases(self):
+        run = Metrics()
+        with run.phase('update_prices_table'):
+            with run.phase('parse_price'):
+                run.count('requests', 3)
+            run.count('rows', 2)
+        report = run.report()
+        self.assertEqual(report['totals']['requests'], 3)
+        self.assertEqual(report['phases']['update_prices_table']['requests'], 3)
+        self.assertEqual(report['phases']['parse_price']['rows'], 0)
+        self.assertEqual(report['phases']['update_prices_table']['rows'], 2)
+        self.assertIn('kant_phase_requests{phase="parse_price"} 3', run.prometheus())
+
+    async def test_parser_metrics(self):
+        metrics.reset()
+        timeout, parser.TIMEOUT = parser.TIMEOUT, 0
+        async with MockKant() as server:
+            Parser.host = server.host
+            try:
+                await Parser.parse_available([(3000005 - ID_OFFSET, 3000005), (3000006 - ID_OFFSET, 3000006)])
+            finally:
+                Parser.host = None
+                parser.TIMEOUT = timeout
+        phase = metrics.report()['phases']['parse_available']
+        self.assertEqual((phase['calls'], phase['requests']), (1, 2))
+        self.assertGreater(phase['bytes'], 0)
+        self.assertGreater(phase['parse_seconds'], 0)
+        self.assertEqual(phase['fallbacks'], 0)  # mock responses are parsed by fast path
+
+
+class TestProfiler(TestCase):
+
+    def test_group_of(self):
+        self.assertEqual(profiler.group_of(parser.__file__, 'parse_details'), 'parser')
+        self.assertEqual(profiler.group_of(asyncio.__file__, 'run'), 'asyncio')
+        self.assertEqual(profiler.group_of('~', "<method 'execute' of 'sqlite3.Cursor' objects>"), 'sqlite3')
+        self.assertEqual(profiler.group_of('~', "<method 'poll' of 'select.epoll' objects>"), 'wait')
+
+    def test_profile(self):
+        async def slow():
+            time.sleep(0.06)  # blocks event loop
+
+        # loop of other thread (as of mock server) with debug mode is not reported
+        other = asyncio.new_event_loop()
+        other.set_debug(True)
+        other.slow_callback_duration = 0.05
+        thread = threading.Thread(target=other.run_forever)
+        thread.start()
+        loop = asyncio.new_event_loop()
+        temp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(temp_dir, 'profile.prof')
+
+            def run():
+                other.call_soon_threadsafe(time.sleep, 0.06)
+                loop.run_until_complete(slow())
+                time.sleep(0.1)  # other loop works
+
+            report = profiler.profile(run, file_name, slow_callback=0.05, loop=loop)
+            self.assertTrue(os.path.isfile(file_name))
+            self.assertTrue(os.path.isfile(os.path.join(temp_dir, 'profile.json')))
+            self.assertFalse(loop.get_debug())  # restored
+        finally:
+            other.call_soon_threadsafe(other.stop)
+            thread.join()
+            other.close()
+            loop.close()
+            shutil.rmtree(temp_dir)
+        self.assertIn('asyncio', report['groups'])
+        self.assertGreater(report['top'][0]['seconds'], 0)
+        self.assertEqual(len(report['slow_callbacks']), 1)
+        self.assertGreaterEqual(report['slow_callbacks'][0]['seconds'], 0.05)
+
+
+class TestBench(AsyncTestCase):
+
+    async def test_bench_parser(self):
+        reports = await bench.bench_parser(concurrency=(5,), latency=0, jitter=0, pages=1, listings=1, items=10)
+        self.assertEqual([report['function'] for report in reports],
+                         ['parse_main', 'parse_details', 'parse_price', 'parse_available'])
+        for report in reports:
+            # 2 requests of parse_main: the last page, than its repeat
+            self.assertEqual(report['requests'], 2 if report['function'] == 'parse_main' else 10)
+            self.assertGreater(report['pages_per_sec'], 0)
+        self.assertIsNone(Parser.host)
+
+    def test_generate_db_and_bench_sync(self):
+        temp_dir = tempfile.mkdtemp()
+        db_file = os.path.join(temp_dir, 'bench.sqlite3')
+        try:
+            count = bench.generate_db(db_file, products=20, years=0.1, churn=0.5)
+            self.assertEqual(count['products'], 20)
+            self.assertGreater(count['prices'], 20)
+            reports = bench.bench_sync(db_file, pages=1)
+            self.assertEqual([report['phase'] for report in reports],
+                             ['update_products_table', 'update_prices_table', 'update_instock_table', 'export_csv',
+                              'export_json', 'export_xml'])
+            self.assertGreater(reports[1]['requests'], 0)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_startup_imports(self):
+        reports = {report['command']: report for report in bench.bench_startup(('products', 'csv'), repeat=1)}
+        self.assertNotIn('aiohttp', reports['csv']['modules'])
+        self.assertNotIn('asyncio', reports['csv']['modules'])
+        self.assertIn('aiohttp', reports['products']['modules'])
+        self.assertGreater(reports['csv']['min_sec'], 0)
+
+
+class TestMainMock(TestCase):
+    """
+    Main sync of the synthetic database (see bench.generate_db()) with the local mock of www.kant.ru
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.temp_dir, 'bench.sqlite3')
+        bench.generate_db(self.db_file, products=30, years=0.1, dead=0.5)
+        self.timeout, parser.TIMEOUT = parser.TIMEOUT, 0
+        self.server = MockKant(pages=1).start_thread()
+        Parser.host = self.server.host
+        self.page = Main(db_name=self.db_file)
+        self.page.db.migrate()  # tables of this project, as by the first sync
+
+    def tearDown(self):
+        self.server.stop_thread()
+        Parser.host = None
+        parser.TIMEOUT = self.timeout
+        self.page.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_instock_not_instock_probe(self):
+        db = self.page.db
+        dead = [code for code, in db.cur.execute("SELECT code FROM products WHERE rating = 0;").fetchall()]
+        self.assertTrue(0 < len(dead) < 30)
+        sql = "SELECT COUNT(*) FROM instock_nagornaya WHERE code_id IN ({});".format(','.join(map(str, dead)))
+        rows = db.cur.execute(sql).fetchone()[0]
+
+        requests = self.server.requests
+        self.assertTrue(self.page.update_instock_table(not_instock=False))
+        self.assertEqual(self.server.requests - requests, 30 - len(dead))
+        self.assertEqual(db.cur.execute(sql).fetchone()[0], rows)  # skipped items are not changed
+
+        requests = self.server.requests
+        self.assertTrue(self.page.update_instock_table(not_instock=True))
+        self.assertEqual(self.server.requests - requests, 30)
+        self.assertEqual(db.get_state('instock_runs'), '2')
+
+    def test_migrate_sizes(self):
+        # EUR sizes of the chart, written as is before sizes.py, are converted once, other sizes are kept
+        db = self.page.db
+        code = db.cur.execute("SELECT code FROM products WHERE brand = 'Asics';").fetchone()[0]
+        rows = [(code, 39.5, 1, '2021-01-01 00:00:00', 0), (code, 49, 1, '2021-01-01 00:00:00', 0),
+                (code, 45.5, 1, '2021-01-01 00:00:00', 0)]
+        db.cur.executemany("INSERT INTO instock_nagornaya (code_id, size, count, timestamp, rating) "
+                           "VALUES (?,?,?,?,?);", rows)
+        db.cur.execute("DELETE FROM state WHERE key = 'sizes_version';")
+        db.conn.commit()
+        sql = "SELECT size FROM instock_nagornaya WHERE code_id = ? AND timestamp = '2021-01-01 00:00:00';"
+        db.migrate_sizes()
+        self.assertEqual(sorted(size for size, in db.cur.execute(sql, (code,)).fetchall()), [6.5, 14, 45.5])
+        self.assertEqual(db.get_state('sizes_version'), '1')
+
+    def test_sharded(self):
+        metrics.reset()
+        page = ShardedMain(workers=3, rate=1000, db_name=self.db_file)
+        try:
+            requests = self.server.requests
+            self.assertTrue(page.update_prices_table())
+            self.assertTrue(page.update_instock_table(not_instock=True))
+            self.assertEqual(self.server.requests - requests, 60)
+        finally:
+            page.close()
+        self.assertEqual(metrics.totals['requests'], 60)  # counters of workers
+
+        # the same data as by one process: nothing to update
+        rows = {table: self.page.db.cur.execute("SELECT COUNT(*) FROM {};".format(table)).fetchone()[0]
+                for table in ('prices', 'instock_nagornaya', 'instock_altufevo')}
+        self.assertTrue(self.page.update_prices_table())
+        self.assertTrue(self.page.update_instock_table(not_instock=True))
+        self.assertEqual({table: self.page.db.cur.execute("SELECT COUNT(*) FROM {};".format(table)).fetchone()[0]
+                          for table in rows}, rows)
+
+    def test_queued_sync(self):
+        poll, workqueue.QUEUE_POLL = workqueue.QUEUE_POLL, 0.01
+        queue = os.path.join(self.temp_dir, 'queue.sqlite3')
+        stop = threading.Event()
+        workers = [threading.Thread(target=workqueue.work, args=(queue, 'worker{}'.format(i)), kwargs={'stop': stop})
+                   for i in range(2)]
+        for worker in workers:
+            worker.start()
+        backend = SQLiteQueue(queue)  # any Queue backend
+        page = QueuedMain(backend, db_name=self.db_file)
+        try:
+            page._parser.task_size = 7
+            requests = self.server.requests
+            self.assertTrue(page.update_prices_table())
+            self.assertTrue(page.update_instock_table(not_instock=True))
+            self.assertEqual(self.server.requests - requests, 60)
+        finally:
+            page.close()
+            backend.close()
+            stop.set()
+            for worker in workers:
+                worker.join()
+            workqueue.QUEUE_POLL = poll
+
+        # the same data as by Parser: nothing to update
+        rows = self.page.db.cur.execute("SELECT COUNT(*) FROM prices;").fetchone()[0]
+        self.assertTrue(self.page.update_prices_table())
+        self.assertEqual(self.page.db.cur.execute("SELECT COUNT(*) FROM prices;").fetchone()[0], rows)
+
+    def test_queue_at_least_once(self):
+        queue = SQLiteQueue(os.path.join(self.temp_dir, 'queue.sqlite3'))
+        try:
+            ids = queue.put('parse_price', [[[[1, 'url1'], [2, 'url2']]], [[[3, 'url3']]]], '2030-01-01 10:00:00')
+            task = queue.lease('a', seconds=0)  # lease is expired at once: worker 'a' is lost
+            self.assertEqual(queue.lease('b'), task)  # the same task to other worker
+            for worker in ('a', 'b'):  # both report
+                queue.done(task[0], worker, 'parse_price', [('1', '[1, 100]'), ('2', '[2, 200]')])
+            self.assertEqual(queue.results(ids)[1:], (1, 0))  # the second task is not finished
+            task = queue.lease('b')
+            queue.release(task[0], 'b')  # failed, to the next attempt
+            self.assertEqual(queue.lease('c')[0], task[0])
+            queue.done(task[0], 'c', 'parse_price', [('3', '[3, 300]')])
+            results, waiting, failed = queue.results(ids)
+            self.assertEqual([workqueue.decode(method, value) for method, key, value in results],
+                             [(1, 100), (2, 200), (3, 300)])
+            self.assertIsNone(queue.lease('c'))
+        finally:
+            queue.close()
+
+    def test_queue_items_once(self):
+        # item of two tasks (or of two reports of one task) is once in the result: rows are written once by the run
+        poll, workqueue.QUEUE_POLL = workqueue.QUEUE_POLL, 0.01
+        queue = os.path.join(self.temp_dir, 'queue.sqlite3')
+        stop = threading.Event()
+        worker = threading.Thread(target=workqueue.work, args=(queue, 'worker'), kwargs={'stop': stop})
+        worker.start()
+        queued = QueuedParser(queue, task_size=1)
+        loop = asyncio.new_event_loop()
+        try:
+            code, url = self.page.db.get_products_code_url()[0]
+            prices = loop.run_until_complete(queued.parse_price([(code, url), (code, url)]))
+            self.assertEqual([price[0] for price in prices], [code])
+        finally:
+            loop.close()
+            queued.close()
+            stop.set()
+            worker.join()
+            workqueue.QUEUE_POLL = poll
+
+    def test_queue_publishers(self):
+        # two publishers of the same items at the same second: each gets its own results after clean of the other
+        queue = SQLiteQueue(os.path.join(self.temp_dir, 'queue.sqlite3'))
+        try:
+            first = queue.put('parse_price', [[[[1, 'url1']]]], '2030-01-01 10:00:00')
+            second = queue.put('parse_price', [[[[1, 'url1']]]], '2030-01-01 10:00:00')
+            for price in (100, 200):
+                task = queue.lease('a')
+                queue.done(task[0], 'a', 'parse_price', [('1', '[1, {}]'.format(price))])
+            queue.clean(first)
+            results, waiting, failed = queue.results(second)
+            self.assertEqual([workqueue.decode(method, value) for method, key, value in results], [(1, 200)])
+        finally:
+            queue.close()
+        self.assertRaises(TypeError, workqueue.Queue)  # backend interface only
+
+    def test_rate_limiter(self):
+        async def requests(count):
+            for _ in range(count):
+                await limiter.wait()
+
+        limiter = RateLimiter(rate=100)
+        loop = asyncio.new_event_loop()  # not to close event loop of Main
+        start = time.time()
+        loop.run_until_complete(requests(11))
+        loop.close()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+        with self.assertRaises(ValueError):
+            RateLimiter(rate=0)
+
+    def test_scheduler(self):
+        scheduler = Scheduler(self.page.db, 'prices', min_hours=1, max_hours=72, checks=2)
+        self.assertEqual(scheduler.interval(0, 1000), 72)
+        self.assertEqual(scheduler.interval(10, 100), 5)
+        self.assertEqual(scheduler.interval(100, 10), 1)
+        with self.assertRaises(ValueError):
+            Scheduler(self.page.db, 'products')
+
+        codes = [code for code, url in self.page.db.get_products_code_url()]
+        self.assertEqual(len(scheduler.due(codes, '2030-01-01 10:00:00')), 30)  # never checked
+        scheduler.checked(codes, '2030-01-01 10:00:00')
+        self.assertEqual(scheduler.due(codes, '2030-01-01 10:30:00'), [])
+        self.assertEqual(len(scheduler.due(codes, '2030-01-04 10:00:00')), 30)  # max staleness
+        self.assertEqual(len(Scheduler(self.page.db, 'instock').due(codes, '2030-01-01 10:30:00')), 30)
+
+    def test_scheduled_sync(self):
+        self.page.schedule = True
+        requests = self.server.requests
+        self.assertTrue(self.page.update_prices_table())
+        self.assertEqual(self.server.requests - requests, 30)
+        self.assertTrue(self.page.update_instock_table(not_instock=True))
+        requests = self.server.requests
+        self.assertTrue(self.page.update_prices_table())  # all items are checked now
+        self.assertTrue(self.page.update_instock_table(not_instock=True))
+        self.assertEqual(self.server.requests, requests)
+
+    def test_scheduled_failed(self):
+        # items of failed requests are not checked: due to the next run, availability in database is kept
+        self.page.schedule = True
+        db = self.page.db
+        codes = [code for code, url in db.get_products_code_url()]
+        instock = [sorted(db.get_instock_last_update(shop)) for shop in SHOPS]
+        self.server.error_rate = 1.0
+        self.assertTrue(self.page.update_prices_table())
+        self.assertTrue(self.page.update_instock_table(not_instock=True))
+        self.assertEqual(len(Scheduler(db, 'prices').due(codes, time.strftime('%Y-%m-%d %H:%M:%S'))), 30)
+        self.assertEqual(len(Scheduler(db, 'instock').due(codes, time.strftime('%Y-%m-%d %H:%M:%S'))), 30)
+        self.assertEqual([sorted(db.get_instock_last_update(shop)) for shop in SHOPS], instock)
+
+    def test_cache_consistent(self):
+        self.server.churn = 0.5  # changed prices and availability
+        metrics.reset()
+        for _ in range(2):
+            self.assertTrue(self.page.update_prices_table())
+            self.assertTrue(self.page.update_instock_table(not_instock=True))
+        self.assertGreater(metrics.report()['totals']['cache_hits'], 0)
+        db = self.page.db
+        self.page.db.update_products_rating_to_0([_id for code, _id in db.get_products_code_id()][:3])
+        cached = (db.get_products_code_url(False), sorted(db.get_last_update_prices()),
+                  [sorted(db.get_instock_last_update(shop)) for shop in SHOPS])
+        db = SQLite(self.db_file)  # other connection, without cache
+        self.assertEqual(db.cache, dict())
+        self.assertEqual(cached, (db.get_products_code_url(False), sorted(db.get_last_update_prices()),
+                                  [sorted(db.get_instock_last_update(shop)) for shop in SHOPS]))
+
+    def test_brands(self):
+        self.assertEqual(brands.select(['asics', 'HOKA', 'Asics', '361']), ('Asics', 'Hoka', '361°'))
+        self.assertEqual(brands.urls(['Brooks']), ['https://www.kant.ru/brand/brooks/products/'])
+        with self.assertRaises(ValueError):
+            brands.select(['Nike'])
+
+        page = Main(db_name=self.db_file, brands=['asics', 'hoka'])
+        self.assertEqual(page.brands, ('Asics', 'Hoka'))
+        self.assertEqual(len(page.url_list), 2)
+        db = page.db
+        codes = db.get_products_code_url()
+        self.assertEqual(set(db.get_products_brand().values()), {'Asics', 'Hoka'})
+        self.assertEqual(len(codes), len(db.get_products_brand()))
+        plan = db.cur.execute("EXPLAIN QUERY PLAN SELECT code, url FROM products WHERE {};".format(db.brand_filter()),
+                              db.brands).fetchall()
+        self.assertIn('products_brand_rating', str(plan))
+
+        requests = self.server.requests
+        self.assertTrue(page.update_prices_table())  # only items of two brands
+        self.assertEqual(self.server.requests - requests, len(codes))
+        self.assertEqual({price.code for price in db.get_last_update_prices()}, {code for code, url in codes})
+
+        page.brand = 'Brooks'
+        self.assertEqual((page.brands, db.brand), (('Brooks', ), 'Brooks'))
+        page.brands = None  # all brands
+        self.assertEqual((page.url_list, db.brand), (BRANDS_URLS, None))
+
+    def test_known_products(self):
+        db = self.page.db
+        # 'url_id' column is added to database of Django schema by migrate()
+        self.assertEqual(db.exe("SELECT url_id, url FROM products ORDER BY code;"),
+                         [(url_id(url), url) for url, in db.exe("SELECT url FROM products ORDER BY code;")])
+        plan = db.exe("EXPLAIN QUERY PLAN UPDATE products SET rating = 0 WHERE url_id = 1;")
+        self.assertIn('products_url_id', str(plan))
+        instock, not_instock = db.get_known_ids()
+        self.assertEqual(instock | not_instock, {url_id(url) for url, in db.exe("SELECT url FROM products;")})
+        self.assertEqual(len(not_instock), db.exe("SELECT COUNT(*) FROM products WHERE rating = 0;")[0][0])
+
+        self.server.pages = 4
+        self.page.url_list = [BRANDS_URLS[1]]
+        self.assertTrue(self.page.update_products_table())
+        # all items of db are out of the listing, 4 pages of new items
+        instock, not_instock = db.get_known_ids()
+        self.assertEqual((len(instock), len(not_instock)), (96, 30))
+        self.assertEqual(SQLite(self.db_file).get_known_ids(), (instock, not_instock))  # from 'known' table
+
+        # 3 new items on the first page of listing sorted by new items (settings.NEW_FIRST): the second page has only
+        # known items
+        path = BRANDS_URLS[1][len('https://www.kant.ru'):]
+        new = ['https://www.kant.ru/catalog/product/{}/'.format(_id)
+               for _id in self.server.listing_ids(path, 1, new_first=True)[:3]]
+        db = SQLite(self.db_file)
+        db.exe("DELETE FROM products WHERE url IN ('{}');".format("','".join(new)))  # by other program
+        self.assertEqual(len(db.get_known_ids()[0]), 93)
+        page = Main(db_name=self.db_file)
+        page.url_list = [BRANDS_URLS[1]]
+        requests = self.server.requests
+        self.assertTrue(page.update_products_table(new_only=True))
+        self.assertEqual(self.server.requests - requests, 2 + 3)  # 2 pages and cards of new items
+        self.assertEqual(db.get_known_ids(), (instock, not_instock))  # written by other connection
+
+        # rating is changed by other program (Django project): the index is built again
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("UPDATE products SET rating = 0 WHERE url = ?;", (new[0], ))
+        conn.commit()
+        conn.close()
+        self.assertEqual(db.get_known_ids(), (instock - {url_id(new[0])}, not_instock | {url_id(new[0])}))
+        self.assertEqual(SQLite(self.db_file).get_known_ids(), db.get_known_ids())
+
+        # the site ignores the order of new items: no early stop, new items of the last page are found
+        self.server.sort = False
+        db.exe("DELETE FROM products WHERE url IN ('{}');".format("','".join(new)))
+        requests = self.server.requests
+        self.assertTrue(page.update_products_table(new_only=True))
+        self.assertEqual(self.server.requests - requests, 6 + 3)  # all 4 pages, by chunks of 2, and 3 new cards
+        self.assertEqual(db.get_known_ids(), (instock, not_instock))
+
+    def test_listing_prices(self):
+        self.page.url_list = [BRANDS_URLS[1]]
+        self.assertTrue(self.page.update_products_table())  # 24 new items of the listing
+        requests = self.server.requests
+        self.assertTrue(self.page.update_prices_table())  # by product pages: new items, items of db out of listing
+        self.assertEqual(self.server.requests - requests, 24 + 30)
+        self.assertEqual(self.page.tiles, dict())
+
+        metrics.reset()
+        requests = self.server.requests
+        self.assertTrue(self.page.update_prices_table())  # 20 pages of listing (settings.CHUNK), items out of listing
+        self.assertEqual(self.server.requests - requests, 20 + 30)
+        self.assertEqual(metrics.totals['listing_hits'], 24)
+
+        db = self.page.db
+        codes = [_id - ID_OFFSET for _id in self.server.listing_ids(BRANDS_URLS[1][len('https://www.kant.ru'):], 1)[:2]]
+        db.to_prices([PriceObservation(code, 1, '2021-01-01 00:00:00', 2) for code in codes])  # other price in db
+        requests = self.server.requests
+        self.assertTrue(self.page.update_prices_table())
+        self.assertEqual(self.server.requests - requests, 20 + 30 + 2)
+        prices = {price.code: price for price in db.get_last_update_prices()}
+        self.assertEqual([prices[code].rating for code in codes], [3, 3])
+
+    def test_listing_threshold(self):
+        self.page.url_list = [BRANDS_URLS[1]]
+        self.assertTrue(self.page.update_products_table())
+        self.assertTrue(self.page.update_prices_table())  # 54 items in stock: 24 of the listing and 30 out of it
+
+        self.page.url_list = BRANDS_URLS[1:4]
+        self.page.max_pagination = 18
+        self.assertEqual(self.page.listing_pages(), 54)
+        requests = self.server.requests
+        self.assertTrue(self.page.update_prices_table())  # not less requests of listing: product pages only
+        self.assertEqual(self.server.requests - requests, 54)
+
+        self.page.max_pagination = 17
+        metrics.reset()
+        requests = self.server.requests
+        self.assertTrue(self.page.update_prices_table())  # 51 pages of listing, items out of listing
+        self.assertEqual(self.server.requests - requests, 51 + 30)
+        self.assertEqual(metrics.totals['listing_hits'], 24)
+
+    def test_rows_count(self):
+        db = self.page.db
+        codes = [code for code, url in db.get_products_code_url()[:3]]
+        metrics.reset()
+        self.assertEqual(db.to_prices([PriceObservation(code, 1, '2030-01-01 00:00:00', 99) for code in codes]), 3)
+        self.assertEqual(db.to_instock(SHOPS[0], [StockObservation(codes[0], size, 1, '2030-01-01 00:00:00', 99)
+                                                  for size in (9.0, 9.5)]), 2)
+        self.assertEqual(metrics.totals['rows'], 5)  # not rows of 'state' table (see SQLite.changed())
+
+    def test_price_pages(self):
+        db = self.page.db
+        self.page.pages = pages = PageArchive(os.path.join(self.temp_dir, 'pages'), retention_days=30)
+        code = db.get_products_code_url()[0][0]
+        last = {price.code: price for price in db.get_last_update_prices()}[code]
+        db.to_prices([PriceObservation(code, 1, '2021-01-01 00:00:00', last.rating + 1)])  # other price in db
+        self.page.url_list = [BRANDS_URLS[1]]
+        try:
+            self.assertTrue(self.page.update_products_table())  # new items of the listing
+            self.assertTrue(self.page.update_prices_table())
+            # the card page of new item by its row of 'products'
+            _id, timestamp = db.exe("SELECT url_id, timestamp FROM products ORDER BY timestamp DESC;")[0]
+            self.assertIn('/catalog/product/{}/'.format(_id), pages.get(_id, timestamp))
+
+            self.page.pages = None  # archive is stopped
+            self.assertTrue(self.page.update_prices_table())
+            self.assertIsNone(Parser.pages)
+        finally:
+            Parser.pages = None
+        price = {price.code: price for price in db.get_last_update_prices()}[code]
+        self.assertEqual(price.rating, last.rating + 2)
+        self.page.pages = pages
+        ids = dict(db.get_products_code_id())
+        html = self.page.price_page(price, ids)  # the page of the new row
+        self.assertIn('{:,}'.format(price.price).replace(',', ' '), html)
+        self.assertIsNone(self.page.price_page(price._replace(timestamp='2021-01-01 00:00:00')))
+
+        pages.stamp = '2021-01-01 00:00:00'
+        pages.put('https://www.kant.ru/catalog/product/3000005/', html)
+        self.assertEqual(pages.get(3000005, pages.stamp), html)
+        self.assertEqual(pages.prune('2021-01-31 00:00:00'), [])
+        self.assertEqual(pages.prune('2021-02-01 00:00:00'), ['2021-01-01'])  # older than 30 days
+        self.assertIsNone(pages.get(3000005, '2021-01-01 00:00:00'))
+        self.assertEqual(self.page.price_page(price), html)  # segment of the current day
+
+    def test_export_columnar(self):
+        directory = os.path.join(self.temp_dir, 'columnar')
+        self.assertTrue(self.page.export('npz', directory))
+        tables = columnar.load(directory)
+        db = self.page.db
+        self.assertEqual(len(tables['products']['code']), 30)
+        self.assertEqual(len(tables['prices']['code']), 30)
+        self.assertEqual(len(tables['prices_history']['price']), db.exe("SELECT COUNT(*) FROM prices;")[0][0])
+        self.assertEqual(tables['prices_history']['timestamp'].dtype, np.dtype('datetime64[s]'))
+        self.assertEqual(set(tables['instock_history']['shop']), set(SHOPS))
+        last = db.get_last_update_prices()
+        self.assertEqual(dict(zip(tables['prices']['code'].tolist(), tables['prices']['price'].tolist())),
+                         {price.code: price.price for price in last})
+        if columnar.pyarrow is None:  # without pyarrow, parquet is written as npz
+            self.assertEqual(columnar.export(db, directory, 'parquet', size=7)['format'], 'npz')
+            self.assertEqual(len(columnar.load(directory)['products']['code']), 30)
+
+    def test_serve(self):
+        cycles = self.page.serve(interval=0, cycles=2)
+        self.assertEqual(cycles, 2)
+        self.assertIsNone(Parser.session)
+        # the second cycle: 'products' table is not due, all prices and availability are checked just now
+        self.assertEqual(metrics.report()['totals']['requests'], 0)
+        self.assertGreater(metrics.report()['totals']['cache_hits'], 0)
+
+    def test_serve_sigterm(self):
+        update = self.page.update_prices_table
+
+        def update_and_stop():
+            os.kill(os.getpid(), signal.SIGTERM)
+            return update()
+
+        self.page.update_prices_table = update_and_stop
+        self.assertEqual(self.page.serve(interval=60), 1)  # the cycle is finished without pause
+
+
+class TestAnalytics(TestCase):
+
+    def test_price_stats(self):
+        history = {'code': np.array([1, 1, 1, 2]), 'price': np.array([100, 80, 90, 50]),
+                   'timestamp': np.array(['2021-09-01 10:00:00', '2021-10-02 10:00:00', '2021-10-09 10:00:00',
+                                          '2021-10-05 10:00:00'], dtype='datetime64[s]')}
+        stats = analytics.price_stats(history, now='2021-10-10 10:00:00', window=7)
+        self.assertEqual(stats['code'].tolist(), [1, 2])
+        self.assertEqual(stats['latest'].tolist(), [90, 50])
+        self.assertEqual(stats['previous'][0], 80)
+        self.assertTrue(np.isnan(stats['previous'][1]))
+        self.assertAlmostEqual(stats['change'][0], 12.5)
+        self.assertEqual((stats['min'][0], stats['max'][0]), (80, 90))  # 80 is actual at the start of window
+        self.assertEqual(analytics.price_drops(analytics.price_stats(history, window=7), percent=10).tolist(), [])
+
+    def test_same_as_python(self):
+        temp_dir = tempfile.mkdtemp()
+        db_file = os.path.join(temp_dir, 'bench.sqlite3')
+        try:
+            bench.generate_db(db_file, products=50, years=0.5, churn=0.1)
+            db = SQLite(db_file)
+            now = '2030-01-01 10:00:00'
+            stats = analytics.price_stats(analytics.load(db, 'prices_history'), now, window=3650)
+            python = analytics.price_stats_python(db.get_prices_history(), now, window=3650)
+            self.assertEqual(set(stats['code'].tolist()), set(python))
+            for i, code in enumerate(stats['code'].tolist()):
+                latest, previous, change, low, high = python[code]
+                self.assertEqual((stats['latest'][i], stats['min'][i], stats['max'][i]), (latest, low, high))
+                if change is not None:
+                    self.assertAlmostEqual(stats['change'][i], change)
+
+            days = analytics.days_in_stock(analytics.load(db, 'instock_history'), '2021-01-01 00:00:00', window=3650)
+            python = analytics.days_in_stock_python({shop: db.get_instock_history(shop) for shop in SHOPS},
+                                                    '2021-01-01 00:00:00', window=3650)
+            self.assertEqual(len(days['days']), len(python))
+            for code, shop, size, value in zip(days['code'].tolist(), days['shop'].tolist(), days['size'].tolist(),
+                                               days['days'].tolist()):
+                self.assertAlmostEqual(value, python[(code, shop, size)])
+        finally:
+            db.close()
+            shutil.rmtree(temp_dir)
+
+
+class TestApi(AsyncTestCase):
+    """
+    api.Api with the synthetic database (see bench.generate_db()), without network
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.temp_dir, 'bench.sqlite3')
+        bench.generate_db(db_file, products=20, years=0.1)
+        self.api = Api(db_file)
+
+    def tearDown(self):
+        self.api.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    async def test_api(self):
+        # connect of api only reads: tables of this project are created by the first sync
+        self.assertEqual(self.api.db.exe("SELECT name FROM sqlite_master WHERE name = 'state';"), [])
+        code = self.api.db.get_last_update_prices()[0].code
+        async with TestClient(TestServer(self.api.app())) as client:
+            response = await client.get('/prices/{}'.format(code))
+            self.assertEqual(response.status, 200)
+            price = await response.json()
+            self.assertEqual(price['code'], code)
+            etag = response.headers['ETag']
+
+            response = await client.get('/prices/{}'.format(code), headers={'If-None-Match': etag})
+            self.assertEqual(response.status, 304)
+
+            self.api.db.to_prices([PriceObservation(code, price['price'] + 10, '2030-01-01 10:00:00',
+                                                    price['rating'] + 1)])  # new version of data
+            response = await client.get('/prices/{}'.format(code), headers={'If-None-Match': etag})
+            self.assertEqual(response.status, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            self.assertEqual((await response.json())['price'], price['price'] + 10)
+
+            cards = await (await client.get('/cards', params={'brand': 'Asics'})).json()
+            self.assertTrue(cards)
+            self.assertEqual({card['brand'] for card in cards}, {'Asics'})
+            self.assertIsNone(self.api.db.brand)
+            default = Api()
+            self.assertIsNot(default.db, SQLite())  # own connection to the default database
+            default.db.close()
+            self.assertEqual((await client.get('/cards/1')).status, 404)
+            self.assertIsInstance(await (await client.get('/available/{}'.format(code))).json(), dict)
+
+
 # True start main parsing class.
 # Run after filling 'products' table from test_update_products() and test_update_prices() or uncomment these cases
 @skipIf(SKIP, 'skip main page parsing')
 class TestMain(TestCase):
 
+    def setUp(self):
+        # sync writes to the temporary copy, not to the database file of the repository
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.temp_dir, 'db.sqlite3')
+        shutil.copy(os.path.join(Path(__file__).resolve().parent, 'db.sqlite3'), self.db_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
     def test_update_products(self):
-        main_page = Main('On')
+        main_page = Main('On', db_name=self.db_file)
         solution = main_page.update_products_table()
         self.assertTrue(solution)
 
     def test_update_prices(self):
-        main_page = Main('Brooks')
+        main_page = Main('Brooks', db_name=self.db_file)
         # uncomment the lines below if 'products' table is empty (if this brand does not exist)
         # solution = main_page.update_prices_table()
         # self.assertTrue(solution)
@@ -197,7 +1077,7 @@ class TestMain(TestCase):
         self.assertTrue(solution)
 
     def test_update_instock(self):
-        main_page = Main('Saucony')
+        main_page = Main('Saucony', db_name=self.db_file)
         # uncomment the lines below if 'products' table is empty (if this brand does not exist)
         # solution = main_page.update_instock_table()
         # self.assertTrue(solution)
@@ -301,6 +1181,93 @@ class TestDb(TestCase):
                     self.assertTrue(0 < count < 20)
 
 
+class TestDbHistory(TestCase):
+    """
+    Test point- in- time (as- of) and history queries on the temporary copy of the database
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        db_file = os.path.join(self.temp_dir, 'db.sqlite3')
+        shutil.copy(os.path.join(Path(__file__).resolve().parent, 'db.sqlite3'), db_file)
+        self.db = SQLite(db_file)
+        self.db.cur.executemany("INSERT INTO prices (code_id, price, timestamp, rating) VALUES (?,?,?,?);", [
+            (1000001, 9000, '2021-10-01 10:00:00', 1), (1000001, 8000, '2021-10-05 10:00:00', 2),
+            (1000001, 7000, '2021-10-09 10:00:00', 3), (1000002, 5000, '2021-10-06 12:00:00', 1)])
+        self.db.cur.executemany("INSERT INTO instock_nagornaya (code_id, size, count, timestamp, rating) "
+                                "VALUES (?,?,?,?,?);", [
+            (1000001, 9.5, 2, '2021-10-01 10:00:00', 1), (1000001, 10, 1, '2021-10-01 10:00:00', 1),
+            (1000001, 9.5, 0, '2021-10-05 10:00:00', 2)])
+        self.db.conn.commit()
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_separate_instance(self):
+        default = SQLite()
+        self.assertIsNot(self.db, default)  # other file doesn't switch holders of the default database
+        self.assertEqual(default.db, os.path.join(Path(__file__).resolve().parent, 'db.sqlite3'))
+        self.assertEqual(self.db.exe("SELECT COUNT(*) FROM prices WHERE code_id = 1000001;"), [(3,)])
+
+    def test_unmigrated_writers(self):
+        # writers of the shipped database, without sync of main.Main: tables of this project by the first write
+        self.assertIsNone(self.db.get_state('version'))
+        self.assertEqual(self.db.to_prices([PriceObservation(1000002, 4000, '2021-10-07 12:00:00', 2)]), 1)
+        self.assertIsNotNone(self.db.get_state('version'))
+        self.assertEqual(self.db.to_instock(SHOPS[0], [StockObservation(1000001, 10, 0, '2021-10-07 12:00:00', 2)]),
+                         1)
+        db_file = os.path.join(self.temp_dir, 'known.sqlite3')
+        shutil.copy(os.path.join(Path(__file__).resolve().parent, 'db.sqlite3'), db_file)
+        db = SQLite(db_file)
+        try:
+            self.assertEqual(db.get_known_ids(), (set(), set()))
+            url = 'https://www.kant.ru/catalog/product/3052137/'
+            self.assertEqual(db.to_products([(1000003, 'Asics', 'gel-model', url, '', 'adult', 'male', 2021, 'road',
+                                              'neutral', 'A1', 'summer', 1, '2021-10-07 12:00:00')]), 1)
+            self.assertEqual(db.get_known_ids(), ({3052137}, set()))
+            db.update_products_rating_to_0([3052137])
+            self.assertEqual(db.get_known_ids(), (set(), {3052137}))
+        finally:
+            db.close()
+
+    def test_prices_as_of(self):
+        self.assertEqual(self.db.get_prices_as_of('2021-10-05'),
+                         [(1000001, 8000, '2021-10-05 10:00:00', 2)])
+        self.assertEqual(len(self.db.get_prices_as_of('2021-10-10')), 2)
+        self.assertEqual(self.db.get_prices_as_of('2021-10-10', codes=[1000002]),
+                         [(1000002, 5000, '2021-10-06 12:00:00', 1)])
+        self.assertEqual(self.db.get_prices_as_of('2021-09-30'), list())
+        self.assertIsInstance(self.db.get_prices_as_of('2021-10-10')[0], PriceObservation)
+
+    def test_instock_as_of(self):
+        solution = {(size, count) for code, size, count, _time, rate in
+                    self.db.get_instock_as_of(SHOPS[0], '2021-10-04 00:00:00')}
+        self.assertEqual(solution, {(9.5, 2), (10, 1)})
+        solution = {(size, count) for code, size, count, _time, rate in
+                    self.db.get_instock_as_of(SHOPS[0], '2021-10-06')}
+        self.assertEqual(solution, {(9.5, 0), (10, 1)})
+        solution = self.db.get_instock_last_update(SHOPS[0])
+        self.assertTrue(all(isinstance(item, StockObservation) and type(item.size) is float for item in solution))
+
+    def test_compact(self):
+        self.db.cur.execute("INSERT INTO prices (code_id, price, timestamp, rating) VALUES (?,?,?,?);",
+                            (1000001, 7500, '2021-10-09 18:00:00', 4))
+        self.db.conn.commit()
+        report = self.db.compact(retention_days=0)
+        self.assertEqual(report['prices'], 1)  # the same day price of 1000001
+        self.assertEqual(report['instock_nagornaya'], 0)
+        self.assertIn('bytes', report)
+        self.assertEqual(self.db.get_prices_as_of('2021-10-10', codes=[1000001]),
+                         [(1000001, 7500, '2021-10-09 18:00:00', 4)])  # actual state
+
+    def test_history(self):
+        history = self.db.get_prices_history()
+        self.assertEqual([price for _time, price, rate in history[1000001]], [9000, 8000, 7000])
+        instock = self.db.get_instock_history(SHOPS[0], codes=[1000001])
+        self.assertEqual([count for _time, count, rate in instock[1000001][9.5]], [2, 0])
+
+
 @skipIf(SKIP, 'skip test db')
 class TestExport(TestCase):
     """
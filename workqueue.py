@@ -0,0 +1,388 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+from abc import ABC, abstractmethod
+
+from main import Main
+from metrics import metrics
+from records import Product, Tile
+from settings import DEBUG, QUEUE_DB, QUEUE_TASK_SIZE, QUEUE_LEASE, QUEUE_ATTEMPTS, QUEUE_POLL, QUEUE_WAIT
+
+# tasks of Parser methods, published by QueuedParser; results of each item: by its task and key (code, or id of url of
+# item of parse_main()), so the second report of the same task (after expired lease) replaces the first, and results
+# of publishers of the same items at the same time are not mixed
+QUEUE_SCHEMA = ['CREATE TABLE IF NOT EXISTS "tasks" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, '
+                '"method" text NOT NULL, "args" text NOT NULL, "timestamp" text NOT NULL, "state" text NOT NULL, '
+                '"worker" text, "lease_until" real NOT NULL DEFAULT 0, "attempts" integer NOT NULL DEFAULT 0);',
+                'CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_until);',
+                'CREATE TABLE IF NOT EXISTS "results" ("task" integer NOT NULL, "key" text NOT NULL, '
+                '"method" text NOT NULL, "value" text NOT NULL, PRIMARY KEY (task, key));']
+
+
+def encode(method: str, item) -> tuple:
+    """
+    Key and json value of item of Parser.<method>() result
+    """
+
+    if method == 'parse_details':
+        return str(item.code), json.dumps(list(item), ensure_ascii=False)
+    return str(item[0]), json.dumps(item, ensure_ascii=False)  # Tile, (code, price), (code, {shop: sizes})
+
+
+def decode(method: str, value: str):
+    """
+    Item of Parser.<method>() result by its json value
+    """
+
+    item = json.loads(value)
+    if method == 'parse_main':
+        return Tile(*item)
+    if method == 'parse_details':
+        return Product(*item)
+    if method == 'parse_available':
+        code, instock = item
+        return code, {shop: [tuple(size) for size in sizes] for shop, sizes in instock.items()}
+    if method == 'parse_price':
+        return tuple(item)
+    return item
+
+
+def arguments(method: str, args: str) -> tuple:
+    """
+    Arguments of Parser.<method>() by json of the task
+    """
+
+    args = json.loads(args)
+    if method == 'parse_price':
+        return [tuple(item) for item in args[0]],
+    if method == 'parse_available':
+        return [tuple(item) for item in args[0]], {int(code): brand for code, brand in args[1].items()}
+    return tuple(args)
+
+
+class Queue(ABC):
+    """
+    Work queue of Parser tasks between QueuedMain (publishes tasks, waits results and writes to database) and any count
+    of workers on any hosts (lease tasks, call Parser and report results), see work(). Delivery is at least once: not
+    reported task is leased again after its lease, results are written by (task, key) to be the same after the second
+    report. Backend interface, see SQLiteQueue
+    """
+
+    @abstractmethod
+    def put(self, method: str, tasks: list, timestamp: str) -> list:
+        """
+        Publish tasks: [args of Parser.<method>(), ...]
+        return ids of tasks
+        """
+
+        pass
+
+    @abstractmethod
+    def lease(self, worker: str, seconds=QUEUE_LEASE):
+        """
+        Take the next task for 'seconds'
+        return (id, method, args, timestamp) or None, if queue is empty
+        """
+
+        pass
+
+    @abstractmethod
+    def done(self, task: int, worker: str, method: str, results: list):
+        """
+        Report results of task: [(key, json value), ...] (see encode())
+        """
+
+        pass
+
+    @abstractmethod
+    def release(self, task: int, worker: str):
+        """
+        Return failed task to the queue, or set it failed after settings.QUEUE_ATTEMPTS attempts
+        """
+
+        pass
+
+    @abstractmethod
+    def results(self, tasks: list) -> tuple:
+        """
+        Results of tasks, if all tasks are finished
+        return [(method, key, json value), ...], count of not finished tasks, count of failed tasks
+        """
+
+        pass
+
+    @abstractmethod
+    def clean(self, tasks: list):
+        """
+        Delete finished tasks and its results
+        """
+
+        pass
+
+    @abstractmethod
+    def close(self):
+        """
+        Close connection to the backend
+        """
+
+        pass
+
+
+class SQLiteQueue(Queue):
+    """
+    Work queue in SQLite database file (settings.QUEUE_DB), common to all processes of one host or of network file
+    system
+    """
+
+    def __init__(self, file_name=None):
+
+        self.file_name = file_name or QUEUE_DB
+        self.conn = sqlite3.connect(self.file_name, timeout=60, isolation_level=None)  # transactions are explicit
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(results);").fetchall()]
+            if 'timestamp' in columns:  # results by (method, key, timestamp) of the first version: done tasks again
+                self.conn.execute("DROP TABLE results;")
+                self.conn.execute("UPDATE tasks SET state = 'pending', lease_until = 0 WHERE state = 'done';")
+            for sql in QUEUE_SCHEMA:
+                self.conn.execute(sql)
+            self.conn.execute("COMMIT;")
+        except Exception:
+            self.conn.execute("ROLLBACK;")
+            raise
+
+    def close(self):
+
+        self.conn.close()
+
+    def put(self, method: str, tasks: list, timestamp: str) -> list:
+
+        ids = list()
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            for args in tasks:
+                cursor = self.conn.execute("INSERT INTO tasks (method, args, timestamp, state) VALUES (?,?,?,?);",
+                                           (method, json.dumps(args, ensure_ascii=False), timestamp, 'pending'))
+                ids.append(cursor.lastrowid)
+            self.conn.execute("COMMIT;")
+        except Exception:
+            self.conn.execute("ROLLBACK;")
+            raise
+        return ids
+
+    def lease(self, worker: str, seconds=QUEUE_LEASE):
+
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE;")  # the only one worker takes the task
+        try:
+            # task of broken workers (not reported in its lease) settings.QUEUE_ATTEMPTS times
+            self.conn.execute("UPDATE tasks SET state = 'failed' WHERE state = 'leased' AND lease_until < ? AND "
+                              "attempts >= ?;", (now, QUEUE_ATTEMPTS))
+            task = self.conn.execute("SELECT id, method, args, timestamp FROM tasks "
+                                     "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                                     "ORDER BY id LIMIT 1;", (now,)).fetchone()
+            if task is not None:
+                self.conn.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, "
+                                  "attempts = attempts + 1 WHERE id = ?;", (worker, now + seconds, task[0]))
+            self.conn.execute("COMMIT;")
+        except Exception:
+            self.conn.execute("ROLLBACK;")
+            raise
+        return task
+
+    def done(self, task: int, worker: str, method: str, results: list):
+
+        self.conn.execute("BEGIN IMMEDIATE;")
+        try:
+            # task may be deleted by publisher after its timeout
+            if self.conn.execute("UPDATE tasks SET state = 'done', worker = ? WHERE id = ?;", (worker, task)).rowcount:
+                self.conn.executemany("INSERT OR REPLACE INTO results (task, key, method, value) VALUES (?,?,?,?);",
+                                      [(task, key, method, value) for key, value in results])
+            self.conn.execute("COMMIT;")
+        except Exception:
+            self.conn.execute("ROLLBACK;")
+            raise
+
+    def release(self, task: int, worker: str):
+
+        self.conn.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                          "lease_until = 0 WHERE id = ? AND worker = ? AND state = 'leased';",
+                          (QUEUE_ATTEMPTS, task, worker))
+
+    def results(self, tasks: list) -> tuple:
+
+        ids = ','.join(str(int(task)) for task in tasks)
+        states = dict(self.conn.execute("SELECT state, COUNT(*) FROM tasks WHERE id IN ({}) GROUP BY state;"
+                                        .format(ids)).fetchall())
+        waiting = states.get('pending', 0) + states.get('leased', 0)
+        if waiting or states.get('failed'):
+            return list(), waiting, states.get('failed', 0)
+        return self.conn.execute("SELECT method, key, value FROM results WHERE task IN ({}) ORDER BY task, key;"
+                                 .format(ids)).fetchall(), 0, 0
+
+    def clean(self, tasks: list):
+
+        ids = ','.join(str(int(task)) for task in tasks)
+        self.conn.execute("BEGIN IMMEDIATE;")
+        self.conn.execute("DELETE FROM results WHERE task IN ({});".format(ids))
+        self.conn.execute("DELETE FROM tasks WHERE id IN ({});".format(ids))
+        self.conn.execute("COMMIT;")
+
+
+def open_queue(queue=None) -> Queue:
+    """
+    Queue backend: Queue instance as is, or SQLiteQueue of file name (settings.QUEUE_DB as default)
+    """
+
+    return queue if isinstance(queue, Queue) else SQLiteQueue(queue)
+
+
+def work(queue=None, worker=None, idle=None, stop=None) -> int:
+    """
+    Worker: lease tasks of the queue (Queue instance, or file name of SQLiteQueue, see open_queue()), call Parser and
+    report results, until the queue is empty for 'idle' seconds (None-- forever) or 'stop' event (threading.Event) is
+    set. Queue of file name is closed by the worker, Queue instance-- by its owner
+    return count of done tasks
+    """
+
+    from parser import Parser  # aiohttp and lxml.html only to work
+
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    owned = not isinstance(queue, Queue)
+    queue = open_queue(queue)
+    done = 0
+    last = time.time()
+    try:
+        while stop is None or not stop.is_set():
+            task = queue.lease(worker)
+            if task is None:
+                if idle is not None and time.time() - last >= idle:
+                    break
+                time.sleep(QUEUE_POLL)
+                continue
+            task_id, method, args, timestamp = task
+            if DEBUG:
+                print('Worker {}: task {}, {}'.format(worker, task_id, method))
+            try:
+                result = asyncio.run(getattr(Parser, method)(*arguments(method, args)))
+            except Exception as err:  # network errors, as usual: the task goes to other worker
+                if DEBUG:
+                    print('Worker {}: task {} failed: {!r}'.format(worker, task_id, err))
+                metrics.count('errors')
+                queue.release(task_id, worker)
+                continue
+            queue.done(task_id, worker, method, [encode(method, item) for item in result])
+            done += 1
+            last = time.time()
+    finally:
+        if owned:
+            queue.close()
+
+    return done
+
+
+class QueuedParser:
+    """
+    Parser, which publishes items of each parse_...() call to the queue by tasks of 'task_size' items and waits for its
+    results from workers (see work()), not longer 'wait' seconds. Not finished or failed tasks raise ConnectionError,
+    as network errors of Parser, so the run is repeated by main.py. 'queue'-- Queue backend, or file name of
+    SQLiteQueue (see open_queue())
+    """
+
+    def __init__(self, queue=None, task_size=QUEUE_TASK_SIZE, wait=QUEUE_WAIT):
+
+        self.owned = not isinstance(queue, Queue)  # queue of file name is closed by close()
+        self.queue = open_queue(queue)
+        self.task_size = task_size
+        self.wait = wait
+        self.host = None  # workers use its own Parser.host
+
+    async def run(self, method: str, items: list, args=lambda chunk: ()) -> list:
+        """
+        Publish tasks of Parser.<method>(chunk, *args(chunk)) to each chunk of items and wait for results. Each item
+        (code, or id of url) is once in the result, so rows of Main are written once by (code, timestamp of the run),
+        however many times its task was reported
+        return joined results of tasks
+        """
+
+        if not items:
+            return list()
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+        chunks = [items[i:i + self.task_size] for i in range(0, len(items), self.task_size)]
+        ids = self.queue.put(method, [[chunk] + list(args(chunk)) for chunk in chunks], timestamp)
+        start = time.time()
+        try:
+            while True:
+                results, waiting, failed = self.queue.results(ids)
+                if failed:
+                    raise ConnectionError('{} of {} tasks of {} failed'.format(failed, len(ids), method))
+                if not waiting:
+                    break
+                if time.time() - start >= self.wait:
+                    raise ConnectionError('{} of {} tasks of {} are not finished in {} sec'.format(
+                        waiting, len(ids), method, self.wait))
+                await asyncio.sleep(QUEUE_POLL)
+        finally:
+            self.queue.clean(ids)
+        unique = dict()  # by key of item, in order of tasks
+        for result_method, key, value in results:
+            unique.setdefault(key, (result_method, value))
+        return [decode(result_method, value) for result_method, value in unique.values()]
+
+    def close(self):
+
+        if self.owned:
+            self.queue.close()
+
+    async def open_session(self):
+        # workers use its own sessions
+        pass
+
+    async def close_session(self):
+        pass
+
+    @metrics.measure
+    async def parse_main(self, urls: list, finish: int, known=None) -> list:
+
+        known = sorted(known) if known is not None else None  # to json
+        return await self.run('parse_main', urls, lambda chunk: (finish, known))
+
+    @metrics.measure
+    async def parse_details(self, urls: list, timestamp=None) -> list:
+
+        return await self.run('parse_details', urls, lambda chunk: (timestamp, ))
+
+    @metrics.measure
+    async def parse_price(self, codes_urls: list) -> list:
+
+        return await self.run('parse_price', codes_urls)
+
+    @metrics.measure
+    async def parse_available(self, codes: list, brands=None) -> list:
+
+        brands = brands or dict()
+        return await self.run('parse_available', codes,
+                              lambda chunk: ({code: brands.get(code) for code, instock_code in chunk}, ))
+
+
+class QueuedMain(Main):
+    """
+    Main, which parses www.kant.ru by workers of the queue on any hosts (see work()) and writes to database by this
+    process.
+    Use:
+        ./main.py worker --queue=/mnt/kant/queue.sqlite3   # on each host, any count
+        ./main.py prices instock --queue=/mnt/kant/queue.sqlite3
+    """
+
+    def __init__(self, queue=None, **kwargs):
+
+        super().__init__(**kwargs)
+        self._parser = QueuedParser(queue)
+
+    def close(self):
+
+        self._parser.close()